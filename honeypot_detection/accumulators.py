@@ -0,0 +1,171 @@
+import math
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles with bounded memory (logarithmic buckets like DDSketch).
+    Every estimated quantile is within the relative accuracy of the real value.
+    Sketches with the same relative accuracy can be merged (e.g. from chunks or shards).
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.count = 0
+        self.zero_count = 0
+        # bucket counts by bucket key (separated by sign)
+        self.positive_counts = {}
+        self.negative_counts = {}
+
+    def add(self, value):
+        self.count += 1
+
+        if value > 0:
+            key = self._key(value)
+            self.positive_counts[key] = self.positive_counts.get(key, 0) + 1
+        elif value < 0:
+            key = self._key(-value)
+            self.negative_counts[key] = self.negative_counts.get(key, 0) + 1
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise Exception("Cannot merge sketches with different relative accuracy.")
+
+        self.count += other.count
+        self.zero_count += other.zero_count
+
+        for key, count in other.positive_counts.items():
+            self.positive_counts[key] = self.positive_counts.get(key, 0) + count
+
+        for key, count in other.negative_counts.items():
+            self.negative_counts[key] = self.negative_counts.get(key, 0) + count
+
+    def quantile(self, q):
+        """
+        :param q: between 0 and 1
+        :return: approximated quantile or None if there are no values
+        """
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+
+        # from the most negative to the most positive value
+        seen = 0
+        for key in sorted(self.negative_counts.keys(), reverse=True):
+            seen += self.negative_counts[key]
+            if seen > rank:
+                return -self._value(key)
+
+        seen += self.zero_count
+        if seen > rank:
+            return 0
+
+        for key in sorted(self.positive_counts.keys()):
+            seen += self.positive_counts[key]
+            if seen > rank:
+                return self._value(key)
+
+        # rounding errors with q close to 1
+        return self._value(max(self.positive_counts.keys())) if len(self.positive_counts) > 0 else 0
+
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def _value(self, key):
+        # middle of the bucket in relative terms
+        return 2 * math.pow(self.gamma, key) / (self.gamma + 1)
+
+
+class StatisticsAccumulator:
+    """
+    Count, mean, standard deviation, min and max calculated one value at a time without keeping the values.
+    The mean and the variance are updated with Welford's algorithm, which is numerically stable.
+    Accumulators can be merged (e.g. from chunks or shards) with the parallel version of the same algorithm.
+    """
+
+    def __init__(self, quantiles=False, relative_accuracy=0.01):
+        """
+        :param quantiles: also keep a sketch to approximate quantiles
+        :param relative_accuracy: of the quantile sketch
+        """
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+        if quantiles:
+            self.sketch = QuantileSketch(relative_accuracy=relative_accuracy)
+        else:
+            self.sketch = None
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if self.sketch is not None:
+            self.sketch.add(value)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean
+            self.m2 = other.m2
+        else:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.count = count
+
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+
+        if self.sketch is not None:
+            if other.sketch is None:
+                raise Exception("Cannot merge an accumulator without quantiles.")
+            self.sketch.merge(other.sketch)
+
+    def variance(self):
+        """
+        :return: population variance like numpy, or None if there are no values
+        """
+        if self.count == 0:
+            return None
+        return self.m2 / self.count
+
+    def std(self):
+        """
+        :return: population standard deviation like numpy, or None if there are no values
+        """
+        if self.count == 0:
+            return None
+        return math.sqrt(self.m2 / self.count)
+
+    def quantile(self, q):
+        """
+        :param q: between 0 and 1
+        :return: approximated quantile, or None if there are no values
+        """
+        if self.sketch is None:
+            raise Exception("The accumulator does not keep quantiles.")
+        return self.sketch.quantile(q)
@@ -0,0 +1,155 @@
+import numpy as np
+
+from collections import Counter
+from decimal import Decimal
+
+from honeypot_detection.fund_flow_cases import fund_flow_case_digit, BALANCE_VALUES, BOOLEAN_VALUES,\
+    FUND_FLOW_CASE_WEIGHT_BY_FIELD
+
+
+WEI_PER_ETHER = 10 ** 18
+
+POSITIVE_DIGIT = BALANCE_VALUES.index("positive")
+UNCHANGED_DIGIT = BALANCE_VALUES.index("unchanged")
+NEGATIVE_DIGIT = BALANCE_VALUES.index("negative")
+
+TRUE_DIGIT = BOOLEAN_VALUES.index(True)
+FALSE_DIGIT = BOOLEAN_VALUES.index(False)
+
+CREATOR_SENDER_DIGIT = fund_flow_case_digit("sender", "creator")
+OTHER_SENDER_DIGIT = fund_flow_case_digit("sender", "other")
+
+# the values of each balance delta row besides the transaction position
+BALANCE_DELTA_FIELDS = [
+    "creator_delta",
+    "contract_delta",
+    "sender_delta",
+    "other_positive_delta",
+    "other_negative_delta",
+]
+
+
+def value_in_wei(transaction):
+    """
+    :return: the exact value of the transaction in wei, or if it was crawled before the exact value was stored,
+    the value in ether converted back to wei (exact only when the shortest float representation is exact)
+    """
+    if transaction.value_wei is not None:
+        return transaction.value_wei
+    return int(Decimal(repr(transaction.value)) * WEI_PER_ETHER)
+
+
+def calculate_balances(contract, transaction, children):
+    """
+    :param contract: row with the contract address and creator
+    :param transaction: normal transaction with source, value and target
+    :param children: internal transactions of the normal transaction
+    :return: Counter with the net amount of wei moved by address
+    """
+    balances = Counter()
+
+    # initialize balances with transaction value movement (if present)
+    value = value_in_wei(transaction)
+    if value > 0:
+        # the source can be either the creator or another account
+        balances[transaction.source] = -value
+        # the target is always the contract
+        balances[contract.address] = value
+
+    for child in children:
+        balances.update(calculate_internal_transaction_balance(child))
+
+    return balances
+
+
+def calculate_internal_transaction_balance(transaction):
+    balance = Counter()
+    value = value_in_wei(transaction)
+
+    # if value is moved
+    if value > 0:
+        # the source loses the value
+        balance[transaction.source] = -value
+
+        # creation transaction
+        if transaction.target is None:
+            # the new contract gets the value
+            balance[transaction.contract_address] = value
+        # non-creation transaction
+        else:
+            # IMPORTANT: _contract_address can be != contract["address"]
+            # children from a transaction can be from another contract
+
+            # the target gets the value
+            # the + should be used, or else transactions with same source and target will get a wrong balance
+            balance[transaction.target] += value
+
+    return balance
+
+
+def summarize_balances(contract, transaction, balances):
+    """
+    Keeps the balance of the creator, the contract and the sender (when it is not the creator),
+    and sums the balances of the rest of the accounts by sign.
+    :return: dictionary with the balance delta fields
+    """
+    deltas = dict.fromkeys(BALANCE_DELTA_FIELDS, 0)
+
+    for address, value in balances.items():
+        if address == contract.creator:
+            deltas["creator_delta"] = value
+        elif address == contract.address:
+            deltas["contract_delta"] = value
+        elif address == transaction.source:
+            deltas["sender_delta"] = value
+        elif value == 0:
+            continue
+        elif value > 0:
+            deltas["other_positive_delta"] += value
+        else:
+            deltas["other_negative_delta"] += value
+
+    return deltas
+
+
+def balance_digits(values):
+    """
+    Separates balances into the bins of the fund flow cases.
+    :param values: array of balances in wei (integers or python integers as objects, so the comparisons are exact)
+    :return: array of fund flow case digits
+    """
+    return np.where(values == 0,
+                    UNCHANGED_DIGIT,
+                    np.where(values > 0, POSITIVE_DIGIT, NEGATIVE_DIGIT))
+
+
+def boolean_digits(values):
+    return np.where(values, TRUE_DIGIT, FALSE_DIGIT)
+
+
+def fund_flow_case_codes(deltas, error, creation, other_sender):
+    """
+    Classifies many transactions at once without building the fund flow case values.
+    :param deltas: dictionary with one array per balance delta field (e.g. from summarize_balances or the ledger table)
+    :param error: boolean array, the transaction or any of its internal transactions failed
+    :param creation: boolean array, the transaction created the contract
+    :param other_sender: boolean array, the sender is not the creator
+    :return: array of fund flow case codes (see fund_flow_cases.encode_fund_flow_case)
+    """
+    digits_by_field = {
+        "sender": np.where(other_sender, OTHER_SENDER_DIGIT, CREATOR_SENDER_DIGIT),
+        "creation": boolean_digits(creation),
+        "error": boolean_digits(error),
+        "balance_creator": balance_digits(deltas["creator_delta"]),
+        "balance_contract": balance_digits(deltas["contract_delta"]),
+        # when the sender is the creator the delta is zero, so it takes the default value
+        "balance_sender": balance_digits(deltas["sender_delta"]),
+        "balance_other_positive": boolean_digits(deltas["other_positive_delta"] > 0),
+        "balance_other_negative": boolean_digits(deltas["other_negative_delta"] < 0),
+    }
+
+    codes = np.zeros(len(error), dtype=np.int64)
+    for field, digits in digits_by_field.items():
+        codes += digits * FUND_FLOW_CASE_WEIGHT_BY_FIELD[field]
+
+    return codes
@@ -0,0 +1,23 @@
+from honeypot_detection.database.contract import Contract
+
+
+def fetch_contract_metadata(sqlalchemy_session, addresses, columns, batch_size=500):
+    """
+    Fetches only some columns of many contracts with one query per batch, without building entities.
+    :param sqlalchemy_session: to query the database (read only)
+    :param addresses: contract addresses
+    :param columns: Contract columns or labeled expressions (the address is always included, so it should not be)
+    :param batch_size: how many contracts are fetched with each query
+    :return: dictionary of rows by address, where each row has one attribute per column
+    (addresses without contract are ignored)
+    """
+    metadata_by_address = {}
+
+    for start in range(0, len(addresses), batch_size):
+        rows = sqlalchemy_session.query(Contract.address, *columns).\
+            filter(Contract.address.in_(addresses[start:start + batch_size]))
+
+        for row in rows:
+            metadata_by_address[row.address] = row
+
+    return metadata_by_address
@@ -0,0 +1,193 @@
+from honeypot_detection.database.transaction import NormalTransaction, InternalTransaction
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import load_only
+
+
+# empty transaction indices go first in every database (like they do in SQLite and MySQL)
+EMPTY_TRANSACTION_INDEX = -1
+
+
+def transaction_index_order(column):
+    """
+    :param column: transaction index column of any table
+    :return: the transaction index as it should be sorted and compared
+    """
+    return func.coalesce(column, EMPTY_TRANSACTION_INDEX)
+
+
+# the hash only breaks ties, so the order is always the same (even between chunks)
+CHRONOLOGICAL_ORDER = [
+    NormalTransaction.block_number.asc(),
+    transaction_index_order(NormalTransaction.transaction_index).asc(),
+    NormalTransaction.hash.asc(),
+]
+
+
+def chronological_position_filter(transaction, after):
+    """
+    Keyset condition in the same order as CHRONOLOGICAL_ORDER.
+    :param transaction: normal transaction with the hash, block number and transaction index loaded
+    :param after: True for the transactions after the given one, False for the ones up to it (including it)
+    :return: filter expression for the normal transactions
+    """
+    block_number = NormalTransaction.block_number
+    transaction_index = transaction_index_order(NormalTransaction.transaction_index)
+
+    position_block_number = transaction.block_number
+    position_transaction_index = transaction.transaction_index
+    if position_transaction_index is None:
+        position_transaction_index = EMPTY_TRANSACTION_INDEX
+
+    if after:
+        return or_(block_number > position_block_number,
+                   and_(block_number == position_block_number, transaction_index > position_transaction_index),
+                   and_(block_number == position_block_number, transaction_index == position_transaction_index,
+                        NormalTransaction.hash > transaction.hash))
+    else:
+        return or_(block_number < position_block_number,
+                   and_(block_number == position_block_number, transaction_index < position_transaction_index),
+                   and_(block_number == position_block_number, transaction_index == position_transaction_index,
+                        NormalTransaction.hash <= transaction.hash))
+
+
+def fetch_normal_transactions(sqlalchemy_session, address, columns=None):
+    """
+    :param columns: optional list of NormalTransaction columns to load (the rest are loaded one by one if accessed)
+    :return: list of normal transactions crawled from the contract in chronological order
+    """
+    transactions = sqlalchemy_session.query(NormalTransaction). \
+        filter(NormalTransaction.crawled_from == address). \
+        order_by(*CHRONOLOGICAL_ORDER)
+
+    if columns is not None:
+        transactions = transactions.options(load_only(*columns))
+
+    return transactions.all()
+
+
+def fetch_internal_transactions_by_hash(sqlalchemy_session, address, columns=None):
+    """
+    Fetches the children of every normal transaction crawled from the contract with only one query.
+    The children can be crawled from another contract (they are matched only by hash).
+    :param columns: optional list of InternalTransaction columns to load (the hash is always loaded)
+    :return: dictionary of lists of internal transactions by the hash of the parent normal transaction
+    """
+    children = sqlalchemy_session.query(InternalTransaction). \
+        join(NormalTransaction, NormalTransaction.hash == InternalTransaction.hash). \
+        filter(NormalTransaction.crawled_from == address). \
+        order_by(InternalTransaction.sqlalchemy_id.asc())
+
+    if columns is not None:
+        children = children.options(load_only(InternalTransaction.hash, *internal_transaction_columns(columns)))
+
+    children_by_hash = {}
+    for child in children:
+        children_by_hash.setdefault(child.hash, []).append(child)
+
+    return children_by_hash
+
+
+def internal_transaction_columns(columns):
+    """
+    :return: the columns that also belong to the internal transactions (e.g. without the transaction index)
+    """
+    return [column for column in columns if hasattr(InternalTransaction, column)]
+
+
+def iterate_transactions_with_children(sqlalchemy_session, address, columns=None, chunk_size=None):
+    """
+    Iterates the normal transactions crawled from the contract in chronological order together with their children.
+    Without chunk size all the transactions and all the children are fetched at once (one query each).
+    With chunk size the transactions are fetched in chunks using the position of the last transaction
+    of the previous chunk (instead of an offset), and the children are fetched for each chunk
+    with the same positions (instead of a list of hashes), so only one chunk is kept in memory at a time.
+    :param columns: optional list of columns to load for both normal and internal transactions
+    (the columns that only belong to the normal transactions are not loaded for the internal transactions)
+    :param chunk_size: optional amount of normal transactions per chunk
+    :return: generator of (normal transaction, list of internal transactions) tuples
+    """
+    if chunk_size is None:
+        transactions = fetch_normal_transactions(sqlalchemy_session, address, columns=columns)
+        children_by_hash = fetch_internal_transactions_by_hash(sqlalchemy_session, address, columns=columns)
+
+        for transaction in transactions:
+            yield transaction, children_by_hash.get(transaction.hash, [])
+
+        return
+
+    # the chunks need the hash to match the children and the position of the last transaction to continue
+    if columns is not None:
+        child_columns = internal_transaction_columns(columns) + ["hash"]
+        columns = list(columns) + ["hash", "block_number", "transaction_index"]
+
+    last_transaction = None
+    while True:
+        transactions = sqlalchemy_session.query(NormalTransaction). \
+            filter(NormalTransaction.crawled_from == address)
+
+        if columns is not None:
+            transactions = transactions.options(load_only(*columns))
+
+        # continue after the last transaction of the previous chunk
+        if last_transaction is not None:
+            transactions = transactions.filter(chronological_position_filter(last_transaction, after=True))
+
+        transactions = transactions. \
+            order_by(*CHRONOLOGICAL_ORDER). \
+            limit(chunk_size).all()
+
+        # no more chunks
+        if len(transactions) == 0:
+            return
+
+        # the children of the transactions between the last one of the previous chunk and the last one of this chunk
+        children = sqlalchemy_session.query(InternalTransaction). \
+            join(NormalTransaction, NormalTransaction.hash == InternalTransaction.hash). \
+            filter(NormalTransaction.crawled_from == address). \
+            filter(chronological_position_filter(transactions[-1], after=False))
+
+        if last_transaction is not None:
+            children = children.filter(chronological_position_filter(last_transaction, after=True))
+
+        children = children.order_by(InternalTransaction.sqlalchemy_id.asc())
+
+        if columns is not None:
+            children = children.options(load_only(*child_columns))
+
+        children_by_hash = {}
+        for child in children:
+            children_by_hash.setdefault(child.hash, []).append(child)
+
+        for transaction in transactions:
+            yield transaction, children_by_hash.get(transaction.hash, [])
+
+        # the last chunk was not full
+        if len(transactions) < chunk_size:
+            return
+
+        last_transaction = transactions[-1]
+
+
+def fetch_normal_transaction_columns(sqlalchemy_session, address, *columns):
+    """
+    Same as fetch_normal_transactions but without building entities.
+    :param columns: NormalTransaction columns to fetch
+    :return: list of tuples with the requested columns in chronological order
+    """
+    return sqlalchemy_session.query(*columns). \
+        filter(NormalTransaction.crawled_from == address). \
+        order_by(*CHRONOLOGICAL_ORDER).all()
+
+
+def fetch_internal_transaction_columns(sqlalchemy_session, address, *columns):
+    """
+    Fetches the children of every normal transaction crawled from the contract without building entities.
+    The children are ordered like their parents, and then like they were crawled.
+    :param columns: InternalTransaction columns to fetch
+    :return: list of tuples with the requested columns
+    """
+    return sqlalchemy_session.query(*columns). \
+        join(NormalTransaction, NormalTransaction.hash == InternalTransaction.hash). \
+        filter(NormalTransaction.crawled_from == address). \
+        order_by(*CHRONOLOGICAL_ORDER + [InternalTransaction.sqlalchemy_id.asc()]).all()
@@ -154,6 +154,7 @@ class TransactionCrawler:
         transaction.target = self.etherscan_client.parse_str(response["to"])  # sometimes empty
         transaction.hash = self.etherscan_client.parse_str(response["hash"])
         transaction.value = self.etherscan_client.parse_value(response["value"])
+        transaction.value_wei = self.etherscan_client.parse_wei(response["value"])
         transaction.gas = self.etherscan_client.parse_int(response["gas"])
         transaction.gas_used = self.etherscan_client.parse_int(response["gasUsed"])
         transaction.is_error = self.etherscan_client.parse_bool(response["isError"])
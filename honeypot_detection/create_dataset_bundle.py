@@ -0,0 +1,313 @@
+import argparse
+import csv
+import logging
+import os
+
+import numpy as np
+
+from honeypot_detection import config  # just to define log level
+from honeypot_detection.dataset_bundle import ADDRESSES_FILE_NAME, BINARY_LABELS_FILE_NAME, FEATURES_FILE_NAME,\
+    FEATURE_METADATA_FIELDS, FEATURE_METADATA_FILE_NAME, MULTI_CLASS_LABELS_FILE_NAME
+
+
+logger = logging.getLogger(__name__)
+
+
+ADDRESS_FIELD = "contract_address"
+BINARY_LABEL_FIELD = "contract_is_honeypot"
+# the paper dataset has label indices and the updated dump has label ids
+MULTI_CLASS_LABEL_FIELDS = ["contract_label_index", "contract_label_id"]
+
+# columns that are never features
+NOT_FEATURE_FIELDS = {
+    ADDRESS_FIELD,
+    BINARY_LABEL_FIELD,
+    "contract_evaluation_positive",
+    "contract_label_name",
+} | set(MULTI_CLASS_LABEL_FIELDS)
+
+DEFAULT_ONE_HOT_FIELDS = [
+    "contract_compiler_minor_version_index",
+    "contract_compiler_patch_index",
+    "contract_library_index",
+]
+
+VALUE_BY_TEXT = {"": np.nan, "True": 1.0, "False": 0.0}
+
+
+def parse_value(text, field):
+    """
+    :return: the value of a csv field as a float (empty values are missing)
+    """
+    if text in VALUE_BY_TEXT:
+        return VALUE_BY_TEXT[text]
+    try:
+        return float(text)
+    except ValueError:
+        raise Exception("The value '{}' of the column '{}' is not a number.".format(text, field))
+
+
+def parse_chunk(rows, positions, fields):
+    """
+    :param rows: list of csv rows
+    :param positions: position in the rows of each column to parse
+    :param fields: name of each column to parse (for the errors)
+    :return: float matrix with one row per csv row and one column per position
+    """
+    values = np.empty((len(rows), len(positions)), dtype=np.float64)
+    for i, row in enumerate(rows):
+        values[i] = [parse_value(row[position], field) for position, field in zip(positions, fields)]
+    return values
+
+
+def iterate_csv_chunks(file_path, chunk_size):
+    """
+    :return: generator of lists of csv rows (without the header)
+    """
+    with open(file_path, "r") as input_file:
+        reader = csv.reader(input_file)
+        next(reader)
+
+        chunk = []
+        for row in reader:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+        if len(chunk) > 0:
+            yield chunk
+
+
+def one_hot_field(field, value):
+    """
+    Same names as the one-hot-encoded columns of the paper experiments (e.g. contract_library_3).
+    """
+    if float(value).is_integer():
+        value = int(value)
+    return "{}_{}".format(field.replace("_index", ""), value)
+
+
+def read_feature_metadata(file_path):
+    """
+    :param file_path: csv with the feature, category and scale (1 or 0) columns
+    :return: list of (feature, category, scale) tuples in the file order
+    """
+    with open(file_path, "r") as metadata_file:
+        return [(row["feature"], row["category"], row["scale"] == "1") for row in csv.DictReader(metadata_file)]
+
+
+class DatasetLayout:
+    """
+    Decides the feature columns of the bundle from the csv header and the first pass over the rows.
+    The scaled features go first and then the rest, like in the paper experiments.
+    """
+
+    def __init__(self, header, one_hot_fields, exclude_fields, feature_metadata=None):
+        """
+        :param header: field names of the dataset
+        :param one_hot_fields: fields to one-hot-encode
+        :param exclude_fields: fields that are not features
+        :param feature_metadata: optional list of (feature, category, scale) tuples to select and scale the features
+        """
+        self.header = header
+        self.feature_metadata = feature_metadata
+
+        for field in one_hot_fields:
+            if field not in header:
+                raise Exception("The column '{}' to one-hot-encode is not in the dataset.".format(field))
+
+        self.multi_class_label_field = None
+        for field in MULTI_CLASS_LABEL_FIELDS:
+            if field in header:
+                self.multi_class_label_field = field
+                break
+        if self.multi_class_label_field is None:
+            raise Exception("The dataset has no label column ({}).".format(" or ".join(MULTI_CLASS_LABEL_FIELDS)))
+
+        self.one_hot_fields = list(one_hot_fields)
+        self.numeric_fields = [field for field in header
+                               if field not in NOT_FEATURE_FIELDS
+                               and field not in exclude_fields
+                               and field not in self.one_hot_fields]
+
+        # the columns without metadata are not parsed
+        if feature_metadata is not None:
+            metadata_fields = set(feature for feature, _, _ in feature_metadata)
+            self.numeric_fields = [field for field in self.numeric_fields if field in metadata_fields]
+
+        # only the numeric fields and the fields to one-hot-encode are parsed
+        self.parsed_fields = self.numeric_fields + self.one_hot_fields
+        self.parsed_positions = [header.index(field) for field in self.parsed_fields]
+
+    def fit(self, file_path, chunk_size):
+        """
+        First pass: counts the rows, finds the values to one-hot-encode and the range of every numeric feature.
+        """
+        self.number_of_rows = 0
+
+        minimums = np.full(len(self.parsed_fields), np.nan)
+        maximums = np.full(len(self.parsed_fields), np.nan)
+        one_hot_values = [set() for _ in self.one_hot_fields]
+
+        for rows in iterate_csv_chunks(file_path, chunk_size):
+            values = parse_chunk(rows, self.parsed_positions, self.parsed_fields)
+
+            # the missing values are ignored
+            minimums = np.fmin(minimums, np.fmin.reduce(values, axis=0))
+            maximums = np.fmax(maximums, np.fmax.reduce(values, axis=0))
+
+            for i, field_values in enumerate(one_hot_values):
+                column = values[:, len(self.numeric_fields) + i]
+                field_values.update(column[~np.isnan(column)].tolist())
+
+            self.number_of_rows += len(rows)
+
+            logger.info("{:d} rows read...".format(self.number_of_rows))
+
+        # every candidate feature: (name, parsed column position, value for one-hot columns or None)
+        candidates = [(field, position, None) for position, field in enumerate(self.numeric_fields)]
+        for i, (field, field_values) in enumerate(zip(self.one_hot_fields, one_hot_values)):
+            for value in sorted(field_values):
+                candidates.append((one_hot_field(field, value), len(self.numeric_fields) + i, value))
+
+        if self.feature_metadata is None:
+            # all the features without scaling
+            selected = [(candidate, "", False) for candidate in candidates]
+        else:
+            candidate_by_name = {candidate[0]: candidate for candidate in candidates}
+            # in case the feature was filtered out
+            selected = [(candidate_by_name[feature], category, scale)
+                        for feature, category, scale in self.feature_metadata if feature in candidate_by_name]
+
+        selected = [entry for entry in selected if entry[2]] + [entry for entry in selected if not entry[2]]
+
+        if len(selected) == 0:
+            raise Exception("At least one column should be used.")
+
+        self.feature_names = [candidate[0] for candidate, _, _ in selected]
+        self.categories = [category for _, category, _ in selected]
+        self.scaled = np.array([scale for _, _, scale in selected], dtype=bool)
+        self.source_columns = np.array([candidate[1] for candidate, _, _ in selected], dtype=np.int64)
+        # nan for the columns that are not one-hot-encoded
+        self.one_hot_values = np.array([np.nan if candidate[2] is None else candidate[2]
+                                        for candidate, _, _ in selected], dtype=np.float64)
+        self.is_one_hot = ~np.isnan(self.one_hot_values)
+
+        # the one-hot-encoded columns go from zero to one
+        self.minimums = np.where(self.is_one_hot, 0, minimums[self.source_columns])
+        self.maximums = np.where(self.is_one_hot, 1, maximums[self.source_columns])
+
+        # same as scikit-learn MinMaxScaler: constant columns are only shifted
+        ranges = self.maximums - self.minimums
+        self.scale_ranges = np.where(np.isnan(ranges) | (ranges == 0), 1, ranges)
+
+    def transform(self, rows):
+        """
+        :return: float32 feature matrix of the rows with the one-hot-encoded and scaled columns
+        """
+        values = parse_chunk(rows, self.parsed_positions, self.parsed_fields)[:, self.source_columns]
+
+        # the rows with missing values have zero in every one-hot-encoded column
+        values[:, self.is_one_hot] = values[:, self.is_one_hot] == self.one_hot_values[self.is_one_hot]
+
+        values[:, self.scaled] = (values[:, self.scaled] - self.minimums[self.scaled]) / self.scale_ranges[self.scaled]
+
+        return values.astype(np.float32)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Create a binary dataset bundle ready for the machine learning experiments from a merged dataset.")
+
+    argument_parser.add_argument("input", type=str, help="Merged dataset in csv format.")
+    argument_parser.add_argument("output", type=str, help="Output bundle directory.")
+
+    argument_parser.add_argument("--metadata", type=str,
+                                 help="Csv file with the feature, category and scale (1 or 0) columns"
+                                      + " to select, categorize and scale the features. Default is all the features"
+                                      + " without scaling.")
+    argument_parser.add_argument("--one_hot", type=str, nargs="*", default=DEFAULT_ONE_HOT_FIELDS,
+                                 help="Columns to one-hot-encode.")
+    argument_parser.add_argument("--exclude", type=str, nargs="*", default=[],
+                                 help="Columns that are not features.")
+    argument_parser.add_argument("--chunk_size", type=int, default=10000,
+                                 help="Number of rows processed at once.")
+
+    arguments = argument_parser.parse_args()
+
+    if arguments.metadata is None:
+        feature_metadata = None
+    else:
+        feature_metadata = read_feature_metadata(arguments.metadata)
+
+    with open(arguments.input, "r") as input_file:
+        header = next(csv.reader(input_file))
+
+    layout = DatasetLayout(header, arguments.one_hot, set(arguments.exclude), feature_metadata)
+
+    logger.info("Reading the ranges...")
+
+    layout.fit(arguments.input, arguments.chunk_size)
+
+    logger.info("{:d} rows and {:d} features.".format(layout.number_of_rows, len(layout.feature_names)))
+
+    if not os.path.exists(arguments.output):
+        os.makedirs(arguments.output)
+
+    # the arrays are filled while the rows are read a second time
+    features = np.lib.format.open_memmap(os.path.join(arguments.output, FEATURES_FILE_NAME), mode="w+",
+                                         dtype=np.float32, shape=(layout.number_of_rows, len(layout.feature_names)))
+    labels_binary = np.lib.format.open_memmap(os.path.join(arguments.output, BINARY_LABELS_FILE_NAME), mode="w+",
+                                              dtype=bool, shape=(layout.number_of_rows,))
+    labels_multi = np.lib.format.open_memmap(os.path.join(arguments.output, MULTI_CLASS_LABELS_FILE_NAME), mode="w+",
+                                             dtype=np.int64, shape=(layout.number_of_rows,))
+
+    address_position = header.index(ADDRESS_FIELD)
+    label_position = header.index(layout.multi_class_label_field)
+    if BINARY_LABEL_FIELD in header:
+        binary_label_position = header.index(BINARY_LABEL_FIELD)
+    else:
+        binary_label_position = None
+
+    logger.info("Writing...")
+
+    with open(os.path.join(arguments.output, ADDRESSES_FILE_NAME), "w") as addresses_file:
+        start = 0
+        for rows in iterate_csv_chunks(arguments.input, arguments.chunk_size):
+            end = start + len(rows)
+
+            features[start:end] = layout.transform(rows)
+
+            labels_multi[start:end] = [int(float(row[label_position])) for row in rows]
+
+            # the honeypots are the contracts with a label
+            if binary_label_position is None:
+                labels_binary[start:end] = labels_multi[start:end] > 0
+            else:
+                labels_binary[start:end] = [parse_value(row[binary_label_position], BINARY_LABEL_FIELD) == 1
+                                            for row in rows]
+
+            for row in rows:
+                addresses_file.write(row[address_position] + "\n")
+
+            start = end
+
+            logger.info("{:d}/{:d} rows written...".format(end, layout.number_of_rows))
+
+    features.flush()
+    labels_binary.flush()
+    labels_multi.flush()
+
+    with open(os.path.join(arguments.output, FEATURE_METADATA_FILE_NAME), "w") as metadata_file:
+        writer = csv.writer(metadata_file)
+        writer.writerow(FEATURE_METADATA_FIELDS)
+        for row in zip(layout.feature_names, layout.categories, layout.scaled.astype(int).tolist(),
+                       layout.minimums.tolist(), layout.maximums.tolist()):
+            writer.writerow(row)
+
+    logger.info("Done.")
+
+
+if __name__ == '__main__':
+    main()
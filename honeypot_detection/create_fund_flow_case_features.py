@@ -1,29 +1,287 @@
 import argparse
+import ast
 import csv
+import os
 import sys
 
-from collections import Counter
+import numpy as np
 
-from honeypot_detection.fund_flow_cases import FUND_FLOW_CASE_ID_BY_NAME
+from multiprocessing import Pool, cpu_count
 
+from honeypot_detection.fund_flow_cases import FUND_FLOW_CASE_ID_BY_NAME, INVALID_FUND_FLOW_CASE_ID
+from honeypot_detection.multiprocess_by_address import concatenate_shards, shard_file_path
+from honeypot_detection.sequence_store import SequenceStore
+from honeypot_detection.sparse_features import columns_file_path, load_sparse_features, rows_file_path,\
+    save_sparse_features
 
-# for very long traces
-csv.field_size_limit(sys.maxsize)
+from scipy import sparse
+
+
+OUTPUT_FORMAT_CSV = "csv"
+OUTPUT_FORMAT_SPARSE = "sparse"
+
+OUTPUT_FORMATS = [OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_SPARSE]
 
 
 def fund_flow_case_field(_id):
     return "fund_flow_case_{:d}_frequency".format(_id)
 
 
+def split_csv_input(input_file_path, number_of_parts):
+    """
+    Splits the rows after the header into byte ranges of similar size.
+    :return: list of (start, end) byte positions
+    """
+    with open(input_file_path, "rb") as input_file:
+        header_end = len(input_file.readline())
+
+    size = os.path.getsize(input_file_path)
+
+    boundaries = np.linspace(header_end, size, number_of_parts + 1).astype(np.int64).tolist()
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def iterate_csv_lines(input_file_path, start, end):
+    """
+    Each row belongs to the byte range where it starts (a row can not contain line breaks).
+    :return: generator of the decoded lines that start inside the byte range
+    """
+    with open(input_file_path, "rb") as input_file:
+        # skip the row that started before the range (unless the range starts exactly at the beginning of a row)
+        input_file.seek(start - 1)
+        if input_file.read(1) != b"\n":
+            input_file.readline()
+
+        while input_file.tell() < end:
+            line = input_file.readline()
+            if len(line) == 0:
+                break
+            yield line.decode("utf-8")
+
+
+def iterate_csv_sequence_chunks(input_file_path, chunk_size, start, end):
+    """
+    Reads the sequences written in csv format (each value is the representation of the bytes).
+    :return: generator of (addresses, concatenated sequences, sequence lengths) tuples
+    """
+    # for very long traces
+    csv.field_size_limit(sys.maxsize)
+
+    with open(input_file_path, "r") as input_file:
+        field_names = next(csv.reader(input_file))
+
+    addresses = []
+    sequences = []
+    for values in csv.reader(iterate_csv_lines(input_file_path, start, end)):
+        input_row = dict(zip(field_names, values))
+
+        addresses.append(input_row["address"])
+        # transform the value from the bytes representation without evaluating code
+        sequences.append(ast.literal_eval(input_row["value"]))
+
+        if len(addresses) == chunk_size:
+            yield concatenate_sequences(addresses, sequences)
+            addresses = []
+            sequences = []
+
+    if len(addresses) > 0:
+        yield concatenate_sequences(addresses, sequences)
+
+
+def concatenate_sequences(addresses, sequences):
+    payload = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    return addresses, payload, lengths
+
+
+def split_store_input(directory, number_of_parts):
+    """
+    Splits the contracts of the sequence store into ranges of similar size.
+    :return: list of (start, end) contract positions
+    """
+    boundaries = np.linspace(0, len(SequenceStore(directory)), number_of_parts + 1).astype(np.int64).tolist()
+
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def iterate_store_sequence_chunks(directory, chunk_size, start, end, with_blocks=False):
+    """
+    Slices the sequence store without copying the sequences.
+    :return: generator of (addresses, concatenated sequences, sequence lengths) tuples,
+    with the concatenated block numbers of the cases at the end when requested
+    """
+    store = SequenceStore(directory)
+
+    if with_blocks and store.blocks is None:
+        raise Exception("The sequence store does not have block numbers.")
+
+    for chunk_start in range(start, end, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, end)
+        offsets = store.offsets[chunk_start:chunk_end + 1]
+        chunk = (store.addresses[chunk_start:chunk_end], store.payload[offsets[0]:offsets[-1]], np.diff(offsets))
+        if with_blocks:
+            chunk += (store.blocks[offsets[0]:offsets[-1]],)
+        yield chunk
+
+
+def split_input(input_path, number_of_parts):
+    """
+    :param input_path: sequence store directory or csv file
+    :param number_of_parts: how many parts should be processed independently
+    :return: list of (start, end) positions in the input
+    """
+    if os.path.isdir(input_path):
+        return split_store_input(input_path, number_of_parts)
+    else:
+        return split_csv_input(input_path, number_of_parts)
+
+
+def iterate_sequence_chunks(input_path, chunk_size, start, end, with_blocks=False):
+    """
+    :param input_path: sequence store directory or csv file
+    :param chunk_size: how many contracts are read at once
+    :param start: position in the input where the part starts (see split_input)
+    :param end: position in the input where the part ends (see split_input)
+    :param with_blocks: add the block numbers of the cases to the tuples (only for sequence stores with blocks)
+    :return: generator of (addresses, concatenated sequences, sequence lengths) tuples
+    """
+    if os.path.isdir(input_path):
+        return iterate_store_sequence_chunks(input_path, chunk_size, start, end, with_blocks=with_blocks)
+    elif with_blocks:
+        raise Exception("Only the sequence store can have block numbers.")
+    else:
+        return iterate_csv_sequence_chunks(input_path, chunk_size, start, end)
+
+
+def fund_flow_case_frequencies(sequences, lengths, number_of_fund_flow_cases):
+    """
+    Counts the cases of many contracts at once using the contract position of every case.
+    :param sequences: concatenated fund flow case sequences
+    :param lengths: length of the sequence of each contract
+    :param number_of_fund_flow_cases: the case ids go from 1 to this number
+    :return: matrix with one row per contract and one column per case id (zero for empty sequences)
+    """
+    if np.any(sequences == INVALID_FUND_FLOW_CASE_ID) or np.any(sequences > number_of_fund_flow_cases):
+        raise Exception("The sequences contain invalid fund flow case ids.")
+
+    number_of_contracts = len(lengths)
+    number_of_columns = number_of_fund_flow_cases + 1  # the first column is the invalid id and it is removed
+
+    contract_positions = np.repeat(np.arange(number_of_contracts), lengths)
+    counts = np.bincount(contract_positions * number_of_columns + sequences,
+                         minlength=number_of_contracts * number_of_columns)
+    counts = counts.reshape(number_of_contracts, number_of_columns)[:, 1:]
+
+    return counts / np.maximum(lengths, 1)[:, np.newaxis]
+
+
+def write_csv_part(output_file_path, fields, feature_chunks):
+    """
+    :param fields: the contract address field followed by the feature fields
+    :param feature_chunks: iterable of (addresses, matrix with one row per address) tuples
+    """
+    with open(output_file_path, "w") as output_file:
+        writer = csv.writer(output_file)
+
+        writer.writerow(fields)
+
+        for addresses, matrix in feature_chunks:
+            # the rows are written directly from the matrix (without one dictionary per row)
+            for address, row in zip(addresses, matrix.tolist()):
+                writer.writerow([address] + row)
+
+
+def write_sparse_part(output_file_path, fields, feature_chunks):
+    """
+    Same as write_csv_part but the part is written as a sparse matrix (see sparse_features).
+    """
+    addresses = []
+    matrices = []
+    for chunk_addresses, matrix in feature_chunks:
+        addresses.extend(chunk_addresses)
+        matrices.append(sparse.csr_matrix(matrix))
+
+    if len(matrices) > 0:
+        matrix = sparse.vstack(matrices, format="csr")
+    else:
+        matrix = sparse.csr_matrix((0, len(fields) - 1))
+
+    save_sparse_features(output_file_path, addresses, fields[1:], matrix)
+
+
+def iterate_frequency_chunks(input_path, number_of_fund_flow_cases, chunk_size, start, end):
+    for addresses, sequences, lengths in iterate_sequence_chunks(input_path, chunk_size, start, end):
+        yield addresses, fund_flow_case_frequencies(sequences, lengths, number_of_fund_flow_cases)
+
+
+def create_features_part(input_path, output_file_path, fields, chunk_size, start, end):
+    """
+    Runs inside each process of the pool and writes the features of one part of the input in its own file.
+    """
+    write_csv_part(output_file_path, fields,
+                   iterate_frequency_chunks(input_path, len(fields) - 1, chunk_size, start, end))
+
+    return output_file_path
+
+
+def create_sparse_features_part(input_path, output_file_path, fields, chunk_size, start, end):
+    """
+    Same as create_features_part but the part is written as a sparse matrix (see sparse_features).
+    """
+    write_sparse_part(output_file_path, fields,
+                      iterate_frequency_chunks(input_path, len(fields) - 1, chunk_size, start, end))
+
+    return output_file_path
+
+
+def concatenate_sparse_shards(shard_file_paths, file_path, fields):
+    """
+    Stacks the rows of the shards into one sparse matrix.
+    The shard files are removed afterwards.
+    """
+    addresses = []
+    matrices = []
+    for shard_path in shard_file_paths:
+        shard_addresses, _, shard_matrix = load_sparse_features(shard_path)
+        addresses.extend(shard_addresses)
+        matrices.append(shard_matrix)
+
+    save_sparse_features(file_path, addresses, fields[1:], sparse.vstack(matrices, format="csr"))
+
+    for shard_path in shard_file_paths:
+        os.remove(shard_path)
+        os.remove(rows_file_path(shard_path))
+        os.remove(columns_file_path(shard_path))
+
+
 def main():
     argument_parser = argparse.ArgumentParser(
         description="Create the fund flow case features from fund flow case sequences.")
 
-    argument_parser.add_argument("input", type=str, help="Input file in csv format.")
-    argument_parser.add_argument("output", type=str, help="Output file in csv format.")
+    argument_parser.add_argument("input", type=str, help="Input sequence store directory or file in csv format.")
+    argument_parser.add_argument("output", type=str,
+                                 help="Output file in csv format, or in npz format for the sparse output format.")
+
+    argument_parser.add_argument("--processes", type=int, help="Number of processes. Default is cpu_count() - 1.")
+    argument_parser.add_argument("--parts", type=int,
+                                 help="Number of parts in which the input is split. Default is 4 per process.")
+    argument_parser.add_argument("--chunk_size", type=int, default=10000,
+                                 help="Number of contracts whose features are computed at once.")
+    argument_parser.add_argument("--output_format", type=str, choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT_CSV,
+                                 help="Write a dense csv file (csv) or a CSR sparse matrix in npz format"
+                                      + " with the contract addresses and the column names in sidecar files (sparse).")
 
     arguments = argument_parser.parse_args()
 
+    num_processes = arguments.processes
+    if num_processes is None:
+        num_processes = max(cpu_count() - 1, 1)
+
+    num_parts = arguments.parts
+    if num_parts is None:
+        num_parts = num_processes * 4
+
     number_of_fund_flow_cases = len(FUND_FLOW_CASE_ID_BY_NAME)
 
     # compute the fields
@@ -33,37 +291,24 @@ def main():
 
     print("Start...")
 
-    input_file = open(arguments.input, "r")
-    output_file = open(arguments.output, "w")
-
-    reader = csv.DictReader(input_file)
-    writer = csv.DictWriter(output_file, fieldnames=fields)
-
-    writer.writeheader()
-
-    for i, input_row in enumerate(reader):
-        # transform the value from bytes to a list of ints
-        fund_flow_case_sequence = list(eval(input_row["value"]))
-
-        output_row = {"contract_address": input_row["address"]}
-
-        counter = Counter()
-        for _id in fund_flow_case_sequence:
-            assert 0 < _id <= number_of_fund_flow_cases
-            counter[_id] += 1
-
-        sequence_length = len(fund_flow_case_sequence)
+    if arguments.output_format == OUTPUT_FORMAT_CSV:
+        create_part = create_features_part
+        concatenate = concatenate_shards
+    elif arguments.output_format == OUTPUT_FORMAT_SPARSE:
+        create_part = create_sparse_features_part
+        concatenate = concatenate_sparse_shards
+    else:
+        raise Exception("Invalid output format '{}'".format(arguments.output_format))
 
-        for _id in range(1, number_of_fund_flow_cases + 1):
-            if sequence_length > 0:
-                output_row[fund_flow_case_field(_id)] = counter[_id] / sequence_length
-            else:
-                output_row[fund_flow_case_field(_id)] = 0.0
+    # each part is written in its own shard file
+    tasks = [(arguments.input, shard_file_path(arguments.output, index), fields, arguments.chunk_size, start, end)
+             for index, (start, end) in enumerate(split_input(arguments.input, num_parts))]
 
-        writer.writerow(output_row)
+    with Pool(num_processes) as pool:
+        shard_file_paths = pool.starmap(create_part, tasks)
 
-    input_file.close()
-    output_file.close()
+    # the shards keep the input order
+    concatenate(shard_file_paths, arguments.output, fields)
 
     print("Finished.")
 
@@ -0,0 +1,195 @@
+import argparse
+
+import numpy as np
+
+from scipy import sparse
+
+from honeypot_detection.create_fund_flow_case_features import iterate_sequence_chunks, split_input
+from honeypot_detection.sparse_features import save_sparse_features
+
+
+NORMALIZATION_NGRAMS = "ngrams"
+NORMALIZATION_TRANSITIONS = "transitions"
+
+NORMALIZATIONS = [NORMALIZATION_NGRAMS, NORMALIZATION_TRANSITIONS]
+
+# each case id fits in one byte, so the n-gram codes fit in a signed 64 bit integer up to this size
+MAX_N = 7
+
+CASE_ID_BITS = 8
+
+
+def fund_flow_case_ngram_field(ngram_code, n):
+    return "fund_flow_case_ngram_{}_frequency".format("_".join(str(_id) for _id in decode_ngram(ngram_code, n)))
+
+
+def decode_ngram(ngram_code, n):
+    """
+    :return: list with the n case ids of the n-gram code in sequence order
+    """
+    return [(ngram_code >> (CASE_ID_BITS * (n - 1 - i))) & 0xFF for i in range(n)]
+
+
+def encode_ngrams(sequences, lengths, n):
+    """
+    Packs every n consecutive case ids of each sequence into one integer (the first case is the most significant).
+    The codes of all the positions are built together with n shifts, so each case is read only n times in total.
+    :param sequences: concatenated fund flow case sequences
+    :param lengths: length of the sequence of each contract
+    :param n: amount of consecutive cases
+    :return: tuple with the contract position and the code of each n-gram (n-grams never cross two sequences)
+    """
+    number_of_contracts = len(lengths)
+    total_length = len(sequences)
+
+    if total_length < n:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # the code of the n-gram that starts in each position (the last n - 1 positions have no complete n-gram)
+    codes = np.zeros(total_length - n + 1, dtype=np.int64)
+    for i in range(n):
+        codes <<= CASE_ID_BITS
+        codes |= sequences[i:total_length - n + 1 + i]
+
+    # keep only the n-grams that start and end in the same sequence
+    contract_positions = np.repeat(np.arange(number_of_contracts), lengths)[:total_length - n + 1]
+    sequence_starts = np.repeat(np.cumsum(lengths) - lengths, lengths)[:total_length - n + 1]
+    sequence_lengths = np.repeat(lengths, lengths)[:total_length - n + 1]
+    complete = np.arange(total_length - n + 1) - sequence_starts <= sequence_lengths - n
+
+    return contract_positions[complete], codes[complete]
+
+
+def count_pairs(contract_positions, codes):
+    """
+    :return: tuple with the unique (contract position, code) pairs and the count of each one
+    """
+    if len(codes) == 0:
+        return contract_positions, codes, np.zeros(0, dtype=np.int64)
+
+    order = np.lexsort((codes, contract_positions))
+    contract_positions = contract_positions[order]
+    codes = codes[order]
+
+    changes = (contract_positions[1:] != contract_positions[:-1]) | (codes[1:] != codes[:-1])
+    starts = np.flatnonzero(np.concatenate([[True], changes]))
+    counts = np.diff(np.append(starts, len(codes)))
+
+    return contract_positions[starts], codes[starts], counts
+
+
+def merge_supports(codes, supports, other_codes, other_supports):
+    """
+    Adds the supports of two sorted sets of n-gram codes.
+    :return: tuple with the sorted codes and their supports
+    """
+    merged_codes, inverse = np.unique(np.concatenate([codes, other_codes]), return_inverse=True)
+    merged_supports = np.bincount(inverse, weights=np.concatenate([supports, other_supports]),
+                                  minlength=len(merged_codes)).astype(np.int64)
+    return merged_codes, merged_supports
+
+
+def count_ngram_supports(input_path, n, chunk_size):
+    """
+    First pass: the amount of contracts in which each n-gram appears.
+    Only the supports are kept between chunks, so the memory depends on the amount of different n-grams.
+    :return: tuple with the sorted n-gram codes and their supports
+    """
+    codes = np.zeros(0, dtype=np.int64)
+    supports = np.zeros(0, dtype=np.int64)
+
+    start, end = split_input(input_path, 1)[0]
+    for _, sequences, lengths in iterate_sequence_chunks(input_path, chunk_size, start, end):
+        _, chunk_codes, _ = count_pairs(*encode_ngrams(sequences, lengths, n))
+        chunk_codes, chunk_supports = np.unique(chunk_codes, return_counts=True)
+        codes, supports = merge_supports(codes, supports, chunk_codes, chunk_supports)
+
+    return codes, supports
+
+
+def ngram_frequencies(sequences, lengths, n, vocabulary, normalization):
+    """
+    Second pass: the frequency of each n-gram of the vocabulary per contract.
+    :param vocabulary: sorted n-gram codes that become the columns
+    :param normalization: divide the counts by the amount of n-grams of the contract (ngrams),
+    or by the amount of n-grams that start with the same n - 1 cases in the contract (transitions)
+    :return: CSR matrix with one row per contract and one column per n-gram of the vocabulary
+    """
+    contract_positions, codes, counts = count_pairs(*encode_ngrams(sequences, lengths, n))
+
+    if normalization == NORMALIZATION_NGRAMS:
+        # the n-grams of each sequence (before removing the ones that are not in the vocabulary)
+        denominators = np.maximum(lengths - n + 1, 1)[contract_positions]
+    elif normalization == NORMALIZATION_TRANSITIONS:
+        # the n-grams of each sequence with the same prefix
+        _, prefix_groups = np.unique(np.stack([contract_positions, codes >> CASE_ID_BITS], axis=1), axis=0,
+                                     return_inverse=True)
+        prefix_groups = prefix_groups.reshape(-1)
+        denominators = np.bincount(prefix_groups, weights=counts)[prefix_groups]
+    else:
+        raise Exception("Invalid normalization '{}'".format(normalization))
+
+    columns = np.searchsorted(vocabulary, codes)
+    in_vocabulary = (columns < len(vocabulary))
+    in_vocabulary[in_vocabulary] = vocabulary[columns[in_vocabulary]] == codes[in_vocabulary]
+
+    return sparse.csr_matrix((counts[in_vocabulary] / denominators[in_vocabulary],
+                              (contract_positions[in_vocabulary], columns[in_vocabulary])),
+                             shape=(len(lengths), len(vocabulary)))
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Create sparse fund flow case n-gram features from fund flow case sequences.")
+
+    argument_parser.add_argument("input", type=str, help="Input sequence store directory or file in csv format.")
+    argument_parser.add_argument("output", type=str,
+                                 help="Output sparse matrix in npz format (see the sparse output format).")
+
+    argument_parser.add_argument("--n", type=int, default=2,
+                                 help="Number of consecutive cases per n-gram (up to {:d}).".format(MAX_N))
+    argument_parser.add_argument("--min_support", type=int, default=1,
+                                 help="Minimum number of contracts in which an n-gram should appear to be a feature.")
+    argument_parser.add_argument("--normalization", type=str, choices=NORMALIZATIONS,
+                                 default=NORMALIZATION_NGRAMS,
+                                 help="Divide the counts by the n-grams of the contract (ngrams), or by the n-grams"
+                                      + " with the same first n - 1 cases, like a transition matrix (transitions).")
+    argument_parser.add_argument("--chunk_size", type=int, default=10000,
+                                 help="Number of contracts whose n-grams are counted at once.")
+
+    arguments = argument_parser.parse_args()
+
+    if not 1 <= arguments.n <= MAX_N:
+        raise Exception("The n-gram size should be between 1 and {:d}.".format(MAX_N))
+
+    print("Counting supports...")
+
+    codes, supports = count_ngram_supports(arguments.input, arguments.n, arguments.chunk_size)
+    vocabulary = codes[supports >= arguments.min_support]
+
+    print("{:d} of {:d} n-grams have enough support.".format(len(vocabulary), len(codes)))
+
+    print("Computing frequencies...")
+
+    addresses = []
+    matrices = []
+    start, end = split_input(arguments.input, 1)[0]
+    for chunk_addresses, sequences, lengths in iterate_sequence_chunks(arguments.input, arguments.chunk_size,
+                                                                       start, end):
+        addresses.extend(chunk_addresses)
+        matrices.append(ngram_frequencies(sequences, lengths, arguments.n, vocabulary, arguments.normalization))
+
+    if len(matrices) > 0:
+        matrix = sparse.vstack(matrices, format="csr")
+    else:
+        matrix = sparse.csr_matrix((0, len(vocabulary)))
+
+    fields = [fund_flow_case_ngram_field(int(code), arguments.n) for code in vocabulary]
+
+    save_sparse_features(arguments.output, addresses, fields, matrix)
+
+    print("Finished.")
+
+
+if __name__ == '__main__':
+    main()
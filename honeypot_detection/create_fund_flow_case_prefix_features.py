@@ -0,0 +1,274 @@
+import argparse
+
+import numpy as np
+
+from multiprocessing import Pool, cpu_count
+
+from honeypot_detection.create_fund_flow_case_features import concatenate_sparse_shards, iterate_sequence_chunks,\
+    split_input, write_csv_part, write_sparse_part, OUTPUT_FORMAT_CSV, OUTPUT_FORMAT_SPARSE, OUTPUT_FORMATS
+from honeypot_detection.fund_flow_cases import FUND_FLOW_CASE_ID_BY_NAME, INVALID_FUND_FLOW_CASE_ID
+from honeypot_detection.multiprocess_by_address import concatenate_shards, shard_file_path
+
+
+UNIT_TRANSACTIONS = "transactions"
+UNIT_BLOCKS = "blocks"
+
+
+def prefix_spans(prefixes, window, unit):
+    """
+    Every prefix and window is the difference between the cumulative counts of two cuts.
+    :param prefixes: prefix sizes (amount of transactions or blocks from the beginning)
+    :param window: optional size of the windows that end where each prefix ends
+    :param unit: transactions or blocks (only for the names)
+    :return: tuple with the sorted cut values and a list of (name, lower cut index or None, upper cut index)
+    """
+    cut_values = set(prefixes)
+    if window is not None:
+        cut_values.update(max(prefix - window, 0) for prefix in prefixes)
+    cut_values = sorted(cut_values)
+
+    index_by_cut_value = {cut_value: index for index, cut_value in enumerate(cut_values)}
+
+    spans = []
+    for prefix in prefixes:
+        spans.append(("first_{:d}_{}".format(prefix, unit), None, index_by_cut_value[prefix]))
+
+    if window is not None:
+        for prefix in prefixes:
+            lower = max(prefix - window, 0)
+            spans.append(("{}_{:d}_to_{:d}".format(unit, lower, prefix),
+                          index_by_cut_value[lower],
+                          index_by_cut_value[prefix]))
+
+    return cut_values, spans
+
+
+def span_fields(spans, number_of_fund_flow_cases):
+    fields = []
+    for name, _, _ in spans:
+        fields.append("fund_flow_case_count_{}".format(name))
+        for _id in range(1, number_of_fund_flow_cases + 1):
+            fields.append("fund_flow_case_{:d}_frequency_{}".format(_id, name))
+    return fields
+
+
+def transaction_cuts(lengths, cut_values):
+    """
+    :return: matrix with one row per contract and the position in the sequence of each cut (in transactions)
+    """
+    return np.minimum(np.array(cut_values, dtype=np.int64)[np.newaxis, :], lengths[:, np.newaxis])
+
+
+def block_cuts(blocks, lengths, cut_values):
+    """
+    The block prefixes are counted from the block of the first transaction of each contract.
+    The blocks of each sequence are sorted, so each prefix is the amount of cases before the cut block.
+    :return: matrix with one row per contract and the position in the sequence of each cut (in blocks)
+    """
+    number_of_contracts = len(lengths)
+
+    contract_positions = np.repeat(np.arange(number_of_contracts), lengths)
+    # the empty sequences have no first block (but they have no cases to count either)
+    non_empty = lengths > 0
+    first_blocks = np.zeros(number_of_contracts, dtype=np.int64)
+    first_blocks[non_empty] = blocks[(np.cumsum(lengths) - lengths)[non_empty]]
+    relative_blocks = blocks - first_blocks[contract_positions]
+
+    cuts = np.zeros((number_of_contracts, len(cut_values)), dtype=np.int64)
+    for index, cut_value in enumerate(cut_values):
+        cuts[:, index] = np.bincount(contract_positions[relative_blocks < cut_value], minlength=number_of_contracts)
+
+    return cuts
+
+
+def cumulative_case_counts(sequences, lengths, cuts, number_of_fund_flow_cases):
+    """
+    Counts every case before every cut of many contracts with only one pass over the sequences.
+    Each case is counted in the segment between the cuts where it is, and then the segments are accumulated.
+    :param sequences: concatenated fund flow case sequences
+    :param lengths: length of the sequence of each contract
+    :param cuts: matrix with one row per contract and sorted positions in its sequence (up to the length)
+    :param number_of_fund_flow_cases: the case ids go from 1 to this number
+    :return: array with the count of each case (contract, cut, case id - 1) in the positions before each cut
+    """
+    if np.any(sequences == INVALID_FUND_FLOW_CASE_ID) or np.any(sequences > number_of_fund_flow_cases):
+        raise Exception("The sequences contain invalid fund flow case ids.")
+
+    number_of_contracts, number_of_cuts = cuts.shape
+    number_of_segments = number_of_cuts + 1  # the last segment goes from the last cut until the end
+    number_of_columns = number_of_fund_flow_cases + 1  # the first column is the invalid id and it is removed
+
+    # the cuts of consecutive contracts never overlap, so all the cuts are sorted in the concatenated sequences
+    global_cuts = ((np.cumsum(lengths) - lengths)[:, np.newaxis] + cuts).reshape(-1)
+
+    # amount of cuts of the same contract before or at each position
+    contract_positions = np.repeat(np.arange(number_of_contracts), lengths)
+    segments = np.searchsorted(global_cuts, np.arange(len(sequences)), side="right")\
+        - contract_positions * number_of_cuts
+
+    counts = np.bincount((contract_positions * number_of_segments + segments) * number_of_columns + sequences,
+                         minlength=number_of_contracts * number_of_segments * number_of_columns)
+    counts = counts.reshape(number_of_contracts, number_of_segments, number_of_columns)
+
+    # the positions before a cut are the ones in the segments up to the cut
+    return np.cumsum(counts, axis=1)[:, :number_of_cuts, 1:]
+
+
+def span_features(cumulative_counts, spans):
+    """
+    :param cumulative_counts: see cumulative_case_counts
+    :param spans: see prefix_spans
+    :return: matrix with one row per contract and for each span the amount of cases and the frequency of each case
+    """
+    columns = []
+    for _, lower, upper in spans:
+        counts = cumulative_counts[:, upper]
+        if lower is not None:
+            counts = counts - cumulative_counts[:, lower]
+
+        totals = counts.sum(axis=1)
+
+        columns.append(totals[:, np.newaxis])
+        columns.append(counts / np.maximum(totals, 1)[:, np.newaxis])
+
+    return np.concatenate(columns, axis=1)
+
+
+def iterate_prefix_feature_chunks(input_path, number_of_fund_flow_cases, chunk_size, start, end,
+                                  transaction_spans, block_spans):
+    """
+    :param transaction_spans: cut values and spans in transactions (see prefix_spans)
+    :param block_spans: cut values and spans in blocks (see prefix_spans), or None to skip them
+    :return: generator of (addresses, feature matrix) tuples
+    """
+    with_blocks = block_spans is not None
+
+    for chunk in iterate_sequence_chunks(input_path, chunk_size, start, end, with_blocks=with_blocks):
+        addresses, sequences, lengths = chunk[:3]
+
+        transaction_cut_values, spans = transaction_spans
+        cuts = [transaction_cuts(lengths, transaction_cut_values)]
+
+        if with_blocks:
+            block_cut_values, block_only_spans = block_spans
+            cuts.append(block_cuts(chunk[3], lengths, block_cut_values))
+            # the block cuts are placed after the transaction cuts
+            shift = len(transaction_cut_values)
+            spans = spans + [(name, None if lower is None else lower + shift, upper + shift)
+                             for name, lower, upper in block_only_spans]
+
+        cuts = np.concatenate(cuts, axis=1)
+
+        # the cuts of each contract should be sorted for the single pass, and then put back in their places
+        order = np.argsort(cuts, axis=1, kind="stable")
+        sorted_counts = cumulative_case_counts(sequences, lengths, np.take_along_axis(cuts, order, axis=1),
+                                               number_of_fund_flow_cases)
+        cumulative_counts = np.empty_like(sorted_counts)
+        np.put_along_axis(cumulative_counts, order[:, :, np.newaxis], sorted_counts, axis=1)
+
+        yield addresses, span_features(cumulative_counts, spans)
+
+
+def create_prefix_features_part(input_path, output_file_path, fields, chunk_size, start, end, output_format,
+                                transaction_spans, block_spans):
+    """
+    Runs inside each process of the pool and writes the features of one part of the input in its own file.
+    """
+    number_of_fund_flow_cases = len(FUND_FLOW_CASE_ID_BY_NAME)
+
+    feature_chunks = iterate_prefix_feature_chunks(input_path, number_of_fund_flow_cases, chunk_size, start, end,
+                                                   transaction_spans, block_spans)
+
+    if output_format == OUTPUT_FORMAT_CSV:
+        write_csv_part(output_file_path, fields, feature_chunks)
+    elif output_format == OUTPUT_FORMAT_SPARSE:
+        write_sparse_part(output_file_path, fields, feature_chunks)
+    else:
+        raise Exception("Invalid output format '{}'".format(output_format))
+
+    return output_file_path
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Create the fund flow case features of the first transactions or blocks of each contract.")
+
+    argument_parser.add_argument("input", type=str, help="Input sequence store directory or file in csv format.")
+    argument_parser.add_argument("output", type=str,
+                                 help="Output file in csv format, or in npz format for the sparse output format.")
+
+    argument_parser.add_argument("--transactions", type=int, nargs="+", default=[1, 2, 5, 10, 20, 50],
+                                 help="Amounts of first transactions of each contract (one group of features each).")
+    argument_parser.add_argument("--transaction_window", type=int,
+                                 help="Add the features of the last transactions (this amount) of every prefix.")
+    argument_parser.add_argument("--blocks", type=int, nargs="+",
+                                 help="Amounts of blocks after the first transaction of each contract"
+                                      + " (one group of features each). The sequence store should have blocks.")
+    argument_parser.add_argument("--block_window", type=int,
+                                 help="Add the features of the last blocks (this amount) of every block prefix.")
+
+    argument_parser.add_argument("--processes", type=int, help="Number of processes. Default is cpu_count() - 1.")
+    argument_parser.add_argument("--parts", type=int,
+                                 help="Number of parts in which the input is split. Default is 4 per process.")
+    argument_parser.add_argument("--chunk_size", type=int, default=1000,
+                                 help="Number of contracts whose features are computed at once.")
+    argument_parser.add_argument("--output_format", type=str, choices=OUTPUT_FORMATS, default=OUTPUT_FORMAT_CSV,
+                                 help="Write a dense csv file (csv) or a CSR sparse matrix in npz format"
+                                      + " with the contract addresses and the column names in sidecar files (sparse).")
+
+    arguments = argument_parser.parse_args()
+
+    for size in arguments.transactions + (arguments.blocks or []):
+        if size < 1:
+            raise Exception("The prefix sizes should be positive.")
+
+    if arguments.block_window is not None and arguments.blocks is None:
+        raise Exception("The block window needs block prefixes.")
+
+    num_processes = arguments.processes
+    if num_processes is None:
+        num_processes = max(cpu_count() - 1, 1)
+
+    num_parts = arguments.parts
+    if num_parts is None:
+        num_parts = num_processes * 4
+
+    number_of_fund_flow_cases = len(FUND_FLOW_CASE_ID_BY_NAME)
+
+    transaction_spans = prefix_spans(arguments.transactions, arguments.transaction_window, UNIT_TRANSACTIONS)
+    spans = transaction_spans[1]
+
+    if arguments.blocks is None:
+        block_spans = None
+    else:
+        block_spans = prefix_spans(arguments.blocks, arguments.block_window, UNIT_BLOCKS)
+        spans = spans + block_spans[1]
+
+    # compute the fields
+    fields = ["contract_address"] + span_fields(spans, number_of_fund_flow_cases)
+
+    print("Start...")
+
+    if arguments.output_format == OUTPUT_FORMAT_CSV:
+        concatenate = concatenate_shards
+    elif arguments.output_format == OUTPUT_FORMAT_SPARSE:
+        concatenate = concatenate_sparse_shards
+    else:
+        raise Exception("Invalid output format '{}'".format(arguments.output_format))
+
+    # each part is written in its own shard file
+    tasks = [(arguments.input, shard_file_path(arguments.output, index), fields, arguments.chunk_size, start, end,
+              arguments.output_format, transaction_spans, block_spans)
+             for index, (start, end) in enumerate(split_input(arguments.input, num_parts))]
+
+    with Pool(num_processes) as pool:
+        shard_file_paths = pool.starmap(create_prefix_features_part, tasks)
+
+    # the shards keep the input order
+    concatenate(shard_file_paths, arguments.output, fields)
+
+    print("Finished.")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,197 +1,202 @@
 import argparse
 
-from collections import Counter
-
-from honeypot_detection.fund_flow_cases import FUND_FLOW_CASE_ID_BY_NAME, create_fund_flow_case_if_valid
-from honeypot_detection.database.contract import Contract
-from honeypot_detection.database.transaction import NormalTransaction, InternalTransaction
-from honeypot_detection.multiprocess_by_address import multiprocess_by_address, Worker
+import numpy as np
+
+from functools import partial
+from itertools import groupby
+
+from sqlalchemy import LargeBinary
+
+from honeypot_detection.balance_deltas import calculate_balances, fund_flow_case_codes, summarize_balances,\
+    BALANCE_DELTA_FIELDS
+from honeypot_detection.contract_transactions import transaction_index_order
+from honeypot_detection.database.balance_delta import BalanceDeltaContract, TransactionBalanceDelta
+from honeypot_detection.fund_flow_cases import fund_flow_case_ids_if_valid
+from honeypot_detection.multiprocess_by_address import Worker, OUTPUT_MODE_SINGLE
+from honeypot_detection.run_by_address import add_run_by_address_arguments, run_by_address, run_with_output
+from honeypot_detection.sequence_store import SequenceStoreOutput
+from honeypot_detection.transaction_extractor import add_extractor_arguments, extractor_worker_options,\
+    TransactionExtractor, TransactionExtractorWorker
+from honeypot_detection.transaction_validation import check_internal_transaction, check_normal_transaction
 from honeypot_detection.utils import address_list_from_file
 
 
-BALANCE_TOLERANCE = 1e-6
+# increase every time the sequences change (used for the database output)
+FEATURE_VERSION = 2
 
 COLUMNS = ["address", "value"]
 
+# the only transaction columns used by the cases (the rest are not loaded)
+TRANSACTION_CASE_COLUMNS = [
+    "hash",
+    "block_number",
+    "source",
+    "target",
+    "contract_address",
+    "crawled_from",
+    "value",
+    "value_wei",
+    "is_error",
+]
+
+# the sequences are bytes (used for the database output)
+COLUMN_TYPES = {"value": LargeBinary()}
+
+
+class FundFlowCaseSequenceExtractor(TransactionExtractor):
+
+    columns = TRANSACTION_CASE_COLUMNS
+
+    # the cases are classified together in blocks of transactions
+    block_size = 1024
+
+    # add the block number of each case to the output row (only for the sequence store output)
+    with_blocks = False
+
+    def __init__(self, contract, validate=False):
+        super(FundFlowCaseSequenceExtractor, self).__init__(contract, validate=validate)
+        # one byte per case id instead of one integer object
+        self.sequence = bytearray()
+        self.block_numbers = []
+        self.contract_created = False
+        # transactions waiting to be classified (see fund_flow_case_ids)
+        self.block = []
+
+    def add(self, transaction, children):
+        if self.validate:
+            check_normal_transaction(self.contract, transaction, self.contract_created)
+            for child in children:
+                check_internal_transaction(child)
+
+        # creation transaction
+        creation = transaction.target is None
+        if creation:
+            # this was the creation transaction
+            self.contract_created = True
+
+        # internal transaction errors
+        error = transaction.is_error
+        for child in children:
+            error = error or child.is_error
 
-class FundFlowCaseSequenceWorker(Worker):
+        balances = calculate_balances(self.contract, transaction, children)
+        deltas = summarize_balances(self.contract, transaction, balances)
 
-    def process_address(self, address):
-        # get the contract
-        contract = self.sqlalchemy_session.query(Contract).filter(Contract.address == address).one()
+        self.block_numbers.append(transaction.block_number)
+        self.block.append((transaction.hash, creation, transaction.source == self.contract.creator, error)
+                          + tuple(deltas[field] for field in BALANCE_DELTA_FIELDS))
 
-        # process to get the sequence
-        sequence = self._contract_sequence(contract)
+        if len(self.block) >= self.block_size:
+            self._classify_block()
 
+    def build(self):
+        self._classify_block()
         # transform sequence as bytes because some sequences are too long (and each id fits in one byte anyways)
-        self.send_output({"address": address, "value": bytes(sequence)})
-
-    def _contract_sequence(self, contract):
-        sequence = []
-        contract_created = False
-
-        transactions = self.sqlalchemy_session.query(NormalTransaction). \
-            filter(NormalTransaction.crawled_from == contract.address). \
-            order_by(NormalTransaction.block_number.asc(),
-                     NormalTransaction.transaction_index.asc()).all()
-
-        for transaction in transactions:
-            # transactions should always have source
-            assert transaction.source is not None, transaction.hash
-            # transaction is not sent and received by the same party
-            assert transaction.source != transaction.target, transaction.hash
-
-            # creation transaction
-            if transaction.target is None:
-                # there should be only one creation transaction
-                assert not contract_created, transaction.hash
-                # this was the creation transaction
-                contract_created = True
-                # create the case
-                case = self._creation_transaction_case(contract, transaction)
-            # other transaction
-            else:
-                # create the case
-                case = self._normal_transaction_case(contract, transaction)
-
-            # add the case id to the sequence
-            sequence.append(FUND_FLOW_CASE_ID_BY_NAME[case])
-
-        return sequence
-
-    def _creation_transaction_case(self, contract, transaction):
-        # in the creation transaction the creator is the source
-        assert transaction.source == contract.creator, transaction.hash
-        # the contract address added by me should match
-        assert transaction.crawled_from == contract.address, transaction.hash
-
-        # return the case if it is valid
-        case_values = self._extract_case_values(contract, transaction, other_sender=False, creation=True)
-        return create_fund_flow_case_if_valid(transaction, case_values)
-
-    def _normal_transaction_case(self, contract, transaction):
-        # non-creation transactions have no contract address
-        assert transaction.contract_address is None, transaction.hash
-        # only the one added by me
-        assert transaction.crawled_from == contract.address, transaction.hash
-        # the contract is always the target
-        assert transaction.target == contract.address
-
-        # the creator is the source
-        if transaction.source == contract.creator:
-            case_values = self._extract_case_values(contract, transaction, other_sender=False)
-
-        # other is the source
-        else:
-            case_values = self._extract_case_values(contract, transaction, other_sender=True)
-
-        # return the case if it is valid
-        return create_fund_flow_case_if_valid(transaction, case_values)
-
-    def _extract_case_values(self, contract, transaction, other_sender=False, creation=False):
-        # initialize values (they might change afterwards)
-        case_values = {
-            "sender": ("other" if other_sender else "creator"),
-            "error": transaction.is_error,
-            "balance_creator": "unchanged",
-            "balance_contract": "unchanged",
-            "balance_other_positive": False,
-            "balance_other_negative": False,
-        }
-
-        # case specific values
-        if other_sender:
-            case_values["balance_sender"] = "unchanged"
-        else:
-            case_values["creation"] = creation
-
-        # initialize balances with transaction value movement (if present)
-        balances = Counter()
-        value = int(transaction.value)
-        if value > 0:
-            # the source can be either the creator or another account
-            balances[transaction.source] = -value
-            # the target is always the contract
-            balances[contract.address] = value
-
-        # internal transaction balances and errors
-        children = self.sqlalchemy_session.query(InternalTransaction).\
-            filter(InternalTransaction.hash == transaction.hash).all()
+        row = {"address": self.contract.address, "value": bytes(self.sequence)}
+        if self.with_blocks:
+            row["blocks"] = np.array(self.block_numbers, dtype=np.int64).tobytes()
+        return row
 
-        for child in children:
-            case_values["error"] = case_values["error"] or child.is_error
-            balances.update(self._calculate_internal_transaction_balance(child))
-
-        # update the values according to balances
-        for address, value in balances.items():
-            # separate balance into bins
-            if abs(value) < BALANCE_TOLERANCE:  # check if very close to zero to avoid arithmetic errors
-                value_bin = "unchanged"
-            elif value > 0:
-                value_bin = "positive"
-            else:
-                value_bin = "negative"
-
-            # balance creator
-            if address == contract.creator:
-                case_values["balance_creator"] = value_bin
-
-            # balance contract
-            elif address == contract.address:
-                case_values["balance_contract"] = value_bin
-
-            # balance sender
-            elif address == transaction.source:
-                assert other_sender
-                assert transaction.source != contract.creator
-                case_values["balance_sender"] = value_bin
-
-            # balance other
-            else:
-                # at least one other account has a positive balance
-                if value_bin == "positive":
-                    case_values["balance_other_positive"] = True
-
-                # at least one other account has a negative balance
-                if value_bin == "negative":
-                    case_values["balance_other_negative"] = True
-
-        return case_values
-
-    @staticmethod
-    def _calculate_internal_transaction_balance(transaction):
-        # transactions should always have source
-        assert transaction.source is not None, transaction.hash
-
-        balance = Counter()
-        value = int(transaction.value)
-
-        # if value is moved
-        if value > 0:
-            # the source loses the value
-            balance[transaction.source] = -value
-
-            # creation transaction
-            if transaction.target is None:
-                # the source is the contract that created this transaction
-                assert transaction.source == transaction.crawled_from, transaction.hash
-                # the new contract should not be the contract that created this transaction
-                assert transaction.contract_address != transaction.crawled_from, transaction.hash
-                # the new contract gets the value
-                balance[transaction.contract_address] = value
-            # non-creation transaction
-            else:
-                # non-creation transactions have no contract address
-                assert transaction.contract_address is None, transaction.hash
-
-                # IMPORTANT: _contract_address can be != contract["address"]
-                # children from a transaction can be from another contract
-
-                # the target gets the value
-                # the + should be used, or else transactions with same source and target will get a wrong balance
-                balance[transaction.target] += value
-
-        return balance
+    def _classify_block(self):
+        # add the case ids to the sequence
+        self.sequence.extend(fund_flow_case_ids(self.block).tobytes())
+        self.block = []
+
+
+def fund_flow_case_ids(rows):
+    """
+    Classifies many transactions at once.
+    :param rows: one tuple per transaction with the hash, the creation flag, the flag that indicates if the sender
+    is the creator, the error flag and the balance delta fields (in that order)
+    :return: array of fund flow case ids (uint8)
+    """
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    columns = list(zip(*rows))
+
+    transaction_hashes = columns[0]
+    creation = np.array(columns[1], dtype=bool)
+    sender_is_creator = np.array(columns[2], dtype=bool)
+    error = np.array(columns[3], dtype=bool)
+    # the deltas can be larger than 64 bit integers
+    deltas = {field: np.array(column, dtype=object) for field, column in zip(BALANCE_DELTA_FIELDS, columns[4:])}
+
+    # the creation transaction is always sent by the creator
+    other_sender = ~(creation | sender_is_creator)
+
+    codes = fund_flow_case_codes(deltas, error, creation, other_sender)
+
+    return fund_flow_case_ids_if_valid(transaction_hashes, codes)
+
+
+class FundFlowCaseBlockSequenceExtractor(FundFlowCaseSequenceExtractor):
+
+    with_blocks = True
+
+
+class FundFlowCaseSequenceWorker(TransactionExtractorWorker):
+
+    extractor_class = FundFlowCaseSequenceExtractor
+
+
+class FundFlowCaseBlockSequenceWorker(TransactionExtractorWorker):
+
+    extractor_class = FundFlowCaseBlockSequenceExtractor
+
+
+class FundFlowCaseSequenceLedgerWorker(Worker):
+    """
+    Creates the same sequences from the materialized balance deltas (see materialize_balance_deltas.py)
+    instead of fetching the transactions, with one query per batch of contracts.
+    The balance deltas should be materialized from the same crawl state.
+    With blocks, the block number of each case is added to the output rows (only for the sequence store output).
+    """
+
+    def __init__(self, sqlalchemy_session, row_writer, with_blocks=False):
+        super(FundFlowCaseSequenceLedgerWorker, self).__init__(sqlalchemy_session, row_writer)
+        self.with_blocks = with_blocks
+
+    def process_batch(self, addresses):
+        materialized_addresses = set(address for address, in self.sqlalchemy_session.
+                                     query(BalanceDeltaContract.address).
+                                     filter(BalanceDeltaContract.address.in_(addresses)))
+
+        rows = self.sqlalchemy_session.query(TransactionBalanceDelta.crawled_from,
+                                             TransactionBalanceDelta.block_number,
+                                             TransactionBalanceDelta.hash,
+                                             TransactionBalanceDelta.creation,
+                                             TransactionBalanceDelta.sender_is_creator,
+                                             TransactionBalanceDelta.error,
+                                             *[getattr(TransactionBalanceDelta, field)
+                                               for field in BALANCE_DELTA_FIELDS]).\
+            filter(TransactionBalanceDelta.crawled_from.in_(addresses)).\
+            order_by(TransactionBalanceDelta.crawled_from.asc(),
+                     TransactionBalanceDelta.block_number.asc(),
+                     transaction_index_order(TransactionBalanceDelta.transaction_index).asc(),
+                     TransactionBalanceDelta.hash.asc()).all()
+
+        ids = fund_flow_case_ids([row[2:] for row in rows])
+        block_numbers = np.array([row.block_number for row in rows], dtype=np.int64)
+
+        # the rows are sorted by contract
+        sequence_by_address = {address: b"" for address in materialized_addresses}
+        blocks_by_address = {address: b"" for address in materialized_addresses}
+        start = 0
+        for address, group in groupby(row.crawled_from for row in rows):
+            end = start + sum(1 for _ in group)
+            sequence_by_address[address] = ids[start:end].tobytes()
+            blocks_by_address[address] = block_numbers[start:end].tobytes()
+            start = end
+
+        for address in addresses:
+            if address not in sequence_by_address:
+                raise Exception("The balance deltas of contract {} were not materialized.".format(address))
+
+            row = {"address": address, "value": sequence_by_address[address]}
+            if self.with_blocks:
+                row["blocks"] = blocks_by_address[address]
+            self.send_output(row)
 
 
 def main():
@@ -200,21 +205,47 @@ def main():
     argument_parser.add_argument("contracts", type=argparse.FileType("r"),
                                  help="File path containing contracts to calculate sequences, one address per line.")
 
-    argument_parser.add_argument("output", type=str, help="Output file in csv format.")
+    add_run_by_address_arguments(argument_parser)
+
+    add_extractor_arguments(argument_parser)
 
-    argument_parser.add_argument("--processes", type=int, help="Number of processes. Default is cpu_count() - 1.")
-    argument_parser.add_argument("--log_every", type=int, default=5, help="How many seconds between count logs.")
+    argument_parser.add_argument("--from_ledger", action="store_true", default=False,
+                                 help="Read the materialized balance deltas instead of the transactions.")
+    argument_parser.add_argument("--sequence_store", action="store_true", default=False,
+                                 help="Write a binary sequence store in the output directory instead of a csv file"
+                                      + " (only with the single output mode).")
+    argument_parser.add_argument("--with_blocks", action="store_true", default=False,
+                                 help="Write the block number of each case in the sequence store"
+                                      + " (needed for the prefix features by blocks).")
 
     arguments = argument_parser.parse_args()
 
     addresses = address_list_from_file(arguments.contracts)
 
-    multiprocess_by_address(addresses,
-                            FundFlowCaseSequenceWorker,
-                            arguments.output,
-                            COLUMNS,
-                            num_processes=arguments.processes,
-                            log_every=arguments.log_every)
+    if arguments.with_blocks and not arguments.sequence_store:
+        raise Exception("The block numbers can only be written in the sequence store.")
+
+    if arguments.sequence_store and arguments.output_mode != OUTPUT_MODE_SINGLE:
+        raise Exception("The sequence store can only be written with the single output mode.")
+
+    if arguments.from_ledger:
+        worker_class = partial(FundFlowCaseSequenceLedgerWorker, with_blocks=arguments.with_blocks)
+    elif arguments.with_blocks:
+        worker_class = partial(FundFlowCaseBlockSequenceWorker, **extractor_worker_options(arguments))
+    else:
+        worker_class = partial(FundFlowCaseSequenceWorker, **extractor_worker_options(arguments))
+
+    if arguments.sequence_store:
+        output = SequenceStoreOutput(arguments.output, incremental=arguments.incremental,
+                                     with_blocks=arguments.with_blocks)
+        run_with_output(arguments, addresses, worker_class, output)
+    else:
+        run_by_address(arguments,
+                       addresses,
+                       worker_class,
+                       COLUMNS,
+                       output_version=FEATURE_VERSION,
+                       output_column_types=COLUMN_TYPES)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,78 @@
+import argparse
+import os
+
+from functools import partial
+
+from honeypot_detection import create_fund_flow_case_sequences, create_transaction_features
+from honeypot_detection.multiprocess_by_address import create_output, RoutedOutput, OUTPUT_MODE_DATABASE
+from honeypot_detection.run_by_address import add_run_by_address_arguments, run_with_output
+from honeypot_detection.transaction_extractor import add_extractor_arguments, extractor_worker_options,\
+    FusedTransactionWorker
+from honeypot_detection.utils import address_list_from_file
+
+
+# everything needed to create the output of each extractor
+EXTRACTORS = {
+    "transaction_features": {
+        "extractor_class": create_transaction_features.TransactionFeatureExtractor,
+        "field_names": create_transaction_features.COLUMNS,
+        "version": create_transaction_features.FEATURE_VERSION,
+        "column_types": None,
+    },
+    "fund_flow_case_sequences": {
+        "extractor_class": create_fund_flow_case_sequences.FundFlowCaseSequenceExtractor,
+        "field_names": create_fund_flow_case_sequences.COLUMNS,
+        "version": create_fund_flow_case_sequences.FEATURE_VERSION,
+        "column_types": create_fund_flow_case_sequences.COLUMN_TYPES,
+    },
+}
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Create several outputs per contract fetching the transactions only once.")
+
+    argument_parser.add_argument("contracts", type=argparse.FileType("r"),
+                                 help="File path containing contracts to process, one address per line.")
+
+    add_run_by_address_arguments(argument_parser,
+                                 output_help="Directory for the csv outputs (one file per extractor),"
+                                             + " or feature table name prefix for the database output mode.")
+
+    argument_parser.add_argument("--extractors", type=str, nargs="+", choices=EXTRACTORS.keys(),
+                                 default=list(EXTRACTORS.keys()),
+                                 help="Which outputs should be created. Default is all of them.")
+    add_extractor_arguments(argument_parser)
+
+    arguments = argument_parser.parse_args()
+
+    addresses = address_list_from_file(arguments.contracts)
+
+    outputs_by_name = {}
+    extractor_classes_by_name = {}
+    for name in arguments.extractors:
+        extractor = EXTRACTORS[name]
+
+        if arguments.output_mode == OUTPUT_MODE_DATABASE:
+            output_path = arguments.output + name
+        else:
+            output_path = os.path.join(arguments.output, name + ".csv")
+
+        outputs_by_name[name] = create_output(arguments.output_mode,
+                                              output_path,
+                                              extractor["field_names"],
+                                              incremental=arguments.incremental,
+                                              version=extractor["version"],
+                                              column_types=extractor["column_types"])
+
+        extractor_classes_by_name[name] = extractor["extractor_class"]
+
+    worker_class = partial(FusedTransactionWorker,
+                           extractor_classes_by_name=extractor_classes_by_name,
+                           **extractor_worker_options(arguments))
+
+    run_with_output(arguments, addresses, worker_class, RoutedOutput(outputs_by_name))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
 import argparse
 
+from sqlalchemy import func
+
 from honeypot_detection.database.contract import Contract
-from honeypot_detection.multiprocess_by_address import multiprocess_by_address, Worker
+from honeypot_detection.multiprocess_by_address import Worker
+from honeypot_detection.run_by_address import add_run_by_address_arguments, run_by_address
 from honeypot_detection.utils import address_list_from_file
 
 
+# increase every time the features change (used for the database output)
+FEATURE_VERSION = 1
+
 COLUMNS = [
     "contract_address",
     "contract_has_source_code",
@@ -18,11 +24,26 @@ COLUMNS = [
 ]
 
 
+# same as splitting the source code by line breaks, but without loading the source code
+NUM_SOURCE_CODE_LINES = func.length(Contract.source_code) \
+                        - func.length(func.replace(Contract.source_code, "\n", "")) + 1
+
+
 class SourceCodeFeatureWorker(Worker):
 
-    def process_address(self, address):
-        features = {"contract_address": address}
-        contract = self.sqlalchemy_session.query(Contract).filter(Contract.address == address).one()
+    contract_columns = [
+        Contract.has_source_code,
+        Contract.has_byte_code,
+        Contract.compiler_runs,
+        Contract.compiler_version_major_id,
+        Contract.compiler_version_minor_id,
+        Contract.compiler_version_patch_id,
+        Contract.library_id,
+        NUM_SOURCE_CODE_LINES.label("num_source_code_lines"),
+    ]
+
+    def process_contract(self, contract):
+        features = {"contract_address": contract.address}
 
         features["contract_has_source_code"] = contract.has_source_code
         features["contract_has_byte_code"] = contract.has_byte_code
@@ -31,7 +52,7 @@ class SourceCodeFeatureWorker(Worker):
             # use this feature only if there is source code
             features["contract_compiler_runs"] = contract.compiler_runs
 
-            features["contract_num_source_code_lines"] = len(contract.source_code.split("\n"))
+            features["contract_num_source_code_lines"] = contract.num_source_code_lines
         else:
             # force no runs if there is no source code
             features["contract_compiler_runs"] = None
@@ -50,21 +71,17 @@ def main():
     argument_parser.add_argument("contracts", type=argparse.FileType("r"),
                                  help="File path containing contracts to crawl, one address per line.")
 
-    argument_parser.add_argument("output", type=str, help="Output file in csv format.")
-
-    argument_parser.add_argument("--processes", type=int, help="Number of processes. Default is cpu_count() - 1.")
-    argument_parser.add_argument("--log_every", type=int, default=5, help="How many seconds between count logs.")
+    add_run_by_address_arguments(argument_parser)
 
     arguments = argument_parser.parse_args()
 
     addresses = address_list_from_file(arguments.contracts)
 
-    multiprocess_by_address(addresses,
-                            SourceCodeFeatureWorker,
-                            arguments.output,
-                            COLUMNS,
-                            num_processes=arguments.processes,
-                            log_every=arguments.log_every)
+    run_by_address(arguments,
+                   addresses,
+                   SourceCodeFeatureWorker,
+                   COLUMNS,
+                   output_version=FEATURE_VERSION)
 
 
 if __name__ == '__main__':
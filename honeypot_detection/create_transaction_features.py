@@ -1,13 +1,44 @@
 import argparse
+import math
+
+from functools import partial
 
 import numpy as np
 
+from sqlalchemy import and_, case, cast, distinct, false, func, or_, select, Float
+
+from honeypot_detection.accumulators import StatisticsAccumulator
+from honeypot_detection.contract_transactions import fetch_normal_transaction_columns,\
+    fetch_internal_transaction_columns, CHRONOLOGICAL_ORDER
 from honeypot_detection.database.contract import Contract
 from honeypot_detection.database.transaction import NormalTransaction, InternalTransaction
-from honeypot_detection.multiprocess_by_address import multiprocess_by_address, Worker
+from honeypot_detection.multiprocess_by_address import Worker
+from honeypot_detection.run_by_address import add_run_by_address_arguments, run_by_address
+from honeypot_detection.transaction_extractor import add_extractor_arguments, extractor_worker_options,\
+    TransactionExtractor, TransactionExtractorWorker
+from honeypot_detection.transaction_validation import check_internal_transaction, check_normal_transaction,\
+    check_violations, find_internal_transaction_violations, find_normal_transaction_violations
 from honeypot_detection.utils import address_list_from_file
 
 
+# increase every time the features change (used for the database output)
+FEATURE_VERSION = 1
+
+# the only transaction columns used by the features (the rest are not loaded)
+TRANSACTION_FEATURE_COLUMNS = [
+    "hash",
+    "source",
+    "target",
+    "contract_address",
+    "crawled_from",
+    "block_number",
+    "timestamp",
+    "value",
+    "gas",
+    "gas_used",
+    "is_error",
+]
+
 COLUMNS = [
     "contract_address",
     "normal_transaction_count",
@@ -48,233 +79,703 @@ COLUMNS = [
 ]
 
 
-class TransactionFeatureWorker(Worker):
+def aggregate_features(features, name, accumulator):
+    if accumulator.count > 0:
+        features[name + "_mean"] = accumulator.mean
+        features[name + "_std"] = accumulator.std()
 
-    def process_address(self, address):
-        features = {"contract_address": address}
-        contract = self.sqlalchemy_session.query(Contract).filter(Contract.address == address).one()
 
-        internal_transactions = self._build_normal_transaction_features(contract, features)
-        self._build_internal_transaction_features(contract, features, internal_transactions)
+class NormalTransactionFeatures:
+    """
+    Normal transaction features of one contract, updated one transaction at a time in chronological order.
+    """
 
-        self.send_output(features)
+    def __init__(self, contract, validate=False):
+        self.contract = contract
+        self.validate = validate
 
-    def _build_normal_transaction_features(self, contract, features):
-        transactions = self.sqlalchemy_session.query(NormalTransaction). \
-            filter(NormalTransaction.crawled_from == contract.address). \
-            order_by(NormalTransaction.block_number.asc(),
-                     NormalTransaction.transaction_index.asc()).all()
-
-        features["normal_transaction_count"] = 0
-        features["normal_transaction_block_count"] = 0
-        features["normal_transaction_before_creation_count"] = 0
-        features["normal_transaction_from_other_count"] = 0
-
-        last_block = None
-        last_block_count = 0
-        count_per_block = []
-        other_senders = set()
-        values = []
-        gas = []
-        gas_used = []
-        last_timestamp = None
-        time_deltas = []
-        block_deltas = []
-        contract_created = False
-        children = []
-
-        for transaction in transactions:
-            # transactions should always have source
-            assert transaction.source is not None, transaction.hash
-            # transaction is not sent and received by the same party
-            assert transaction.source != transaction.target, transaction.hash
-
-            features["normal_transaction_count"] += 1
-
-            # creation transaction
-            if transaction.target is None:
-                # there should be only one creation transaction
-                assert not contract_created, transaction.hash
-                # this was the creation transaction
-                contract_created = True
-
-                # in the creation transaction the creator is the source
-                assert transaction.source == contract.creator, transaction.hash
-                # the contract address added by me should match
-                assert transaction.crawled_from == contract.address, transaction.hash
-
-            # other transaction
-            else:
-                # non-creation transactions have no contract address
-                assert transaction.contract_address is None, transaction.hash
-                # only the one added by me
-                assert transaction.crawled_from == contract.address, transaction.hash
-                # the contract is always the target
-                assert transaction.target == contract.address
-
-                # this was before the creation transaction
-                if not contract_created:
-                    features["normal_transaction_before_creation_count"] += 1
-
-            # first or new block
-            if last_block is None or transaction.block_number != last_block:
-                # new block
-                if last_block is not None and last_block_count > 0:
-                    count_per_block.append(last_block_count)
-                    last_block_count = 0
-
-                # count block
-                features["normal_transaction_block_count"] += 1
-
-            # count transaction
-            last_block_count += 1
-
-            # the creator is the source
-            if transaction.source != contract.creator:
-                other_senders.add(transaction.source)
-                features["normal_transaction_from_other_count"] += 1
+        self.features = {
+            "normal_transaction_count": 0,
+            "normal_transaction_block_count": 0,
+            "normal_transaction_before_creation_count": 0,
+            "normal_transaction_from_other_count": 0,
+        }
 
-            # only count eth movement if there is no error
-            if not transaction.is_error:
-                values.append(transaction.value)
-            gas.append(transaction.gas)
-            gas_used.append(transaction.gas_used)
-
-            # time delta
-            if last_timestamp is not None:
-                time_deltas.append(transaction.timestamp - last_timestamp)
-            # update timestamp
-            last_timestamp = transaction.timestamp
-
-            # block delta
-            if last_block is not None:
-                block_deltas.append(transaction.block_number - last_block)
-            # first block
-            else:
-                features["normal_transaction_first_block"] = transaction.block_number
-            # update block
-            last_block = transaction.block_number
-
-            # append all the children from this transaction
-            children.extend(self._fetch_transaction_children(transaction))
+        self.last_block = None
+        self.last_block_count = 0
+        self.count_per_block = StatisticsAccumulator()
+        self.other_senders = set()
+        self.values = StatisticsAccumulator()
+        self.gas = StatisticsAccumulator()
+        self.gas_used = StatisticsAccumulator()
+        self.last_timestamp = None
+        self.time_deltas = StatisticsAccumulator()
+        self.block_deltas = StatisticsAccumulator()
+        self.contract_created = False
+
+    def add(self, transaction):
+        contract = self.contract
+        features = self.features
+
+        if self.validate:
+            check_normal_transaction(contract, transaction, self.contract_created)
+
+        features["normal_transaction_count"] += 1
+
+        # creation transaction
+        if transaction.target is None:
+            # this was the creation transaction
+            self.contract_created = True
+
+        # other transaction
+        else:
+            # this was before the creation transaction
+            if not self.contract_created:
+                features["normal_transaction_before_creation_count"] += 1
+
+        # first or new block
+        if self.last_block is None or transaction.block_number != self.last_block:
+            # new block
+            if self.last_block is not None and self.last_block_count > 0:
+                self.count_per_block.add(self.last_block_count)
+                self.last_block_count = 0
+
+            # count block
+            features["normal_transaction_block_count"] += 1
+
+        # count transaction
+        self.last_block_count += 1
+
+        # the creator is the source
+        if transaction.source != contract.creator:
+            self.other_senders.add(transaction.source)
+            features["normal_transaction_from_other_count"] += 1
+
+        # only count eth movement if there is no error
+        if not transaction.is_error:
+            self.values.add(transaction.value)
+        self.gas.add(transaction.gas)
+        self.gas_used.add(transaction.gas_used)
+
+        # time delta
+        if self.last_timestamp is not None:
+            self.time_deltas.add(transaction.timestamp - self.last_timestamp)
+        # update timestamp
+        self.last_timestamp = transaction.timestamp
+
+        # block delta
+        if self.last_block is not None:
+            self.block_deltas.add(transaction.block_number - self.last_block)
+        # first block
+        else:
+            features["normal_transaction_first_block"] = transaction.block_number
+        # update block
+        self.last_block = transaction.block_number
+
+    def build(self, features):
+        features.update(self.features)
 
         # last block
-        if last_block is not None and last_block_count > 0:
-            count_per_block.append(last_block_count)
+        if self.last_block is not None and self.last_block_count > 0:
+            self.count_per_block.add(self.last_block_count)
 
-            features["normal_transaction_last_block"] = last_block
-            features["normal_transaction_block_span"] = last_block - features["normal_transaction_first_block"]
+            features["normal_transaction_last_block"] = self.last_block
+            features["normal_transaction_block_span"] = self.last_block - features["normal_transaction_first_block"]
         else:
             features["normal_transaction_last_block"] = features["normal_transaction_first_block"]
             features["normal_transaction_block_span"] = 0
 
         # aggregate features
-        features["normal_transaction_other_sender_count"] = len(other_senders)
-
-        self._aggregate(features, "normal_transaction_count_per_block", count_per_block)
-        self._aggregate(features, "normal_transaction_value", values)
-        self._aggregate(features, "normal_transaction_gas", gas)
-        self._aggregate(features, "normal_transaction_gas_used", gas_used)
-        self._aggregate(features, "normal_transaction_time_delta", time_deltas)
-        self._aggregate(features, "normal_transaction_block_delta", block_deltas)
-
-        # return the internal transactions ordered by normal transactions
-        return children
-
-    def _build_internal_transaction_features(self, contract, features, transactions):
-        features["internal_transaction_count"] = 0
-        features["internal_transaction_block_count"] = 0
-        features["internal_transaction_creation_count"] = 0
-        features["internal_transaction_from_other_count"] = 0
-        features["internal_transaction_to_other_count"] = 0
-
-        last_block = None
-        last_block_count = 0
-        count_per_block = []
-        other_senders = set()
-        other_receivers = set()
-        values = []
-        gas = []
-        gas_used = []
-
-        for transaction in transactions:
-            # transactions should always have source
-            assert transaction.source is not None, transaction.hash
-
-            features["internal_transaction_count"] += 1
-
-            # other contract creation
-            if transaction.target is None:
-                # the source is the contract that created this transaction
-                assert transaction.source == transaction.crawled_from, transaction.hash
-                # the new contract should not be the contract that created this transaction
-                assert transaction.contract_address != transaction.crawled_from, transaction.hash
-                # creation features
-                features["internal_transaction_creation_count"] += 1
-            # no other contract is created
-            else:
-                # non-creation transactions have no contract address
-                assert transaction.contract_address is None, transaction.hash
-
-                # IMPORTANT: _contract_address can be != contract["address"]
-                # children from a transaction can be from another contract
-
-            # first or new block
-            if last_block is None or transaction.block_number != last_block:
-                # new block
-                if last_block is not None and last_block_count > 0:
-                    count_per_block.append(last_block_count)
-                    last_block_count = 0
-
-                # count block
-                features["internal_transaction_block_count"] += 1
-
-            # count transaction
-            last_block_count += 1
-
-            # from other
-            if transaction.source not in [contract.address, contract.creator]:
-                other_senders.add(transaction.source)
-                features["internal_transaction_from_other_count"] += 1
-
-            # to other
-            if transaction.target not in [contract.address, contract.creator]:
-                other_receivers.add(transaction.target)
-                features["internal_transaction_to_other_count"] += 1
-
-            # update block
-            last_block = transaction.block_number
-
-            # only count eth movement if there is no error
-            if not transaction.is_error:
-                values.append(transaction.value)
-            gas.append(transaction.gas)
-            gas_used.append(transaction.gas_used)
+        features["normal_transaction_other_sender_count"] = len(self.other_senders)
+
+        aggregate_features(features, "normal_transaction_count_per_block", self.count_per_block)
+        aggregate_features(features, "normal_transaction_value", self.values)
+        aggregate_features(features, "normal_transaction_gas", self.gas)
+        aggregate_features(features, "normal_transaction_gas_used", self.gas_used)
+        aggregate_features(features, "normal_transaction_time_delta", self.time_deltas)
+        aggregate_features(features, "normal_transaction_block_delta", self.block_deltas)
+
+
+class InternalTransactionFeatures:
+    """
+    Internal transaction features of one contract, updated one transaction at a time in the order of their parents.
+    """
+
+    def __init__(self, contract, validate=False):
+        self.contract = contract
+        self.validate = validate
+
+        self.features = {
+            "internal_transaction_count": 0,
+            "internal_transaction_block_count": 0,
+            "internal_transaction_creation_count": 0,
+            "internal_transaction_from_other_count": 0,
+            "internal_transaction_to_other_count": 0,
+        }
+
+        self.last_block = None
+        self.last_block_count = 0
+        self.count_per_block = StatisticsAccumulator()
+        self.other_senders = set()
+        self.other_receivers = set()
+        self.values = StatisticsAccumulator()
+        self.gas = StatisticsAccumulator()
+        self.gas_used = StatisticsAccumulator()
+
+    def add(self, transaction):
+        contract = self.contract
+        features = self.features
+
+        if self.validate:
+            check_internal_transaction(transaction)
+
+        features["internal_transaction_count"] += 1
+
+        # other contract creation
+        if transaction.target is None:
+            # creation features
+            features["internal_transaction_creation_count"] += 1
+
+        # first or new block
+        if self.last_block is None or transaction.block_number != self.last_block:
+            # new block
+            if self.last_block is not None and self.last_block_count > 0:
+                self.count_per_block.add(self.last_block_count)
+                self.last_block_count = 0
+
+            # count block
+            features["internal_transaction_block_count"] += 1
+
+        # count transaction
+        self.last_block_count += 1
+
+        # from other
+        if transaction.source not in [contract.address, contract.creator]:
+            self.other_senders.add(transaction.source)
+            features["internal_transaction_from_other_count"] += 1
+
+        # to other
+        if transaction.target not in [contract.address, contract.creator]:
+            self.other_receivers.add(transaction.target)
+            features["internal_transaction_to_other_count"] += 1
+
+        # update block
+        self.last_block = transaction.block_number
+
+        # only count eth movement if there is no error
+        if not transaction.is_error:
+            self.values.add(transaction.value)
+        self.gas.add(transaction.gas)
+        self.gas_used.add(transaction.gas_used)
+
+    def build(self, features):
+        features.update(self.features)
 
         # last block
-        if last_block is not None and last_block_count > 0:
-            count_per_block.append(last_block_count)
+        if self.last_block is not None and self.last_block_count > 0:
+            self.count_per_block.add(self.last_block_count)
 
         # aggregate features
-        features["internal_transaction_other_sender_count"] = len(other_senders)
-        features["internal_transaction_other_receiver_count"] = len(other_receivers)
+        features["internal_transaction_other_sender_count"] = len(self.other_senders)
+        features["internal_transaction_other_receiver_count"] = len(self.other_receivers)
+
+        aggregate_features(features, "internal_transaction_count_per_block", self.count_per_block)
+        aggregate_features(features, "internal_transaction_value", self.values)
+        aggregate_features(features, "internal_transaction_gas", self.gas)
+        aggregate_features(features, "internal_transaction_gas_used", self.gas_used)
+
+
+class TransactionFeatureExtractor(TransactionExtractor):
+
+    columns = TRANSACTION_FEATURE_COLUMNS
+
+    def __init__(self, contract, validate=False):
+        super(TransactionFeatureExtractor, self).__init__(contract, validate=validate)
+        self.normal_transaction_features = NormalTransactionFeatures(contract, validate=validate)
+        self.internal_transaction_features = InternalTransactionFeatures(contract, validate=validate)
+
+    def add(self, transaction, children):
+        self.normal_transaction_features.add(transaction)
+        # the internal transactions are visited in the order of the normal transactions
+        for child in children:
+            self.internal_transaction_features.add(child)
+
+    def build(self):
+        features = {"contract_address": self.contract.address}
+        self.normal_transaction_features.build(features)
+        self.internal_transaction_features.build(features)
+        return features
+
+
+class TransactionFeatureWorker(TransactionExtractorWorker):
+    """
+    Computes the features in one pass over the transactions of each contract without keeping them.
+    """
+
+    extractor_class = TransactionFeatureExtractor
+
+
+def column_arrays(rows):
+    """
+    Transposes the fetched rows into one object array per column (the values can be empty).
+    """
+    columns = []
+    for column in zip(*rows):
+        array = np.empty(len(column), dtype=object)
+        array[:] = column
+        columns.append(array)
+    return columns
+
+
+def check_contract_transactions(sqlalchemy_session, address, creator):
+    """
+    Checks all the transactions of one contract at once and fails on the first invalid one.
+    """
+    rows = fetch_normal_transaction_columns(sqlalchemy_session,
+                                            address,
+                                            NormalTransaction.hash,
+                                            NormalTransaction.source,
+                                            NormalTransaction.target,
+                                            NormalTransaction.contract_address)
+
+    if len(rows) > 0:
+        hashes, sources, targets, contract_addresses = column_arrays(rows)
+        check_violations(hashes, find_normal_transaction_violations(address, creator, sources, targets,
+                                                                    contract_addresses))
+
+    rows = fetch_internal_transaction_columns(sqlalchemy_session,
+                                              address,
+                                              InternalTransaction.hash,
+                                              InternalTransaction.source,
+                                              InternalTransaction.target,
+                                              InternalTransaction.contract_address,
+                                              InternalTransaction.crawled_from)
+
+    if len(rows) > 0:
+        hashes, sources, targets, contract_addresses, crawled_froms = column_arrays(rows)
+        check_violations(hashes, find_internal_transaction_violations(sources, targets, contract_addresses,
+                                                                      crawled_froms))
+
+
+class NumpyTransactionFeatureWorker(Worker):
+    """
+    Computes the same features as TransactionFeatureWorker with array operations.
+    Only the needed columns are fetched (as tuples instead of entities) and turned into numpy arrays.
+    With validation, all the transactions of each contract are checked at once (see transaction_validation).
+    Empty numeric values are ignored by the aggregations, like in the database.
+    """
+
+    contract_columns = [Contract.creator]
+
+    def __init__(self, sqlalchemy_session, row_writer, validate=False):
+        super(NumpyTransactionFeatureWorker, self).__init__(sqlalchemy_session, row_writer)
+        self.validate = validate
+
+    def process_contract(self, contract):
+        features = {"contract_address": contract.address}
+
+        self._build_normal_transaction_features(contract.address, contract.creator, features)
+        self._build_internal_transaction_features(contract.address, contract.creator, features)
+
+        self.send_output(features)
+
+    def _build_normal_transaction_features(self, address, creator, features):
+        columns = [NormalTransaction.source,
+                   NormalTransaction.target,
+                   NormalTransaction.block_number,
+                   NormalTransaction.timestamp,
+                   NormalTransaction.value,
+                   NormalTransaction.gas,
+                   NormalTransaction.gas_used,
+                   NormalTransaction.is_error]
+
+        # only needed to check the transactions
+        if self.validate:
+            columns += [NormalTransaction.hash, NormalTransaction.contract_address]
+
+        rows = fetch_normal_transaction_columns(self.sqlalchemy_session, address, *columns)
+
+        features["normal_transaction_count"] = len(rows)
+
+        # contracts without transactions
+        if len(rows) == 0:
+            features["normal_transaction_block_count"] = 0
+            features["normal_transaction_before_creation_count"] = 0
+            features["normal_transaction_from_other_count"] = 0
+            features["normal_transaction_other_sender_count"] = 0
+            return
+
+        columns = column_arrays(rows)
+
+        sources = columns[0]
+        targets = columns[1]
+        block_numbers = np.array(columns[2], dtype=np.int64)
+        timestamps = self._float_array(columns[3])
+        values = self._float_array(columns[4])
+        gas = self._float_array(columns[5])
+        gas_used = self._float_array(columns[6])
+        is_error = self._flag_array(columns[7])
+
+        if self.validate:
+            check_violations(columns[8], find_normal_transaction_violations(address, creator, sources, targets,
+                                                                            columns[9]))
+
+        # creation transactions
+        is_creation = np.equal(targets, None)
+
+        # the creation transaction is not counted because it has no target
+        before_creation = ~is_creation & (np.cumsum(is_creation) == 0)
+
+        count_per_block = self._run_lengths(block_numbers)
+
+        from_other = sources != creator
+
+        features["normal_transaction_block_count"] = len(count_per_block)
+        features["normal_transaction_before_creation_count"] = int(np.count_nonzero(before_creation))
+        features["normal_transaction_from_other_count"] = int(np.count_nonzero(from_other))
+        features["normal_transaction_first_block"] = int(block_numbers[0])
+        features["normal_transaction_last_block"] = int(block_numbers[-1])
+        features["normal_transaction_block_span"] = int(block_numbers[-1] - block_numbers[0])
+        features["normal_transaction_other_sender_count"] = len(np.unique(sources[from_other]))
+
+        self._aggregate(features, "normal_transaction_count_per_block", count_per_block)
+        # only count eth movement if there is no error
+        self._aggregate(features, "normal_transaction_value", values[~is_error])
+        self._aggregate(features, "normal_transaction_gas", gas)
+        self._aggregate(features, "normal_transaction_gas_used", gas_used)
+        self._aggregate(features, "normal_transaction_time_delta", np.diff(timestamps))
+        self._aggregate(features, "normal_transaction_block_delta", np.diff(block_numbers))
+
+    def _build_internal_transaction_features(self, address, creator, features):
+        columns = [InternalTransaction.source,
+                   InternalTransaction.target,
+                   InternalTransaction.block_number,
+                   InternalTransaction.value,
+                   InternalTransaction.gas,
+                   InternalTransaction.gas_used,
+                   InternalTransaction.is_error]
+
+        # only needed to check the transactions
+        if self.validate:
+            columns += [InternalTransaction.hash, InternalTransaction.contract_address,
+                        InternalTransaction.crawled_from]
+
+        rows = fetch_internal_transaction_columns(self.sqlalchemy_session, address, *columns)
+
+        features["internal_transaction_count"] = len(rows)
+
+        # contracts without internal transactions
+        if len(rows) == 0:
+            features["internal_transaction_block_count"] = 0
+            features["internal_transaction_creation_count"] = 0
+            features["internal_transaction_from_other_count"] = 0
+            features["internal_transaction_to_other_count"] = 0
+            features["internal_transaction_other_sender_count"] = 0
+            features["internal_transaction_other_receiver_count"] = 0
+            return
+
+        columns = column_arrays(rows)
+
+        sources = columns[0]
+        targets = columns[1]
+        block_numbers = np.array(columns[2], dtype=np.int64)
+        values = self._float_array(columns[3])
+        gas = self._float_array(columns[4])
+        gas_used = self._float_array(columns[5])
+        is_error = self._flag_array(columns[6])
+
+        if self.validate:
+            check_violations(columns[7], find_internal_transaction_violations(sources, targets, columns[8],
+                                                                              columns[9]))
+
+        # same as checking that the source or target is not in [address, creator]
+        from_other = (sources != address) & (sources != creator)
+        to_other = (targets != address) & (targets != creator)
+
+        count_per_block = self._run_lengths(block_numbers)
+
+        # the empty target of the creation transactions cannot be sorted with the rest
+        other_receivers = targets[to_other]
+        other_receivers_empty = np.equal(other_receivers, None)
+
+        features["internal_transaction_block_count"] = len(count_per_block)
+        features["internal_transaction_creation_count"] = int(np.count_nonzero(np.equal(targets, None)))
+        features["internal_transaction_from_other_count"] = int(np.count_nonzero(from_other))
+        features["internal_transaction_to_other_count"] = int(np.count_nonzero(to_other))
+        features["internal_transaction_other_sender_count"] = len(np.unique(sources[from_other]))
+        features["internal_transaction_other_receiver_count"] = \
+            len(np.unique(other_receivers[~other_receivers_empty])) + int(np.any(other_receivers_empty))
 
         self._aggregate(features, "internal_transaction_count_per_block", count_per_block)
-        self._aggregate(features, "internal_transaction_value", values)
+        # only count eth movement if there is no error
+        self._aggregate(features, "internal_transaction_value", values[~is_error])
         self._aggregate(features, "internal_transaction_gas", gas)
         self._aggregate(features, "internal_transaction_gas_used", gas_used)
 
+    @staticmethod
+    def _float_array(column):
+        """
+        :return: float array where the empty values are nan
+        """
+        return np.array([np.nan if value is None else value for value in column], dtype=np.float64)
+
+    @staticmethod
+    def _flag_array(column):
+        # empty error flags are not errors
+        return np.array([bool(flag) for flag in column], dtype=bool)
+
+    @staticmethod
+    def _run_lengths(block_numbers):
+        """
+        :return: the amount of consecutive transactions in each block
+        """
+        starts = np.flatnonzero(np.concatenate(([True], block_numbers[1:] != block_numbers[:-1])))
+        return np.diff(np.append(starts, len(block_numbers)))
+
     @staticmethod
     def _aggregate(features, name, values):
+        # the empty values are ignored
+        values = values[~np.isnan(values)]
         if len(values) > 0:
-            features[name + "_mean"] = np.mean(values)
-            features[name + "_std"] = np.std(values)
+            # python floats, so no numpy scalar reaches the writers
+            features[name + "_mean"] = float(np.mean(values))
+            features[name + "_std"] = float(np.std(values))
+
+
+class SqlTransactionFeatureWorker(Worker):
+    """
+    Computes the same features as TransactionFeatureWorker but the aggregation is done by the database,
+    with one query for the normal transactions and one query for the internal transactions of many contracts.
+    The database should support window functions (e.g. SQLite >= 3.25, MySQL >= 8 or PostgreSQL).
+    Standard deviations are the average squared distance to the mean of each contract (taken from a window),
+    so they can differ from numpy only in the last decimals.
+    With validation, the transactions of each contract are fetched and checked like in the numpy engine.
+    """
+
+    def __init__(self, sqlalchemy_session, row_writer, validate=False):
+        super(SqlTransactionFeatureWorker, self).__init__(sqlalchemy_session, row_writer)
+        self.validate = validate
+
+    def process_address(self, address):
+        self.process_batch([address])
+
+    def process_batch(self, addresses):
+        if self.validate:
+            contracts = self.sqlalchemy_session.query(Contract.address, Contract.creator).\
+                filter(Contract.address.in_(addresses)).all()
+            for address, creator in contracts:
+                check_contract_transactions(self.sqlalchemy_session, address, creator)
+
+        features_by_address = {address: {"contract_address": address} for address in addresses}
+
+        self._build_normal_transaction_features(addresses, features_by_address)
+        self._build_internal_transaction_features(addresses, features_by_address)
+
+        for address in addresses:
+            self.send_output(features_by_address[address])
+
+    def _build_normal_transaction_features(self, addresses, features_by_address):
+        transactions = NormalTransaction.__table__
+        contracts = Contract.__table__
+
+        # one row per transaction with the values that need the previous transactions or the whole block
+        rows = select([
+            transactions.c.crawled_from.label("address"),
+            contracts.c.creator,
+            transactions.c.source,
+            transactions.c.target,
+            transactions.c.block_number,
+            # only count eth movement if there is no error
+            case([(or_(transactions.c.is_error.is_(None), transactions.c.is_error == false()),
+                   transactions.c.value)]).label("value"),
+            transactions.c.gas,
+            transactions.c.gas_used,
+            (transactions.c.timestamp
+             - func.lag(transactions.c.timestamp).over(partition_by=transactions.c.crawled_from,
+                                                       order_by=CHRONOLOGICAL_ORDER)).label("time_delta"),
+            (transactions.c.block_number
+             - func.lag(transactions.c.block_number).over(partition_by=transactions.c.crawled_from,
+                                                          order_by=CHRONOLOGICAL_ORDER)).label("block_delta"),
+            func.count().over(partition_by=[transactions.c.crawled_from,
+                                            transactions.c.block_number]).label("block_size"),
+            # creation transactions up to this one (the chronological order has no ties, and a frame with
+            # bound offsets is avoided because SQLAlchemy 1.3 binds its parameters out of order)
+            func.sum(case([(transactions.c.target.is_(None), 1)], else_=0)).over(
+                partition_by=transactions.c.crawled_from,
+                order_by=CHRONOLOGICAL_ORDER).label("creations"),
+        ]).select_from(transactions.join(contracts, contracts.c.address == transactions.c.crawled_from)).\
+            where(transactions.c.crawled_from.in_(addresses)).alias("transaction_rows")
+
+        rows = self._with_means(rows, ["value", "gas", "gas_used", "time_delta", "block_delta"])
+
+        from_other = or_(rows.c.creator.is_(None), rows.c.source != rows.c.creator)
+        # a transaction that is not a creation does not count itself
+        before_creation = and_(rows.c.target.isnot(None), rows.c.creations == 0)
+
+        query = select([
+            rows.c.address,
+            func.count().label("normal_transaction_count"),
+            func.count(distinct(rows.c.block_number)).label("normal_transaction_block_count"),
+            func.sum(case([(before_creation, 1)], else_=0)).label("normal_transaction_before_creation_count"),
+            func.sum(case([(from_other, 1)], else_=0)).label("normal_transaction_from_other_count"),
+            func.min(rows.c.block_number).label("normal_transaction_first_block"),
+            func.max(rows.c.block_number).label("normal_transaction_last_block"),
+            func.count(distinct(case([(from_other, rows.c.source)]))).label("normal_transaction_other_sender_count"),
+            func.sum(rows.c.block_size).label("block_size_squares"),
+        ] + self._moment_columns(rows, ["value", "gas", "gas_used", "time_delta", "block_delta"])).\
+            group_by(rows.c.address)
+
+        results = {row["address"]: row for row in self.sqlalchemy_session.execute(query)}
+
+        for address in addresses:
+            features = features_by_address[address]
+            row = results.get(address)
+
+            # contracts without transactions
+            if row is None:
+                for name in ["count", "block_count", "before_creation_count", "from_other_count",
+                             "other_sender_count"]:
+                    features["normal_transaction_" + name] = 0
+                continue
+
+            for name in ["count", "block_count", "before_creation_count", "from_other_count", "first_block",
+                         "last_block", "other_sender_count"]:
+                features["normal_transaction_" + name] = row["normal_transaction_" + name]
+
+            features["normal_transaction_block_span"] = \
+                features["normal_transaction_last_block"] - features["normal_transaction_first_block"]
+
+            self._aggregate_count_per_block(features, "normal_transaction_count_per_block",
+                                            row["normal_transaction_block_count"], row["normal_transaction_count"],
+                                            row["block_size_squares"])
+
+            for name in ["value", "gas", "gas_used", "time_delta", "block_delta"]:
+                self._aggregate(features, "normal_transaction_" + name,
+                                row[name + "_count"], row[name + "_mean"], row[name + "_variance"])
+
+    def _build_internal_transaction_features(self, addresses, features_by_address):
+        transactions = InternalTransaction.__table__
+        parents = NormalTransaction.__table__
+        contracts = Contract.__table__
+
+        # the children of the normal transactions crawled from each contract (matched only by hash)
+        rows = select([
+            parents.c.crawled_from.label("address"),
+            contracts.c.creator,
+            transactions.c.source,
+            transactions.c.target,
+            transactions.c.block_number,
+            # only count eth movement if there is no error
+            case([(or_(transactions.c.is_error.is_(None), transactions.c.is_error == false()),
+                   transactions.c.value)]).label("value"),
+            transactions.c.gas,
+            transactions.c.gas_used,
+            func.count().over(partition_by=[parents.c.crawled_from,
+                                            transactions.c.block_number]).label("block_size"),
+        ]).select_from(transactions.join(parents, parents.c.hash == transactions.c.hash).
+                       join(contracts, contracts.c.address == parents.c.crawled_from)).\
+            where(parents.c.crawled_from.in_(addresses)).alias("transaction_rows")
+
+        rows = self._with_means(rows, ["value", "gas", "gas_used"])
+
+        # same as checking that the source or target is not in [address, creator]
+        from_other = and_(rows.c.source != rows.c.address,
+                          or_(rows.c.creator.is_(None), rows.c.source != rows.c.creator))
+        to_other = or_(and_(rows.c.target.is_(None), rows.c.creator.isnot(None)),
+                       and_(rows.c.target.isnot(None),
+                            rows.c.target != rows.c.address,
+                            or_(rows.c.creator.is_(None), rows.c.target != rows.c.creator)))
+        # the creation transactions are sent to an empty target, which also counts as another receiver
+        to_other_empty = and_(rows.c.target.is_(None), rows.c.creator.isnot(None))
+
+        query = select([
+            rows.c.address,
+            func.count().label("internal_transaction_count"),
+            func.count(distinct(rows.c.block_number)).label("internal_transaction_block_count"),
+            func.sum(case([(rows.c.target.is_(None), 1)], else_=0)).label("internal_transaction_creation_count"),
+            func.sum(case([(from_other, 1)], else_=0)).label("internal_transaction_from_other_count"),
+            func.sum(case([(to_other, 1)], else_=0)).label("internal_transaction_to_other_count"),
+            func.count(distinct(case([(from_other, rows.c.source)]))).
+            label("internal_transaction_other_sender_count"),
+            func.count(distinct(case([(to_other, rows.c.target)]))).label("other_receiver_count"),
+            func.max(case([(to_other_empty, 1)], else_=0)).label("other_receiver_empty"),
+            func.sum(rows.c.block_size).label("block_size_squares"),
+        ] + self._moment_columns(rows, ["value", "gas", "gas_used"])).\
+            group_by(rows.c.address)
+
+        results = {row["address"]: row for row in self.sqlalchemy_session.execute(query)}
+
+        for address in addresses:
+            features = features_by_address[address]
+            row = results.get(address)
+
+            # contracts without internal transactions
+            if row is None:
+                for name in ["count", "block_count", "creation_count", "from_other_count", "to_other_count",
+                             "other_sender_count", "other_receiver_count"]:
+                    features["internal_transaction_" + name] = 0
+                continue
+
+            for name in ["count", "block_count", "creation_count", "from_other_count", "to_other_count",
+                         "other_sender_count"]:
+                features["internal_transaction_" + name] = row["internal_transaction_" + name]
+
+            features["internal_transaction_other_receiver_count"] = \
+                row["other_receiver_count"] + row["other_receiver_empty"]
+
+            self._aggregate_count_per_block(features, "internal_transaction_count_per_block",
+                                            row["internal_transaction_block_count"], row["internal_transaction_count"],
+                                            row["block_size_squares"])
+
+            for name in ["value", "gas", "gas_used"]:
+                self._aggregate(features, "internal_transaction_" + name,
+                                row[name + "_count"], row[name + "_mean"], row[name + "_variance"])
 
-    def _fetch_transaction_children(self, transaction):
-        children = self.sqlalchemy_session.query(InternalTransaction).\
-            filter(InternalTransaction.hash == transaction.hash).all()
+    @staticmethod
+    def _with_means(rows, names):
+        """
+        :return: the same rows with the mean of each column per contract (named like the column plus _mean)
+        """
+        # floats to avoid integer divisions and overflows in the squares
+        return select(list(rows.c) + [func.avg(cast(rows.c[name], Float())).over(partition_by=rows.c.address).
+                                      label(name + "_mean") for name in names]).alias("centered_transaction_rows")
 
-        return list(children)
+    @staticmethod
+    def _moment_columns(rows, names):
+        columns = []
+        for name in names:
+            column = cast(rows.c[name], Float())
+            deviation = column - rows.c[name + "_mean"]
+            # count and avg ignore nulls
+            columns += [
+                func.count(column).label(name + "_count"),
+                func.avg(column).label(name + "_mean"),
+                func.avg(deviation * deviation).label(name + "_variance"),
+            ]
+        return columns
+
+    @staticmethod
+    def _aggregate(features, name, count, mean, variance):
+        if count > 0:
+            features[name + "_mean"] = mean
+            # population standard deviation like numpy (rounding should never make it negative, but just in case)
+            features[name + "_std"] = math.sqrt(max(variance, 0))
+
+    @classmethod
+    def _aggregate_count_per_block(cls, features, name, block_count, count, block_size_squares):
+        """
+        Every transaction adds the size of its block, so the sum of the block sizes of all the transactions
+        is the sum of the squared block sizes. The variance is computed from these integers without rounding.
+        """
+        cls._aggregate(features, name, block_count, count / block_count,
+                       (block_count * block_size_squares - count * count) / (block_count * block_count))
+
+
+ENGINES = {
+    "python": TransactionFeatureWorker,
+    "numpy": NumpyTransactionFeatureWorker,
+    "sql": SqlTransactionFeatureWorker,
+}
 
 
 def main():
@@ -283,21 +784,33 @@ def main():
     argument_parser.add_argument("contracts", type=argparse.FileType("r"),
                                  help="File path containing contracts to crawl, one address per line.")
 
-    argument_parser.add_argument("output", type=str, help="Output file in csv format.")
+    add_run_by_address_arguments(argument_parser)
 
-    argument_parser.add_argument("--processes", type=int, help="Number of processes. Default is cpu_count() - 1.")
-    argument_parser.add_argument("--log_every", type=int, default=5, help="How many seconds between count logs.")
+    argument_parser.add_argument("--engine", type=str, choices=ENGINES.keys(), default="python",
+                                 help="Aggregate the transactions in python or with numpy arrays (one contract at a time),"
+                                      + " or in the database (all the contracts of a batch at a time, see --batch_size).")
+
+    # streaming only for the python engine
+    add_extractor_arguments(argument_parser)
 
     arguments = argument_parser.parse_args()
 
     addresses = address_list_from_file(arguments.contracts)
 
-    multiprocess_by_address(addresses,
-                            TransactionFeatureWorker,
-                            arguments.output,
-                            COLUMNS,
-                            num_processes=arguments.processes,
-                            log_every=arguments.log_every)
+    worker_class = ENGINES[arguments.engine]
+
+    if worker_class == TransactionFeatureWorker:
+        worker_class = partial(worker_class, **extractor_worker_options(arguments))
+    elif arguments.chunk_size is not None:
+        raise Exception("Only the python engine can stream the transactions.")
+    else:
+        worker_class = partial(worker_class, validate=arguments.validate)
+
+    run_by_address(arguments,
+                   addresses,
+                   worker_class,
+                   COLUMNS,
+                   output_version=FEATURE_VERSION)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,29 @@
+from sqlalchemy import inspect
+
+from honeypot_detection import config
+
+from honeypot_detection.database.transaction import NormalTransaction, InternalTransaction
+
+
+def main():
+    """
+    Adds the exact value column to the transaction tables of databases created before it existed.
+    The transactions crawled before keep an empty exact value (the value in ether is used instead).
+    """
+    sqlalchemy_engine = config.create_sqlalchemy_engine()
+    inspector = inspect(sqlalchemy_engine)
+
+    for model in [NormalTransaction, InternalTransaction]:
+        table = model.__table__
+        column = table.c.value_wei
+
+        if column.name in [existing["name"] for existing in inspector.get_columns(table.name)]:
+            print("The table {} already has the column {}.".format(table.name, column.name))
+        else:
+            column_type = column.type.compile(dialect=sqlalchemy_engine.dialect)
+            sqlalchemy_engine.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table.name, column.name, column_type))
+            print("The column {} was added to the table {}.".format(column.name, table.name))
+
+
+if __name__ == '__main__':
+    main()
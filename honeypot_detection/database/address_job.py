@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, Boolean, Text, Index
+
+from honeypot_detection.database.base import Base
+
+
+class AddressJob(Base):
+    __tablename__ = "address_jobs"
+
+    # index for the lease queries
+    __table_args__ = (Index("ix_address_job_leases", "run", "finished", "lease_expires_at"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run = Column(String(length=64), nullable=False)  # not sure about the size
+    addresses = Column(Text(), nullable=False)  # one address per line
+    finished = Column(Boolean, nullable=False, default=False)
+    failed = Column(Boolean, nullable=False, default=False)  # leased too many times without finishing
+    lease_owner = Column(String(length=128))  # host name and process id
+    lease_expires_at = Column(Integer)  # timestamp
+    attempts = Column(Integer, nullable=False, default=0)
@@ -1,3 +1,5 @@
+from honeypot_detection.database.address_job import AddressJob
+from honeypot_detection.database.balance_delta import TransactionBalanceDelta, BalanceDeltaContract
 from honeypot_detection.database.contract import Contract
 from honeypot_detection.database.contract_compiler_version import ContractCompilerMajorVersion,\
     ContractCompilerMinorVersion, ContractCompilerPatchVersion
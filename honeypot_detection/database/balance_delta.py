@@ -0,0 +1,41 @@
+from sqlalchemy import Column, Integer, String, Boolean, Index
+
+from honeypot_detection.database.base import Base
+from honeypot_detection.database.wei import Wei
+
+
+class TransactionBalanceDelta(Base):
+    """
+    Net balance change of the parties of one normal transaction (including its internal transactions).
+    The accounts that are not the creator, the contract or the sender are summed by sign.
+    The deltas are exact amounts of wei.
+    """
+    __tablename__ = "transaction_balance_deltas"
+
+    # index to read the deltas of one contract in chronological order
+    __table_args__ = (Index("ix_balance_delta_order", "crawled_from", "block_number", "transaction_index", "hash"),)
+
+    hash = Column(String(length=66), primary_key=True, autoincrement=False)
+    crawled_from = Column(String(length=42), nullable=False)
+    block_number = Column(Integer)
+    transaction_index = Column(Integer)
+    creation = Column(Boolean, nullable=False)
+    sender_is_creator = Column(Boolean, nullable=False)
+    error = Column(Boolean, nullable=False)  # the transaction or any of its internal transactions failed
+    creator_delta = Column(Wei(), nullable=False)
+    contract_delta = Column(Wei(), nullable=False)
+    sender_delta = Column(Wei(), nullable=False)  # zero when the sender is the creator
+    other_positive_delta = Column(Wei(), nullable=False)
+    other_negative_delta = Column(Wei(), nullable=False)
+
+
+class BalanceDeltaContract(Base):
+    """
+    Contracts with materialized balance deltas and the input fingerprint from which they were computed.
+    """
+    __tablename__ = "balance_delta_contracts"
+
+    address = Column(String(length=42), primary_key=True, autoincrement=False)
+    fingerprint = Column(String(length=40))  # fixed size
+    transaction_count = Column(Integer, nullable=False, default=0)
+    computed_at = Column(Integer)  # timestamp
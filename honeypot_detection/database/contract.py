@@ -1,4 +1,5 @@
 from sqlalchemy import Column, String, Integer, Boolean, Text
+from sqlalchemy.orm import deferred
 
 from honeypot_detection.database.base import Base
 
@@ -12,10 +13,10 @@ class Contract(Base):
     name = Column(String(length=256))  # not sure about the size
     compiler_optimization = Column(Boolean())
     compiler_runs = Column(Integer())
-    abi = Column(Text())
+    abi = deferred(Column(Text()))  # wide columns are only loaded when accessed
     license_type = Column(String(length=64))  # not sure about the size
     swarm_source = Column(String(length=128))  # not sure about the size
-    source_code = Column(Text(length=2097152))  # had to extend this to be 2MB > TEXT=64KB
+    source_code = deferred(Column(Text(length=2097152)))  # had to extend this to be 2MB > TEXT=64KB
 
     # computed from creation transaction
     timestamp = Column(Integer())
@@ -32,6 +33,6 @@ class Contract(Base):
     has_source_code = Column(Boolean())
 
     # computed from byte code
-    byte_code = Column(Text())
+    byte_code = deferred(Column(Text()))
     has_byte_code = Column(Boolean())
     byte_code_hash = Column(String(length=64), index=True)  # fixed size
@@ -0,0 +1,49 @@
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+
+
+# crawl state from which each feature row was computed
+CRAWL_STATE_COLUMNS = [
+    "normal_transaction_crawl_count",
+    "normal_transaction_crawl_last_block",
+    "internal_transaction_crawl_count",
+    "internal_transaction_crawl_last_block",
+]
+
+# fingerprint of all the inputs from which each feature row was computed
+FINGERPRINT_COLUMN = "fingerprint"
+
+COMPUTED_AT_COLUMN = "computed_at"
+
+
+def feature_table_name(name, version):
+    return "{}_v{:d}".format(name, version)
+
+
+def create_feature_table(name, version, field_names, column_types=None):
+    """
+    Feature tables are not declared with the other models because their columns depend on the feature script.
+    The first field should be the contract address and is used as primary key.
+    The rest of the fields are floats unless another type is defined.
+    :param name: feature table name without version
+    :param version: should change every time the feature extraction changes
+    :param field_names: columns of the feature rows
+    :param column_types: optional dictionary of SQLAlchemy types by field name
+    :return: SQLAlchemy table (not created in the database yet)
+    """
+    if column_types is None:
+        column_types = {}
+
+    key_field = field_names[0]
+
+    columns = [Column(key_field, String(length=42), primary_key=True, autoincrement=False)]  # fixed size
+
+    for field_name in field_names[1:]:
+        columns.append(Column(field_name, column_types.get(field_name, Float())))
+
+    for field_name in CRAWL_STATE_COLUMNS:
+        columns.append(Column(field_name, Integer()))
+
+    columns.append(Column(FINGERPRINT_COLUMN, String(length=40)))  # fixed size
+    columns.append(Column(COMPUTED_AT_COLUMN, Integer()))
+
+    return Table(feature_table_name(name, version), MetaData(), *columns)
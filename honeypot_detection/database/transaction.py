@@ -1,6 +1,9 @@
 from sqlalchemy import Column, Integer, String, Boolean, Float, Text, Index, BigInteger
+from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.orm import deferred
 
 from honeypot_detection.database.base import Base
+from honeypot_detection.database.wei import Wei
 
 
 class Transaction(Base):
@@ -10,13 +13,18 @@ class Transaction(Base):
     block_number = Column(Integer)
     source = Column(String(length=42))
     target = Column(String(length=42))
-    value = Column(Float())
+    value = Column(Float())  # in ether
+    value_wei = Column(Wei())  # exact
     gas = Column(Integer())
     gas_used = Column(Integer())
     is_error = Column(Boolean)
     contract_address = Column(String(length=42), index=True)
     crawled_from = Column(String(length=42))
-    input = Column(Text())
+
+    # wide column only loaded when accessed (declared as attribute because the class is abstract)
+    @declared_attr
+    def input(cls):
+        return deferred(Column(Text()))
 
 
 class NormalTransaction(Transaction):
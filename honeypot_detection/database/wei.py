@@ -0,0 +1,25 @@
+from sqlalchemy import String
+from sqlalchemy.types import TypeDecorator
+
+
+# 2 ** 256 has 78 digits (plus the sign for balance deltas)
+WEI_LENGTH = 79
+
+
+class Wei(TypeDecorator):
+    """
+    Exact integer amount of wei stored as decimal text, because it does not fit in the integer types of most databases
+    and floats lose precision. The values are python integers.
+    """
+
+    impl = String(length=WEI_LENGTH)
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return str(int(value))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return int(value)
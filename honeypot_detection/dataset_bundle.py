@@ -0,0 +1,47 @@
+import csv
+import os
+
+import numpy as np
+
+from honeypot_detection.utils import address_list_from_file
+
+
+ADDRESSES_FILE_NAME = "addresses.txt"
+FEATURES_FILE_NAME = "features.npy"
+FEATURE_METADATA_FILE_NAME = "features.csv"
+BINARY_LABELS_FILE_NAME = "contract_is_honeypot.npy"
+MULTI_CLASS_LABELS_FILE_NAME = "contract_label_index.npy"
+
+FEATURE_METADATA_FIELDS = ["feature", "category", "scale", "minimum", "maximum"]
+
+
+class DatasetBundle:
+    """
+    Dataset ready for the machine learning experiments stored in a directory (see create_dataset_bundle.py):
+    the contract addresses (one per line), the float32 feature matrix (one row per address),
+    the binary and multi-class label vectors, and the metadata of each feature column.
+    The matrix and the labels are memory mapped, so opening the dataset does not read or copy them.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, ADDRESSES_FILE_NAME), "r") as addresses_file:
+            self.addresses = address_list_from_file(addresses_file)
+
+        self.features = np.load(os.path.join(directory, FEATURES_FILE_NAME), mmap_mode="r")
+        self.labels_binary = np.load(os.path.join(directory, BINARY_LABELS_FILE_NAME), mmap_mode="r")
+        self.labels_multi = np.load(os.path.join(directory, MULTI_CLASS_LABELS_FILE_NAME), mmap_mode="r")
+
+        with open(os.path.join(directory, FEATURE_METADATA_FILE_NAME), "r") as metadata_file:
+            self.feature_metadata = list(csv.DictReader(metadata_file))
+
+        self.feature_names = [row["feature"] for row in self.feature_metadata]
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def feature_indices(self, categories):
+        """
+        :param categories: list of feature categories
+        :return: list with the column position of the features of those categories
+        """
+        return [index for index, row in enumerate(self.feature_metadata) if row["category"] in categories]
@@ -0,0 +1,265 @@
+import os
+import socket
+import time
+
+from multiprocessing import Process, cpu_count
+
+from honeypot_detection import config
+from honeypot_detection.database.address_job import AddressJob
+from honeypot_detection.multiprocess_by_address import create_output, log_elapsed_time, logger, OUTPUT_MODE_DATABASE
+
+from sqlalchemy import or_
+from sqlalchemy.orm import sessionmaker
+
+
+def submit_address_jobs(sqlalchemy_session, run, addresses, batch_size=100):
+    """
+    Splits the addresses into jobs of one run.
+    Previous jobs from the same run are replaced.
+    :return: number of jobs
+    """
+    sqlalchemy_session.query(AddressJob).filter(AddressJob.run == run).delete(synchronize_session=False)
+
+    count = 0
+    for start in range(0, len(addresses), batch_size):
+        sqlalchemy_session.add(AddressJob(run=run,
+                                          addresses="\n".join(addresses[start:start + batch_size]),
+                                          finished=False,
+                                          failed=False,
+                                          attempts=0))
+        count += 1
+
+    sqlalchemy_session.commit()
+
+    return count
+
+
+def lease_address_job(sqlalchemy_session, run, owner, lease_seconds, max_attempts):
+    """
+    Takes the next job of the run that is not finished and not leased (or with an expired lease).
+    Several processes from different hosts can compete for the same job, but only one of them gets the lease.
+    Jobs that were already leased max_attempts times are marked as failed instead of being dispatched again.
+    :return: the leased job or None if there is nothing available at the moment
+    """
+    while True:
+        now = int(time.time())
+
+        available = or_(AddressJob.lease_expires_at.is_(None), AddressJob.lease_expires_at < now)
+
+        # the workers of the last attempts died or failed
+        sqlalchemy_session.query(AddressJob).\
+            filter(AddressJob.run == run, AddressJob.finished.is_(False), AddressJob.failed.is_(False), available,
+                   AddressJob.attempts >= max_attempts).\
+            update({AddressJob.failed: True}, synchronize_session=False)
+
+        job_id = sqlalchemy_session.query(AddressJob.id).\
+            filter(AddressJob.run == run, AddressJob.finished.is_(False), AddressJob.failed.is_(False), available).\
+            order_by(AddressJob.id.asc()).\
+            limit(1).scalar()
+
+        # nothing available
+        if job_id is None:
+            sqlalchemy_session.commit()
+            return None
+
+        # the conditions are repeated so only one process can win the lease
+        updated = sqlalchemy_session.query(AddressJob).\
+            filter(AddressJob.id == job_id, AddressJob.finished.is_(False), AddressJob.failed.is_(False), available,
+                   AddressJob.attempts < max_attempts).\
+            update({AddressJob.lease_owner: owner,
+                    AddressJob.lease_expires_at: now + lease_seconds,
+                    AddressJob.attempts: AddressJob.attempts + 1},
+                   synchronize_session=False)
+
+        sqlalchemy_session.commit()
+
+        if updated == 1:
+            return sqlalchemy_session.query(AddressJob).filter(AddressJob.id == job_id).one()
+
+        # another process won the lease, try with the next job
+
+
+def finish_address_job(sqlalchemy_session, job):
+    # the outputs are upserted, so it does not matter if the lease expired and the job was dispatched again
+    job.finished = True
+    sqlalchemy_session.commit()
+
+
+def release_address_job(sqlalchemy_session, job):
+    # the job can be leased again right away (until it reaches the maximum attempts)
+    job.lease_owner = None
+    job.lease_expires_at = None
+    sqlalchemy_session.commit()
+
+
+def count_unfinished_address_jobs(sqlalchemy_session, run):
+    # the failed jobs are not going to be finished
+    count = sqlalchemy_session.query(AddressJob).\
+        filter(AddressJob.run == run, AddressJob.finished.is_(False), AddressJob.failed.is_(False)).count()
+    sqlalchemy_session.commit()
+    return count
+
+
+def count_failed_address_jobs(sqlalchemy_session, run):
+    count = sqlalchemy_session.query(AddressJob).\
+        filter(AddressJob.run == run, AddressJob.failed.is_(True)).count()
+    sqlalchemy_session.commit()
+    return count
+
+
+def job_worker(run, worker_class, output, lease_seconds, poll_every, max_attempts):
+    owner = "{}:{:d}".format(socket.gethostname(), os.getpid())
+
+    logger.info("Worker {} started...".format(owner))
+
+    sqlalchemy_engine = config.create_sqlalchemy_engine()
+    session_factory = sessionmaker(bind=sqlalchemy_engine)
+
+    # separate sessions to read features, write outputs and handle the jobs
+    sqlalchemy_session = session_factory()
+    write_session = session_factory()
+    job_session = session_factory()
+
+    row_writer = output.create_direct_row_writer(write_session)
+    worker = worker_class(sqlalchemy_session, row_writer)
+
+    while True:
+        job = lease_address_job(job_session, run, owner, lease_seconds, max_attempts)
+
+        # nothing to lease
+        if job is None:
+            # the rest of the jobs are finished
+            if count_unfinished_address_jobs(job_session, run) == 0:
+                logger.info("No more jobs.")
+                break
+
+            # the rest of the jobs are leased by other workers, but their leases may expire
+            time.sleep(poll_every)
+            continue
+
+        logger.debug("Job {:d} leased (attempt {:d}).".format(job.id, job.attempts))
+
+        try:
+            worker.process_batch(job.addresses.split("\n"))
+        except Exception:
+            logger.exception("Job {:d} failed (attempt {:d} of {:d}).".format(job.id, job.attempts, max_attempts))
+            # the rows written before the failure are upserted again if the job is processed again
+            sqlalchemy_session.rollback()
+            release_address_job(job_session, job)
+            continue
+
+        # the outputs should be stored before finishing the job
+        row_writer.flush()
+        finish_address_job(job_session, job)
+
+        logger.info("Job {:d} finished.".format(job.id))
+
+    row_writer.close()
+
+    sqlalchemy_session.close()
+    write_session.close()
+    job_session.close()
+    sqlalchemy_engine.dispose()
+
+    logger.info("Worker {} finished.".format(owner))
+
+
+def distributed_by_address(run, addresses, worker_class, output_file_path, output_field_names, submit=False,
+                           num_processes=None, batch_size=100, lease_seconds=600, poll_every=5, max_attempts=3,
+                           output_mode=OUTPUT_MODE_DATABASE, output_version=1, output_column_types=None,
+                           incremental=False):
+    """
+    Addresses are split into jobs stored in a database table shared by several hosts.
+    First one host submits the jobs of a run. Then any host can spawn workers for the same run.
+    Each worker leases one job at a time, processes its addresses and writes the outputs directly.
+    If a worker dies, its lease expires and the job is dispatched again to another worker.
+    If a job fails, its lease is released and the job is dispatched again right away.
+    After max_attempts leases the job is marked as failed and the run fails when the workers stop.
+    Workers stop when every job of the run is finished or failed.
+    Since any job can be processed more than once, the output should be the database (rows are upserted).
+    :param run: name shared by the jobs of the same execution
+    :param addresses: contract address to process (only used when submitting)
+    :param worker_class: the one that actually does the processing
+    :param output_file_path: feature table name
+    :param output_field_names:
+    :param submit: create the jobs of the run instead of processing them
+    :param num_processes: how many workers should be spawned in this host
+    :param batch_size: how many addresses per job
+    :param lease_seconds: how long a worker has to finish a job before it is dispatched again
+                          (the lease is not renewed, so it should be longer than any job)
+    :param poll_every: amount of seconds between lease attempts when all the remaining jobs are leased
+    :param max_attempts: how many times a job can be leased before it is marked as failed
+    :param output_mode: only "database" supports writing from several hosts
+    :param output_version: feature table version
+    :param output_column_types: optional SQLAlchemy types by field (float by default)
+    :param incremental: only submit the addresses with new inputs since the last successful run
+    """
+    if output_mode != OUTPUT_MODE_DATABASE:
+        raise Exception("Only the database output mode can be written from several hosts.")
+
+    output = create_output(output_mode, output_file_path, output_field_names, incremental=incremental,
+                           version=output_version, column_types=output_column_types)
+
+    distributed_with_output(run, addresses, worker_class, output, submit=submit, num_processes=num_processes,
+                            batch_size=batch_size, lease_seconds=lease_seconds, poll_every=poll_every,
+                            max_attempts=max_attempts)
+
+
+def distributed_with_output(run, addresses, worker_class, output, submit=False, num_processes=None, batch_size=100,
+                            lease_seconds=600, poll_every=5, max_attempts=3):
+    """
+    Same as distributed_by_address but with an output that was already created (e.g. a routed output).
+    The output should support writing directly from the workers.
+    """
+    if submit:
+        # the output decides which addresses need to be processed
+        addresses = output.prepare(addresses)
+
+        sqlalchemy_engine = config.create_sqlalchemy_engine()
+        AddressJob.__table__.create(sqlalchemy_engine, checkfirst=True)
+        sqlalchemy_session = sessionmaker(bind=sqlalchemy_engine)()
+
+        count = submit_address_jobs(sqlalchemy_session, run, addresses, batch_size=batch_size)
+
+        sqlalchemy_session.close()
+        sqlalchemy_engine.dispose()
+
+        logger.info("{:d} jobs submitted for {:d} addresses.".format(count, len(addresses)))
+        return
+
+    start_time = time.time()
+
+    if num_processes is None:
+        num_processes = cpu_count() - 1
+
+    worker_processes = []
+    for _ in range(num_processes):
+        worker_process = Process(target=job_worker,
+                                 args=(run, worker_class, output, lease_seconds, poll_every, max_attempts))
+        worker_process.start()
+        worker_processes.append(worker_process)
+
+    # wait for all the workers to finish
+    logger.info("Waiting for the workers...")
+    for worker_process in worker_processes:
+        worker_process.join()
+    logger.info("Workers finished.")
+
+    log_elapsed_time(start_time)
+
+    # the leases of a dead worker expire, but they are not dispatched again when every worker in this host died
+    failed_count = sum(1 for worker_process in worker_processes if worker_process.exitcode != 0)
+    if failed_count > 0:
+        raise Exception("{:d} of {:d} workers failed.".format(failed_count, len(worker_processes)))
+
+    sqlalchemy_engine = config.create_sqlalchemy_engine()
+    sqlalchemy_session = sessionmaker(bind=sqlalchemy_engine)()
+
+    failed_job_count = count_failed_address_jobs(sqlalchemy_session, run)
+
+    sqlalchemy_session.close()
+    sqlalchemy_engine.dispose()
+
+    if failed_job_count > 0:
+        raise Exception("{:d} jobs of the run {} failed after {:d} attempts.".format(failed_job_count, run,
+                                                                                     max_attempts))
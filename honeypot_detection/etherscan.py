@@ -152,3 +152,9 @@ class Client:
         if value == "":
             return None
         return int(value) / 1e18
+
+    @staticmethod
+    def parse_wei(value):
+        if value == "":
+            return None
+        return int(value)
@@ -0,0 +1,103 @@
+import csv
+import hashlib
+
+from honeypot_detection.database.contract import Contract
+from honeypot_detection.database.transaction_crawl import NormalTransactionCrawl, InternalTransactionCrawl
+
+
+FINGERPRINT_FIELDS = ["address", "fingerprint"]
+
+
+def fetch_contract_inputs(sqlalchemy_session, addresses, batch_size=100):
+    """
+    Fetches everything the feature extraction depends on with one query per batch of contracts:
+    the normal and internal transaction crawl states, the creator, and the source and byte code hashes.
+    Addresses without contract are ignored.
+    :param sqlalchemy_session: to query the database (read only)
+    :param addresses: contract addresses
+    :param batch_size: how many contracts are fetched with each query (source code is loaded to hash it)
+    :return: dictionary of input dictionaries by address, including the fingerprint of all the inputs
+    """
+    inputs_by_address = {}
+
+    for start in range(0, len(addresses), batch_size):
+        rows = sqlalchemy_session.query(Contract.address,
+                                        Contract.creator,
+                                        Contract.byte_code_hash,
+                                        Contract.source_code,
+                                        NormalTransactionCrawl.count,
+                                        NormalTransactionCrawl.last_block,
+                                        InternalTransactionCrawl.count,
+                                        InternalTransactionCrawl.last_block).\
+            outerjoin(NormalTransactionCrawl, NormalTransactionCrawl.address == Contract.address).\
+            outerjoin(InternalTransactionCrawl, InternalTransactionCrawl.address == Contract.address).\
+            filter(Contract.address.in_(addresses[start:start + batch_size]))
+
+        for row in rows:
+            address, creator, byte_code_hash, source_code = row[:4]
+
+            inputs = {
+                "normal_transaction_crawl_count": row[4],
+                "normal_transaction_crawl_last_block": row[5],
+                "internal_transaction_crawl_count": row[6],
+                "internal_transaction_crawl_last_block": row[7],
+            }
+
+            if source_code is None:
+                source_code_hash = None
+            else:
+                source_code_hash = hashlib.md5(source_code.encode("utf-8")).hexdigest()
+
+            # the order of the values should never change, or else every fingerprint will change
+            fingerprint_values = [
+                creator,
+                byte_code_hash,
+                source_code_hash,
+                inputs["normal_transaction_crawl_count"],
+                inputs["normal_transaction_crawl_last_block"],
+                inputs["internal_transaction_crawl_count"],
+                inputs["internal_transaction_crawl_last_block"],
+            ]
+
+            inputs["fingerprint"] = hashlib.sha1("|".join([str(value) for value in fingerprint_values])
+                                                 .encode("utf-8")).hexdigest()
+
+            inputs_by_address[address] = inputs
+
+    return inputs_by_address
+
+
+def compute_fingerprints(sqlalchemy_session, addresses):
+    """
+    :return: dictionary of fingerprints by address (addresses without contract are ignored)
+    """
+    return {address: inputs["fingerprint"]
+            for address, inputs in fetch_contract_inputs(sqlalchemy_session, addresses).items()}
+
+
+def output_fingerprints(fingerprint_by_address, version, field_names):
+    """
+    Combines the input fingerprints with the version and the columns of an output,
+    so no row is carried forward after the features change.
+    :return: dictionary of fingerprints by address
+    """
+    output_values = [str(version)] + list(field_names)
+    return {address: hashlib.sha1("|".join(output_values + [fingerprint]).encode("utf-8")).hexdigest()
+            for address, fingerprint in fingerprint_by_address.items()}
+
+
+def fingerprint_file_path(file_path):
+    return file_path + ".fingerprints"
+
+
+def load_fingerprint_file(file_path):
+    with open(file_path, "r") as fingerprint_file:
+        return {row["address"]: row["fingerprint"] for row in csv.DictReader(fingerprint_file)}
+
+
+def write_fingerprint_file(file_path, fingerprint_by_address):
+    with open(file_path, "w") as fingerprint_file:
+        writer = csv.DictWriter(fingerprint_file, FINGERPRINT_FIELDS)
+        writer.writeheader()
+        for address, fingerprint in fingerprint_by_address.items():
+            writer.writerow({"address": address, "fingerprint": fingerprint})
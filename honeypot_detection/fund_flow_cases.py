@@ -1,3 +1,6 @@
+import numpy as np
+
+
 BOOLEAN_VALUES = [True, False]
 BALANCE_VALUES = ["positive", "unchanged", "negative"]
 
@@ -23,6 +26,23 @@ FUND_FLOW_CASE_DEFINITION_BY_SENDER = {
 }
 
 
+# every field of any case in mixed-radix order (the digit of a value is its index in the possible values)
+# with the value taken by the cases of the senders that do not define the field
+FUND_FLOW_CASE_FIELDS = [
+    ("sender", list(FUND_FLOW_CASE_DEFINITION_BY_SENDER.keys()), None),
+    ("creation", BOOLEAN_VALUES, False),
+    ("error", BOOLEAN_VALUES, None),
+    ("balance_creator", BALANCE_VALUES, None),
+    ("balance_contract", BALANCE_VALUES, None),
+    ("balance_sender", BALANCE_VALUES, "unchanged"),
+    ("balance_other_positive", BOOLEAN_VALUES, None),
+    ("balance_other_negative", BOOLEAN_VALUES, None),
+]
+
+# the case codes without a valid case are mapped to this id (the valid ids start from 1)
+INVALID_FUND_FLOW_CASE_ID = 0
+
+
 class InvalidFundFlowCaseException(Exception):
 
     def __init__(self, transaction_hash, values):
@@ -125,4 +145,96 @@ def fund_flow_case_is_valid(values):
     return has_positive == has_negative
 
 
+def build_fund_flow_case_field_weights():
+    """
+    :return: dictionary of the mixed-radix weight of each field (the first field is the most significant)
+    """
+    weight_by_field = {}
+    weight = 1
+    for field, possible_values, _ in reversed(FUND_FLOW_CASE_FIELDS):
+        weight_by_field[field] = weight
+        weight *= len(possible_values)
+    return weight_by_field
+
+
+def fund_flow_case_digit(field, value):
+    for other_field, possible_values, _ in FUND_FLOW_CASE_FIELDS:
+        if other_field == field:
+            return possible_values.index(value)
+    raise Exception("Invalid fund flow case field '{}'".format(field))
+
+
+def encode_fund_flow_case(values):
+    """
+    :param values: dictionary of fund flow case values (the fields missing in the definition take their default)
+    :return: integer code of the fund flow case values
+    """
+    code = 0
+    for field, possible_values, default_value in FUND_FLOW_CASE_FIELDS:
+        code += possible_values.index(values.get(field, default_value)) * FUND_FLOW_CASE_WEIGHT_BY_FIELD[field]
+    return code
+
+
+def decode_fund_flow_case(code):
+    """
+    :param code: integer code of fund flow case values
+    :return: dictionary with the values of the fields in the definition of the sender,
+    or None if another field does not have the default value
+    """
+    values = {}
+    for field, possible_values, _ in FUND_FLOW_CASE_FIELDS:
+        weight = FUND_FLOW_CASE_WEIGHT_BY_FIELD[field]
+        values[field] = possible_values[(code // weight) % len(possible_values)]
+
+    defined_fields = set(field for field, _ in FUND_FLOW_CASE_DEFINITION_BY_SENDER[values["sender"]])
+    for field, _, default_value in FUND_FLOW_CASE_FIELDS:
+        if field not in defined_fields:
+            if values.pop(field) != default_value:
+                return None
+
+    return values
+
+
+def build_fund_flow_case_id_by_code():
+    """
+    :return: array with the fund flow case id of every code (the same ids as build_fund_flow_cases),
+    or the invalid id if the code does not represent a valid case
+    """
+    fund_flow_case_id_by_name = build_fund_flow_cases()
+
+    number_of_codes = 1
+    for _, possible_values, _ in FUND_FLOW_CASE_FIELDS:
+        number_of_codes *= len(possible_values)
+
+    # the ids fit in one byte
+    fund_flow_case_id_by_code = np.full(number_of_codes, INVALID_FUND_FLOW_CASE_ID, dtype=np.uint8)
+    for code in range(number_of_codes):
+        values = decode_fund_flow_case(code)
+        if values is not None and fund_flow_case_is_valid(values):
+            fund_flow_case_id_by_code[code] = fund_flow_case_id_by_name[create_fund_flow_case(values)]
+
+    return fund_flow_case_id_by_code
+
+
+def fund_flow_case_ids_if_valid(transaction_hashes, codes):
+    """
+    :param transaction_hashes: one hash per code (only used to report invalid cases)
+    :param codes: array of fund flow case codes
+    :return: array of fund flow case ids (uint8)
+    """
+    ids = FUND_FLOW_CASE_ID_BY_CODE[codes]
+
+    invalid = np.flatnonzero(ids == INVALID_FUND_FLOW_CASE_ID)
+    if len(invalid) > 0:
+        # this should never happen
+        raise InvalidFundFlowCaseException(transaction_hashes[invalid[0]],
+                                           str(decode_fund_flow_case(int(codes[invalid[0]]))))
+
+    return ids
+
+
 FUND_FLOW_CASE_ID_BY_NAME = build_fund_flow_cases()
+
+FUND_FLOW_CASE_WEIGHT_BY_FIELD = build_fund_flow_case_field_weights()
+
+FUND_FLOW_CASE_ID_BY_CODE = build_fund_flow_case_id_by_code()
@@ -0,0 +1,266 @@
+import argparse
+import time
+
+from functools import partial
+from multiprocessing import Process
+
+from honeypot_detection import config
+from honeypot_detection.balance_deltas import calculate_balances, summarize_balances
+from honeypot_detection.create_fund_flow_case_sequences import TRANSACTION_CASE_COLUMNS
+from honeypot_detection.database.balance_delta import TransactionBalanceDelta, BalanceDeltaContract
+from honeypot_detection.fingerprints import compute_fingerprints
+from honeypot_detection.multiprocess_by_address import database_write_worker, logger, EVENT_TYPE_EXIT, Output,\
+    QueueRowWriter
+from honeypot_detection.run_by_address import add_run_by_address_arguments, run_with_output
+from honeypot_detection.transaction_extractor import add_extractor_arguments, extractor_worker_options,\
+    TransactionExtractor, TransactionExtractorWorker
+from honeypot_detection.transaction_validation import check_internal_transaction, check_normal_transaction
+from honeypot_detection.utils import address_list_from_file
+
+from sqlalchemy.orm import sessionmaker
+
+
+class BalanceDeltaExtractor(TransactionExtractor):
+    """
+    Creates one balance delta row per normal transaction of the contract.
+    """
+
+    columns = TRANSACTION_CASE_COLUMNS + ["transaction_index"]
+
+    def __init__(self, contract, validate=False):
+        super(BalanceDeltaExtractor, self).__init__(contract, validate=validate)
+        self.deltas = []
+        self.contract_created = False
+
+    def add(self, transaction, children):
+        if self.validate:
+            check_normal_transaction(self.contract, transaction, self.contract_created)
+            for child in children:
+                check_internal_transaction(child)
+
+        creation = transaction.target is None
+        if creation:
+            self.contract_created = True
+
+        error = transaction.is_error
+        for child in children:
+            error = error or child.is_error
+
+        balances = calculate_balances(self.contract, transaction, children)
+
+        row = {
+            "hash": transaction.hash,
+            "crawled_from": self.contract.address,
+            "block_number": transaction.block_number,
+            "transaction_index": transaction.transaction_index,
+            "creation": creation,
+            "sender_is_creator": transaction.source == self.contract.creator,
+            "error": bool(error),
+        }
+        row.update(summarize_balances(self.contract, transaction, balances))
+
+        self.deltas.append(row)
+
+    def build(self):
+        return {"address": self.contract.address, "deltas": self.deltas}
+
+
+class BalanceDeltaWorker(TransactionExtractorWorker):
+
+    extractor_class = BalanceDeltaExtractor
+
+
+class BalanceDeltaRowWriter:
+    """
+    Replaces the balance deltas of the contracts in batches using the given session.
+    """
+
+    def __init__(self, sqlalchemy_session, batch_size, fingerprint_by_address=None):
+        """
+        :param sqlalchemy_session: should be used only for writing
+        :param batch_size: how many contracts are replaced together
+        :param fingerprint_by_address: input fingerprints computed before (the missing ones are computed per batch)
+        """
+        self.sqlalchemy_session = sqlalchemy_session
+        self.batch_size = batch_size
+        self.fingerprint_by_address = fingerprint_by_address
+
+        # rows by address, so a repeated address in the same batch is only kept once
+        self.batch = {}
+
+    def write(self, row):
+        self.batch[row["address"]] = row["deltas"]
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.batch) > 0:
+            replace_balance_deltas(self.sqlalchemy_session, self.batch,
+                                   fingerprint_by_address=self.fingerprint_by_address)
+            self.batch = {}
+
+    def close(self):
+        self.flush()
+
+
+class BalanceDeltaOutput(Output):
+    """
+    All the workers send the balance deltas of each contract through the write queue to only one process
+    that replaces them in the ledger table.
+    The input fingerprint of each contract is stored, so in incremental mode the unchanged contracts are skipped.
+    The fingerprints are computed once when the output is prepared.
+    """
+
+    def __init__(self, incremental=False, batch_size=100):
+        """
+        :param incremental: only process the addresses with new inputs since their deltas were stored
+        :param batch_size: how many contracts are replaced together
+        """
+        super(BalanceDeltaOutput, self).__init__(None, None, incremental=incremental)
+        self.batch_size = batch_size
+        # filled by prepare
+        self.fingerprint_by_address = {}
+
+    def prepare(self, addresses):
+        sqlalchemy_engine = config.create_sqlalchemy_engine()
+        sqlalchemy_session = sessionmaker(bind=sqlalchemy_engine)()
+
+        # create the tables in case they do not exist yet
+        TransactionBalanceDelta.__table__.create(sqlalchemy_engine, checkfirst=True)
+        BalanceDeltaContract.__table__.create(sqlalchemy_engine, checkfirst=True)
+
+        # stored with the deltas, so the inputs should not change until the run is finished
+        # (if they do, the deltas are computed again in the next incremental run)
+        fingerprint_by_address = compute_fingerprints(sqlalchemy_session, addresses)
+
+        if self.incremental:
+            stored_fingerprint_by_address = fetch_balance_delta_fingerprints(sqlalchemy_session, addresses)
+
+            changed_addresses = []
+            for address in addresses:
+                fingerprint = fingerprint_by_address.get(address)
+                if fingerprint is None or stored_fingerprint_by_address.get(address) != fingerprint:
+                    changed_addresses.append(address)
+
+            logger.info("{:d} addresses changed and {:d} unchanged contracts will be kept.".format(
+                len(changed_addresses), len(addresses) - len(changed_addresses)))
+
+            addresses = changed_addresses
+
+        # only the fingerprints of the addresses that will be written
+        self.fingerprint_by_address = {address: fingerprint_by_address[address]
+                                       for address in addresses if address in fingerprint_by_address}
+
+        sqlalchemy_session.close()
+        sqlalchemy_engine.dispose()
+
+        return addresses
+
+    def create_row_writer(self, write_queue, worker_index):
+        return QueueRowWriter(write_queue)
+
+    def create_direct_row_writer(self, sqlalchemy_session):
+        return BalanceDeltaRowWriter(sqlalchemy_session, self.batch_size, self.fingerprint_by_address)
+
+    def start(self, write_queue):
+        # database write worker: we will replace the deltas using only one process and a queue
+        write_process = Process(target=database_write_worker, args=(write_queue, self))
+        write_process.start()
+        return [write_process]
+
+    def finish(self, write_queue):
+        # the workers stopped queuing rows
+        # add to stop event for the writing worker
+        write_queue.put({"event_type": EVENT_TYPE_EXIT})
+
+
+def fetch_balance_delta_fingerprints(sqlalchemy_session, addresses, batch_size=500):
+    """
+    :return: dictionary of the fingerprints stored with the balance deltas by address
+    (addresses without materialized deltas are ignored)
+    """
+    fingerprint_by_address = {}
+
+    for start in range(0, len(addresses), batch_size):
+        rows = sqlalchemy_session.query(BalanceDeltaContract.address, BalanceDeltaContract.fingerprint).\
+            filter(BalanceDeltaContract.address.in_(addresses[start:start + batch_size]))
+
+        for address, fingerprint in rows:
+            fingerprint_by_address[address] = fingerprint
+
+    return fingerprint_by_address
+
+
+def replace_balance_deltas(sqlalchemy_session, deltas_by_address, fingerprint_by_address=None):
+    """
+    Replaces the balance deltas of the addresses in one transaction (delete and insert works with any database).
+    :param fingerprint_by_address: input fingerprints computed before (see compute_fingerprints),
+    only the missing ones are computed for the whole batch with one query
+    """
+    addresses = list(deltas_by_address.keys())
+    computed_at = int(time.time())
+
+    if fingerprint_by_address is None:
+        fingerprint_by_address = {}
+
+    missing_addresses = [address for address in addresses if address not in fingerprint_by_address]
+    if len(missing_addresses) > 0:
+        computed_fingerprint_by_address = compute_fingerprints(sqlalchemy_session, missing_addresses)
+    else:
+        computed_fingerprint_by_address = {}
+
+    delta_values = []
+    contract_values = []
+    for address, deltas in deltas_by_address.items():
+        delta_values.extend(deltas)
+        contract_values.append({"address": address,
+                                "fingerprint": fingerprint_by_address.get(
+                                    address, computed_fingerprint_by_address.get(address)),
+                                "transaction_count": len(deltas),
+                                "computed_at": computed_at})
+
+    delta_table = TransactionBalanceDelta.__table__
+    contract_table = BalanceDeltaContract.__table__
+
+    sqlalchemy_session.execute(delta_table.delete().where(delta_table.c.crawled_from.in_(addresses)))
+    sqlalchemy_session.execute(contract_table.delete().where(contract_table.c.address.in_(addresses)))
+
+    if len(delta_values) > 0:
+        sqlalchemy_session.execute(delta_table.insert(), delta_values)
+    sqlalchemy_session.execute(contract_table.insert(), contract_values)
+
+    sqlalchemy_session.commit()
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Materialize the net balance deltas of every normal transaction of the contracts.")
+
+    argument_parser.add_argument("contracts", type=argparse.FileType("r"),
+                                 help="File path containing contracts to process, one address per line.")
+
+    # the deltas are always replaced in the ledger tables
+    add_run_by_address_arguments(argument_parser, with_output=False)
+    # no default, to know if the output mode was given
+    argument_parser.set_defaults(output_mode=None)
+
+    add_extractor_arguments(argument_parser)
+
+    arguments = argument_parser.parse_args()
+
+    if arguments.output_mode is not None:
+        raise Exception("The balance deltas are always written into the ledger tables (no output mode).")
+
+    if arguments.distributed is not None or arguments.submit:
+        raise Exception("The balance deltas can only be materialized by one host (no distributed run).")
+
+    addresses = address_list_from_file(arguments.contracts)
+
+    worker_class = partial(BalanceDeltaWorker, **extractor_worker_options(arguments))
+
+    run_with_output(arguments, addresses, worker_class, BalanceDeltaOutput(incremental=arguments.incremental))
+
+
+if __name__ == '__main__':
+    main()
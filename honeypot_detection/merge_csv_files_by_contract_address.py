@@ -1,8 +1,17 @@
 import argparse
 import csv
+import heapq
 import logging
+import os
+import shutil
+import tempfile
+
+from contextlib import ExitStack
+from functools import partial
+from operator import itemgetter
 
 from honeypot_detection import config  # just to define log level
+from honeypot_detection.sparse_features import iterate_dense_rows, load_sparse_features
 
 
 logger = logging.getLogger(__name__)
@@ -10,23 +19,287 @@ logger = logging.getLogger(__name__)
 
 ADDRESS_FIELD = "contract_address"
 
+JOIN_INNER = "inner"
+JOIN_LEFT = "left"
+
+JOINS = [JOIN_INNER, JOIN_LEFT]
+
+FILL_EMPTY = "empty"
+FILL_ZERO = "zero"
+
+FILLS = [FILL_EMPTY, FILL_ZERO]
+
+
+class SparseReader:
+    """
+    Reads a sparse feature matrix (see sparse_features) like a csv.DictReader.
+    """
+
+    def __init__(self, file_path):
+        self.addresses, columns, self.matrix = load_sparse_features(file_path)
+        self.fieldnames = [ADDRESS_FIELD] + columns
+
+    def __iter__(self):
+        for address, values in zip(self.addresses, iterate_dense_rows(self.matrix)):
+            yield dict(zip(self.fieldnames, [address] + values))
+
+    def sorted_rows(self, temporary_directory, chunk_size, infer_types=False):
+        """
+        The addresses are already in memory, so they are used as an index to read the rows sorted.
+        :param infer_types: ignored because every column is numeric
+        :return: generator of (address, values of the fields except the address) tuples sorted by address
+        """
+        order = sorted(range(len(self.addresses)), key=self.addresses.__getitem__)
+
+        # only a few rows are densified at a time
+        for start in range(0, len(order), chunk_size):
+            indices = order[start:start + chunk_size]
+            for index, values in zip(indices, iterate_dense_rows(self.matrix[indices])):
+                yield self.addresses[index], values
+
+    def missing_values(self, fill):
+        """
+        :return: the values of the fields except the address for the addresses missing in this input (see fill_values)
+        """
+        return fill_values([True] * (len(self.fieldnames) - 1), fill)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class CsvReader:
+    """
+    csv.DictReader that closes the file when the context ends.
+    """
+
+    def __init__(self, file_path):
+        self.file = open(file_path, "r")
+        self.reader = csv.DictReader(self.file)
+        self.fieldnames = self.reader.fieldnames
+
+        # for each field except the address: None until a non-empty value is read, then if every one is a number
+        self.numeric_fields = None
+
+    def __iter__(self):
+        return iter(self.reader)
+
+    def sorted_rows(self, temporary_directory, chunk_size, infer_types=False):
+        """
+        :param infer_types: decide if each column is numeric while the input is read (see missing_values)
+        :return: generator of (address, values of the fields except the address) tuples sorted by address
+        (see external_sort)
+        """
+        fields = [field for field in self.fieldnames if field != ADDRESS_FIELD]
+        rows = ((row[ADDRESS_FIELD], [row[field] for field in fields]) for row in self.reader)
+
+        if infer_types:
+            self.numeric_fields = [None] * len(fields)
+            rows = ((address, self._infer_types(values)) for address, values in rows)
+
+        return external_sort(rows, temporary_directory, chunk_size)
+
+    def _infer_types(self, values):
+        for i, value in enumerate(values):
+            # the empty values do not decide the type, and one value that is not a number is enough
+            if value != "" and self.numeric_fields[i] is not False:
+                self.numeric_fields[i] = is_number(value)
+        return values
+
+    def missing_values(self, fill):
+        """
+        A column is numeric when every non-empty value of the whole input is a number
+        (and a column with only empty values is not numeric).
+        The whole input is read before the first sorted row is returned (see external_sort),
+        so this should be called after that, and only if the types were inferred.
+        :return: the values of the fields except the address for the addresses missing in this input (see fill_values)
+        """
+        if fill == FILL_EMPTY:
+            return fill_values([False] * (len(self.fieldnames) - 1), fill)
+
+        if self.numeric_fields is None:
+            raise Exception("The column types were not inferred while the input was sorted.")
+
+        return fill_values([numeric is True for numeric in self.numeric_fields], fill)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+
+def open_input(file_path):
+    """
+    :param file_path: csv file, or sparse feature matrix in npz format
+    :return: reader with the field names and an iterator of dictionary rows
+    """
+    if file_path.endswith(".npz"):
+        return SparseReader(file_path)
+    else:
+        return CsvReader(file_path)
+
+
+def write_sorted_run(rows, directory, index):
+    """
+    :return: path of a temporary csv file with the rows sorted by address (without header)
+    """
+    file_path = os.path.join(directory, "run-{:d}.csv".format(index))
+
+    rows.sort(key=itemgetter(0))
+
+    with open(file_path, "w") as run_file:
+        writer = csv.writer(run_file)
+        for address, values in rows:
+            writer.writerow([address] + values)
+
+    return file_path
+
+
+def iterate_run(file_path):
+    with open(file_path, "r") as run_file:
+        for values in csv.reader(run_file):
+            yield values[0], values[1:]
+
+
+def external_sort(rows, temporary_directory, chunk_size):
+    """
+    Sorts the rows by address keeping at most one chunk of rows in memory.
+    Each chunk is sorted and written in a temporary run file, and then the runs are merged while they are read.
+    When all the rows fit in one chunk they are sorted in memory instead.
+    :param rows: iterable of (address, values) tuples
+    :param temporary_directory: where the run files are written (they are removed at the end)
+    :param chunk_size: maximum amount of rows in memory
+    :return: generator of (address, values) tuples sorted by address
+    """
+    directory = tempfile.mkdtemp(prefix="merge-", dir=temporary_directory)
+
+    try:
+        run_file_paths = []
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                run_file_paths.append(write_sorted_run(chunk, directory, len(run_file_paths)))
+                chunk = []
+
+        # everything fits in memory
+        if len(run_file_paths) == 0:
+            chunk.sort(key=itemgetter(0))
+            for row in chunk:
+                yield row
+
+        else:
+            if len(chunk) > 0:
+                run_file_paths.append(write_sorted_run(chunk, directory, len(run_file_paths)))
+                chunk = []
+
+            for row in heapq.merge(*[iterate_run(file_path) for file_path in run_file_paths], key=itemgetter(0)):
+                yield row
+
+    finally:
+        shutil.rmtree(directory)
+
+
+def is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def fill_values(numeric_fields, fill):
+    """
+    :param numeric_fields: if each field of the input is numeric
+    :param fill: empty for every missing value, or zero for the numeric fields (and empty for the rest)
+    :return: list with the value of each field for the addresses that are missing in the input
+    """
+    if fill == FILL_EMPTY:
+        return [""] * len(numeric_fields)
+    elif fill == FILL_ZERO:
+        return [0 if numeric else "" for numeric in numeric_fields]
+    else:
+        raise Exception("Invalid fill '{}'".format(fill))
+
+
+def merge_join(streams, missing_values, join):
+    """
+    K-way merge join of streams sorted by address, keeping only the current row of each stream in memory.
+    :param streams: list of iterators of (address, values) tuples sorted by address without repeated addresses
+    :param missing_values: list with one function per stream that returns the values of the addresses missing
+    in the stream (called once every stream returned its first row)
+    :param join: inner (only the addresses present in every stream)
+    or left (the addresses of the first stream, filling the values missing in the rest)
+    :return: generator of (address, concatenated values) tuples sorted by address
+    """
+    heads = [next(stream, None) for stream in streams]
+
+    # the inputs were read while they were sorted, so their types are known
+    fills = [function() for function in missing_values]
+
+    while True:
+        # the first stream defines the addresses of the left join
+        if join == JOIN_LEFT and heads[0] is None:
+            break
+        # every stream should have the address for the inner join
+        if join == JOIN_INNER and any(head is None for head in heads):
+            break
+        if all(head is None for head in heads):
+            break
+
+        address = min(head[0] for head in heads if head is not None)
+        matches = [head is not None and head[0] == address for head in heads]
+
+        if all(matches) or (join == JOIN_LEFT and matches[0]):
+            values = []
+            for head, match, fill in zip(heads, matches, fills):
+                if match:
+                    values.extend(head[1])
+                else:
+                    values.extend(fill)
+            yield address, values
+
+        # move forward the streams with the address
+        for i, stream in enumerate(streams):
+            if matches[i]:
+                heads[i] = next(stream, None)
+                if heads[i] is not None and heads[i][0] <= address:
+                    raise Exception("Repeated or unsorted address {} in input {:d}.".format(heads[i][0], i + 1))
+
 
 def main():
     argument_parser = argparse.ArgumentParser(description="Merge csv files by contract address.")
 
     argument_parser.add_argument("output", type=str, help="Output csv file.")
-    argument_parser.add_argument("inputs", type=str, help="Input csv files.", nargs="+")
+    argument_parser.add_argument("inputs", type=str, nargs="+",
+                                 help="Input csv files, or sparse feature matrices in npz format.")
+
+    argument_parser.add_argument("--join", type=str, choices=JOINS, default=JOIN_LEFT,
+                                 help="Keep the contracts of the first input (left) or the contracts present in every"
+                                      + " input (inner).")
+    argument_parser.add_argument("--fill", type=str, choices=FILLS, default=FILL_EMPTY,
+                                 help="Values of the contracts that are missing in an input: empty values (empty)"
+                                      + " or zero for the numeric columns (zero). A column is numeric when every"
+                                      + " non-empty value of its input is a number (and it has at least one).")
+    argument_parser.add_argument("--chunk_size", type=int, default=100000,
+                                 help="Maximum number of rows of each input sorted in memory.")
+    argument_parser.add_argument("--temporary_directory", type=str,
+                                 help="Directory for the sorted runs of the inputs. Default is the system one.")
 
     arguments = argument_parser.parse_args()
 
-    values_by_address = {}
     all_fields_in_order = []
     all_fields_set = set()
-    first_file = True
 
-    for i, input_file_path in enumerate(arguments.inputs, start=1):
-        with open(input_file_path, "r") as csv_file:
-            reader = csv.DictReader(csv_file)
+    streams = []
+    missing_values = []
+
+    with ExitStack() as stack:
+        for i, input_file_path in enumerate(arguments.inputs, start=1):
+            reader = stack.enter_context(open_input(input_file_path))
 
             # get the fields from this file (but ignore the address because it will be duplicated)
             fields = []
@@ -49,43 +322,31 @@ def main():
             # verify that the address was in the field list of the file
             assert address_present
 
-            # append the values to each contract
-            for j, row in enumerate(reader, start=1):
-                address = row[ADDRESS_FIELD]
-
-                # if it is the first file the address needs to be defined
-                if first_file:
-                    assert address not in values_by_address
-                    values_by_address[address] = []
-                # the address should be defined, if not, the file rows don't match
-                else:
-                    assert address in values_by_address
-
-                # append every value using the fixed field order
-                for field in fields:
-                    values_by_address[address].append(row[field])
+            # each input is sorted while it is read (see external_sort)
+            stream = reader.sorted_rows(arguments.temporary_directory, arguments.chunk_size,
+                                        infer_types=arguments.fill == FILL_ZERO)
+            # the temporary files of the sorted runs are removed when the stream is closed
+            stack.callback(stream.close)
 
-                if j % 1000 == 0:
-                    logger.info("{:d} rows read from file {:d}/{:d}.".format(j, i, len(arguments.inputs)))
+            streams.append(stream)
+            missing_values.append(partial(reader.missing_values, arguments.fill))
 
-            # first file already read
-            first_file = False
+        logger.info("Merging...")
 
-        logger.info("{:d}/{:d} files merged.".format(i, len(arguments.inputs)))
+        with open(arguments.output, "w") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow([ADDRESS_FIELD] + all_fields_in_order)
 
-    logger.info("Writing...")
+            # the rows are written in address order while the inputs are merged
+            count = 0
+            for address, values in merge_join(streams, missing_values, arguments.join):
+                writer.writerow([address] + values)
 
-    with open(arguments.output, "w") as csv_file:
-        writer = csv.DictWriter(csv_file, [ADDRESS_FIELD] + all_fields_in_order)
-        writer.writeheader()
-        for i, (address, values) in enumerate(values_by_address.items(), start=1):
-            row = {ADDRESS_FIELD: address}
-            for field, value in zip(all_fields_in_order, values):
-                row[field] = value
-            writer.writerow(row)
+                count += 1
+                if count % 1000 == 0:
+                    logger.info("{:d} rows written...".format(count))
 
-            if i % 1000 == 0:
-                logger.info("Writing {:d}/{:d}...".format(i, len(values_by_address)))
+        logger.info("{:d} rows written.".format(count))
 
     logger.info("Done.")
 
@@ -1,17 +1,42 @@
 import csv
+import os
+import shutil
+import sys
 import time
 
 from multiprocessing import Process, Queue, cpu_count, log_to_stderr
 
 from queue import Empty
 
+from threading import Thread
+
 from honeypot_detection import config
+from honeypot_detection.contract_metadata import fetch_contract_metadata
+from honeypot_detection.database.feature_table import create_feature_table, COMPUTED_AT_COLUMN, FINGERPRINT_COLUMN
+from honeypot_detection.fingerprints import compute_fingerprints, fetch_contract_inputs, fingerprint_file_path,\
+    load_fingerprint_file, output_fingerprints, write_fingerprint_file
 
+from sqlalchemy import select
 from sqlalchemy.orm import sessionmaker
 
 
 EVENT_TYPE_EXIT = "exit"
 EVENT_TYPE_WRITE = "write"
+EVENT_TYPE_SHARD = "shard"
+
+OUTPUT_MODE_SINGLE = "single"
+OUTPUT_MODE_SHARDED = "sharded"
+OUTPUT_MODE_DATABASE = "database"
+
+OUTPUT_MODES = [OUTPUT_MODE_SINGLE, OUTPUT_MODE_SHARDED, OUTPUT_MODE_DATABASE]
+
+EXECUTOR_PROCESSES = "processes"
+EXECUTOR_THREADS = "threads"
+EXECUTOR_HYBRID = "hybrid"
+
+EXECUTORS = [EXECUTOR_PROCESSES, EXECUTOR_THREADS, EXECUTOR_HYBRID]
+
+DEFAULT_NUM_THREADS = 4
 
 
 logger = log_to_stderr()
@@ -19,18 +44,21 @@ logger = log_to_stderr()
 
 class Worker:
 
-    def __init__(self, sqlalchemy_session, write_queue):
+    # contract columns prefetched for each batch of addresses (see process_contract)
+    contract_columns = None
+
+    def __init__(self, sqlalchemy_session, row_writer):
         """
         :param sqlalchemy_session: to query the database (should be read only queries)
-        :param write_queue: should put model instances
+        :param row_writer: should receive the output rows (in dictionary format)
         """
         self.sqlalchemy_session = sqlalchemy_session
-        self.write_queue = write_queue
+        self.row_writer = row_writer
 
         self.logger = logger
 
     def send_output(self, output):
-        self.write_queue.put({"event_type": EVENT_TYPE_WRITE, "row": output})
+        self.row_writer.write(output)
 
     def process_address(self, address):
         """
@@ -39,35 +67,612 @@ class Worker:
         """
         raise NotImplementedError
 
+    def process_contract(self, contract):
+        """
+        Process a contract and write outputs in a queue.
+        Used instead of process_address when the worker defines the contract columns.
+        :param contract: row with the address and the contract columns (fetched with the rest of the batch)
+        """
+        raise NotImplementedError
 
-def worker_wrapper(read_queue, worker_class, write_queue):
-    logger.info("Worker started...")
+    def process_batch(self, addresses):
+        """
+        Process several contracts and write outputs in a queue.
+        If the worker defines the contract columns, they are fetched for the whole batch with one query.
+        Workers that can process many contracts together should override this.
+        :param addresses: contract addresses to process
+        """
+        if self.contract_columns is None:
+            for address in addresses:
+                self.process_address(address)
+            return
+
+        contracts = fetch_contract_metadata(self.sqlalchemy_session, addresses, self.contract_columns)
+
+        for address in addresses:
+            if address not in contracts:
+                raise Exception("Contract {} not found.".format(address))
+
+            self.process_contract(contracts[address])
+
+
+class QueueRowWriter:
+    """
+    Sends the rows to the write worker through the write queue.
+    """
+
+    def __init__(self, write_queue):
+        self.write_queue = write_queue
+
+    def write(self, row):
+        self.write_queue.put({"event_type": EVENT_TYPE_WRITE, "row": row})
+
+    def close(self):
+        pass
+
+
+class ShardRowWriter:
+    """
+    Writes the rows directly into a csv shard file owned by only one worker.
+    When closed, the shard is announced through the write queue (only a control message, not the rows).
+    """
+
+    def __init__(self, write_queue, file_path, field_names, index):
+        self.write_queue = write_queue
+        self.file_path = file_path
+        self.index = index
+        self.count = 0
+
+        self.file = open(file_path, "w")
+
+        self.writer = csv.DictWriter(self.file, field_names)
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+        self.write_queue.put({"event_type": EVENT_TYPE_SHARD,
+                              "file_path": self.file_path,
+                              "index": self.index,
+                              "count": self.count})
+
+
+class DatabaseRowWriter:
+    """
+    Upserts the rows in batches into a feature table using the given session.
+    """
+
+    def __init__(self, sqlalchemy_session, output):
+        """
+        :param sqlalchemy_session: should be used only for writing
+        :param output: database output that defines the feature table
+        """
+        self.sqlalchemy_session = sqlalchemy_session
+        self.table = output.create_table()
+        self.key_field = output.field_names[0]
+        self.batch_size = output.batch_size
+        self.inputs_by_address = output.inputs_by_address
+
+        # rows by address, so a repeated address in the same batch is only kept once
+        self.batch = {}
+
+    def write(self, row):
+        self.batch[row[self.key_field]] = row
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.batch) > 0:
+            upsert_feature_rows(self.sqlalchemy_session, self.table, self.key_field, self.batch,
+                                inputs_by_address=self.inputs_by_address)
+            self.batch = {}
+
+    def close(self):
+        self.flush()
+
+
+class RoutedRowWriter:
+    """
+    Holds one row writer per output of a routed output.
+    The workers choose the output of each row by name.
+    """
+
+    def __init__(self, row_writers_by_name):
+        self.row_writers_by_name = row_writers_by_name
+
+    def route(self, name):
+        return self.row_writers_by_name[name]
+
+    def write(self, row):
+        raise Exception("The rows of a routed output should be written through one route.")
+
+    def flush(self):
+        for row_writer in self.row_writers_by_name.values():
+            row_writer.flush()
+
+    def close(self):
+        for row_writer in self.row_writers_by_name.values():
+            row_writer.close()
+
+
+class Output:
+
+    def __init__(self, file_path, field_names, incremental=False):
+        """
+        :param file_path: where the final output should be
+        :param field_names: columns of the output rows (the first one should be the contract address)
+        :param incremental: only process the addresses with new inputs since the last successful run
+        """
+        self.file_path = file_path
+        self.field_names = field_names
+        self.incremental = incremental
+
+    def prepare(self, addresses):
+        """
+        Called in the main process before anything else.
+        :param addresses: contract addresses that should be in the output
+        :return: contract addresses that should be processed
+        """
+        return addresses
+
+    def create_row_writer(self, write_queue, worker_index):
+        """
+        Called inside each worker process.
+        :param write_queue: shared by all the workers and the main process
+        :param worker_index: unique per worker
+        :return: an object with the methods write(row) and close()
+        """
+        raise NotImplementedError
+
+    def create_direct_row_writer(self, sqlalchemy_session):
+        """
+        Called inside each worker process when there is no main process (e.g. distributed execution).
+        :param sqlalchemy_session: should be used only for writing
+        :return: an object with the methods write(row), flush() and close()
+        """
+        raise NotImplementedError("This output can only be written from one main process.")
+
+    def start(self, write_queue):
+        """
+        Called in the main process before the workers are spawned.
+        :param write_queue: shared by all the workers and the main process
+        :return: list of additional processes that should be joined after finishing
+        """
+        return []
+
+    def finish(self, write_queue):
+        """
+        Called in the main process after all the workers finished.
+        :param write_queue: shared by all the workers and the main process
+        """
+        pass
+
+    def close(self):
+        """
+        Called in the main process after the additional processes finished.
+        """
+        pass
+
+
+class FileOutput(Output):
+    """
+    Writes a csv file.
+    In incremental mode a fingerprint file is kept next to the output file,
+    the new rows are written into a partial file and the unchanged rows are carried forward from the previous output.
+    The fingerprints include the version and the columns, so every row is processed again when they change.
+    """
+
+    def __init__(self, file_path, field_names, incremental=False, version=1):
+        super(FileOutput, self).__init__(file_path, field_names, incremental=incremental)
+        self.version = version
+        self.fingerprint_by_address = {}
+        self.carried_addresses = set()
+
+    def write_file_path(self):
+        if self.incremental:
+            return self.file_path + ".partial"
+        else:
+            return self.file_path
+
+    def prepare(self, addresses):
+        if not self.incremental:
+            return addresses
+
+        # fingerprints from the last successful run
+        previous_fingerprint_file_path = fingerprint_file_path(self.file_path)
+        if os.path.exists(self.file_path) and os.path.exists(previous_fingerprint_file_path):
+            previous_fingerprint_by_address = load_fingerprint_file(previous_fingerprint_file_path)
+        else:
+            previous_fingerprint_by_address = {}
+
+        self.fingerprint_by_address = output_fingerprints(fingerprints_with_new_session(addresses),
+                                                          self.version,
+                                                          self.field_names)
+
+        changed_addresses = []
+        for address in addresses:
+            fingerprint = self.fingerprint_by_address.get(address)
+            if fingerprint is not None and previous_fingerprint_by_address.get(address) == fingerprint:
+                self.carried_addresses.add(address)
+            else:
+                changed_addresses.append(address)
+
+        logger.info("{:d} addresses changed and {:d} unchanged addresses will be carried forward.".format(
+            len(changed_addresses), len(self.carried_addresses)))
+
+        return changed_addresses
+
+    def close(self):
+        if not self.incremental:
+            return
+
+        logger.info("Carrying forward unchanged rows...")
+
+        # for very long sequences
+        csv.field_size_limit(sys.maxsize)
+
+        key_field = self.field_names[0]
+        merged_file_path = self.file_path + ".merged"
+        written_fingerprint_by_address = {}
+        carried_count = 0
+
+        with open(merged_file_path, "w") as merged_file:
+            writer = csv.DictWriter(merged_file, self.field_names)
+            writer.writeheader()
+
+            # first the new rows
+            with open(self.write_file_path(), "r") as partial_file:
+                for row in csv.DictReader(partial_file):
+                    writer.writerow(row)
+                    written_fingerprint_by_address[row[key_field]] = self.fingerprint_by_address.get(row[key_field])
+
+            # then the unchanged rows from the previous output
+            if len(self.carried_addresses) > 0:
+                with open(self.file_path, "r") as previous_file:
+                    for row in csv.DictReader(previous_file):
+                        address = row[key_field]
+                        if address in self.carried_addresses and address not in written_fingerprint_by_address:
+                            writer.writerow(row)
+                            written_fingerprint_by_address[address] = self.fingerprint_by_address[address]
+                            carried_count += 1
+
+        os.replace(merged_file_path, self.file_path)
+        os.remove(self.write_file_path())
+
+        # only the rows that were actually written can be carried forward in the next run
+        write_fingerprint_file(fingerprint_file_path(self.file_path),
+                               {address: fingerprint
+                                for address, fingerprint in written_fingerprint_by_address.items()
+                                if fingerprint is not None})
+
+        logger.info("{:d} rows carried forward.".format(carried_count))
+
+
+class SingleFileOutput(FileOutput):
+    """
+    All the workers send their rows through the write queue to only one process that writes the output file.
+    """
+
+    def create_row_writer(self, write_queue, worker_index):
+        return QueueRowWriter(write_queue)
+
+    def start(self, write_queue):
+        # write worker: we will write in the output file using only one process and a queue
+        write_process = Process(target=write_worker, args=(write_queue, self.write_file_path(), self.field_names))
+        write_process.start()
+        return [write_process]
+
+    def finish(self, write_queue):
+        # the workers stopped queuing rows
+        # add to stop event for the writing worker
+        write_queue.put({"event_type": EVENT_TYPE_EXIT})
+
+
+class ShardedFileOutput(FileOutput):
+    """
+    Each worker writes its own shard file, and the write queue only carries control messages.
+    At the end the shards are concatenated into the output file.
+    """
 
+    def create_row_writer(self, write_queue, worker_index):
+        return ShardRowWriter(write_queue, shard_file_path(self.write_file_path(), worker_index), self.field_names,
+                              worker_index)
+
+    def finish(self, write_queue):
+        # collect the shards announced by the workers (they already finished so nothing else will come)
+        shards = []
+        while True:
+            try:
+                event = write_queue.get(block=True, timeout=1)
+            except Empty:
+                break
+
+            if event["event_type"] == EVENT_TYPE_SHARD:
+                shards.append(event)
+            else:
+                raise Exception("Invalid event type '{}'".format(event["event_type"]))
+
+        # keep the worker order
+        shards.sort(key=lambda shard: shard["index"])
+
+        logger.info("Concatenating {:d} rows from {:d} shards...".format(
+            sum(shard["count"] for shard in shards), len(shards)))
+
+        concatenate_shards([shard["file_path"] for shard in shards], self.write_file_path(), self.field_names)
+
+        logger.info("Concatenation finished.")
+
+
+class DatabaseOutput(Output):
+    """
+    All the workers send their rows through the write queue to only one process that upserts them in batches
+    into a versioned feature table (keyed by contract address).
+    Each row also records the transaction crawl state and the input fingerprint from which it was computed.
+    The inputs are fetched once when the output is prepared (the workers of other hosts fetch their own).
+    In incremental mode the rows with the same fingerprint are left untouched.
+    """
+
+    def __init__(self, table_name, field_names, incremental=False, version=1, column_types=None, batch_size=500):
+        """
+        :param table_name: feature table name without version
+        :param field_names: columns of the output rows (the first one should be the contract address)
+        :param incremental: only process the addresses with new inputs since they were stored
+        :param version: should change every time the feature extraction changes
+        :param column_types: optional dictionary of SQLAlchemy types by field name
+        :param batch_size: how many rows are upserted together
+        """
+        super(DatabaseOutput, self).__init__(table_name, field_names, incremental=incremental)
+        self.version = version
+        self.column_types = column_types
+        self.batch_size = batch_size
+        # filled by prepare
+        self.inputs_by_address = {}
+
+    def create_table(self):
+        return create_feature_table(self.file_path, self.version, self.field_names, self.column_types)
+
+    def prepare(self, addresses):
+        sqlalchemy_engine = config.create_sqlalchemy_engine()
+        sqlalchemy_session = sessionmaker(bind=sqlalchemy_engine)()
+
+        # create the table in case it does not exist yet
+        table = self.create_table()
+        table.create(sqlalchemy_engine, checkfirst=True)
+
+        # stored with every row, so the inputs should not change until the run is finished
+        # (if they do, the rows are computed again in the next incremental run)
+        inputs_by_address = fetch_contract_inputs(sqlalchemy_session, addresses)
+
+        if self.incremental:
+            # fingerprints stored with the rows
+            key_column = table.c[self.field_names[0]]
+            stored_fingerprint_by_address = {}
+            for start in range(0, len(addresses), self.batch_size):
+                rows = sqlalchemy_session.execute(
+                    select([key_column, table.c[FINGERPRINT_COLUMN]]).
+                    where(key_column.in_(addresses[start:start + self.batch_size])))
+                for address, fingerprint in rows:
+                    stored_fingerprint_by_address[address] = fingerprint
+
+            changed_addresses = []
+            for address in addresses:
+                fingerprint = inputs_by_address.get(address, {}).get("fingerprint")
+                if fingerprint is None or stored_fingerprint_by_address.get(address) != fingerprint:
+                    changed_addresses.append(address)
+
+            logger.info("{:d} addresses changed and {:d} unchanged rows will be kept.".format(
+                len(changed_addresses), len(addresses) - len(changed_addresses)))
+
+            addresses = changed_addresses
+
+        # only the inputs of the addresses that will be written
+        self.inputs_by_address = {address: inputs_by_address[address]
+                                  for address in addresses if address in inputs_by_address}
+
+        sqlalchemy_session.close()
+        sqlalchemy_engine.dispose()
+
+        return addresses
+
+    def create_row_writer(self, write_queue, worker_index):
+        return QueueRowWriter(write_queue)
+
+    def create_direct_row_writer(self, sqlalchemy_session):
+        return DatabaseRowWriter(sqlalchemy_session, self)
+
+    def start(self, write_queue):
+        # database write worker: we will upsert into the table using only one process and a queue
+        write_process = Process(target=database_write_worker, args=(write_queue, self))
+        write_process.start()
+        return [write_process]
+
+    def finish(self, write_queue):
+        # the workers stopped queuing rows
+        # add to stop event for the writing worker
+        write_queue.put({"event_type": EVENT_TYPE_EXIT})
+
+
+class RoutedOutput(Output):
+    """
+    Several outputs filled by the same workers in the same run (e.g. different features from the same data).
+    Each output has its own write queue, so each one can use any output mode.
+    The shared write queue of the run is not used.
+    """
+
+    def __init__(self, outputs_by_name):
+        """
+        :param outputs_by_name: dictionary of outputs by the name used to route the rows
+        """
+        super(RoutedOutput, self).__init__(None, None)
+        self.outputs_by_name = outputs_by_name
+        self.write_queues_by_name = {name: Queue() for name in outputs_by_name.keys()}
+
+    def prepare(self, addresses):
+        # the addresses that any of the outputs needs (in the original order)
+        needed_addresses = set()
+        for output in self.outputs_by_name.values():
+            needed_addresses.update(output.prepare(addresses))
+
+        return [address for address in addresses if address in needed_addresses]
+
+    def create_row_writer(self, write_queue, worker_index):
+        return RoutedRowWriter({name: output.create_row_writer(self.write_queues_by_name[name], worker_index)
+                                for name, output in self.outputs_by_name.items()})
+
+    def create_direct_row_writer(self, sqlalchemy_session):
+        return RoutedRowWriter({name: output.create_direct_row_writer(sqlalchemy_session)
+                                for name, output in self.outputs_by_name.items()})
+
+    def start(self, write_queue):
+        processes = []
+        for name, output in self.outputs_by_name.items():
+            processes.extend(output.start(self.write_queues_by_name[name]))
+        return processes
+
+    def finish(self, write_queue):
+        for name, output in self.outputs_by_name.items():
+            output.finish(self.write_queues_by_name[name])
+
+    def close(self):
+        for output in self.outputs_by_name.values():
+            output.close()
+
+
+def create_output(output_mode, file_path, field_names, incremental=False, version=1, column_types=None):
+    if output_mode == OUTPUT_MODE_SINGLE:
+        return SingleFileOutput(file_path, field_names, incremental=incremental, version=version)
+    elif output_mode == OUTPUT_MODE_SHARDED:
+        return ShardedFileOutput(file_path, field_names, incremental=incremental, version=version)
+    elif output_mode == OUTPUT_MODE_DATABASE:
+        return DatabaseOutput(file_path, field_names, incremental=incremental, version=version,
+                              column_types=column_types)
+    else:
+        raise Exception("Invalid output mode '{}'".format(output_mode))
+
+
+def fingerprints_with_new_session(addresses):
     sqlalchemy_engine = config.create_sqlalchemy_engine()
     sqlalchemy_session = sessionmaker(bind=sqlalchemy_engine)()
 
+    fingerprint_by_address = compute_fingerprints(sqlalchemy_session, addresses)
+
+    sqlalchemy_session.close()
+    sqlalchemy_engine.dispose()
+
+    return fingerprint_by_address
+
+
+def shard_file_path(file_path, index):
+    return "{}.shard-{:d}".format(file_path, index)
+
+
+def concatenate_shards(shard_file_paths, file_path, field_names):
+    """
+    Copies the shards byte by byte into one file keeping only the header of the first one.
+    The shard files are removed afterwards.
+    """
+    # write the header in case there are no shards
+    if len(shard_file_paths) == 0:
+        with open(file_path, "w") as output_file:
+            csv.DictWriter(output_file, field_names).writeheader()
+        return
+
+    with open(file_path, "wb") as output_file:
+        for i, file_path_to_copy in enumerate(shard_file_paths):
+            with open(file_path_to_copy, "rb") as shard_file:
+                # all the shards have the same header
+                header = shard_file.readline()
+                if i == 0:
+                    output_file.write(header)
+
+                # copy the rest in big blocks without parsing rows
+                shutil.copyfileobj(shard_file, output_file)
+
+    for file_path_to_remove in shard_file_paths:
+        os.remove(file_path_to_remove)
+
+
+def worker_wrapper(read_queue, worker_class, write_queue, output, worker_index, num_threads=1):
+    """
+    Runs inside each worker process.
+    All the threads of the process share the same engine (and therefore the same bounded connection pool),
+    but each thread has its own session, row writer and worker.
+    """
+    logger.info("Worker started...")
+
+    sqlalchemy_engine = config.create_sqlalchemy_engine()
+    session_factory = sessionmaker(bind=sqlalchemy_engine)
+
+    # only one thread: work in the process main thread
+    if num_threads == 1:
+        thread_worker(read_queue, worker_class, write_queue, output, worker_index, session_factory)
+
+    # several threads: the connections are returned to the pool after each address
+    else:
+        failed_thread_indices = []
+
+        def run_thread(thread_index):
+            try:
+                thread_worker(read_queue, worker_class, write_queue, output, worker_index * num_threads + thread_index,
+                              session_factory, release_connections=True)
+            except Exception:
+                logger.exception("Thread {:d} failed.".format(thread_index))
+                failed_thread_indices.append(thread_index)
+
+        threads = []
+        for thread_index in range(num_threads):
+            thread = Thread(target=run_thread, args=(thread_index,))
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        # the process should fail like it does with only one thread, so the main process sees the failure
+        if len(failed_thread_indices) > 0:
+            sqlalchemy_engine.dispose()
+            raise Exception("{:d} of {:d} threads failed.".format(len(failed_thread_indices), num_threads))
+
+    sqlalchemy_engine.dispose()
+
+    logger.info("Worker finished.")
+
+
+def thread_worker(read_queue, worker_class, write_queue, output, worker_index, session_factory,
+                  release_connections=False):
+    sqlalchemy_session = session_factory()
+
     # create the worker
-    worker = worker_class(sqlalchemy_session, write_queue)
+    row_writer = output.create_row_writer(write_queue, worker_index)
+    worker = worker_class(sqlalchemy_session, row_writer)
 
     # while there are more addresses in the queue
     while True:
-        # get the next address if possible
+        # get the next batch of addresses if possible
         try:
-            address = read_queue.get(block=True, timeout=1)
-            logger.debug("Next address: {}".format(address))
+            addresses = read_queue.get(block=True, timeout=1)
+            logger.debug("Next addresses: {}".format(", ".join(addresses)))
 
         # no more addresses in the queue
         except Empty:
             logger.info("No more addresses.")
             break
 
-        # process the next address
-        worker.process_address(address)
+        # process the next batch of addresses
+        worker.process_batch(addresses)
 
-    sqlalchemy_session.close()
-    sqlalchemy_engine.dispose()
+        # give the connection back to the shared pool while this thread is not using it
+        if release_connections:
+            sqlalchemy_session.close()
 
-    logger.info("Worker finished.")
+    row_writer.close()
+
+    sqlalchemy_session.close()
 
 
 def count_worker(queue, log_every=5):
@@ -109,46 +714,174 @@ def write_worker(queue, file_path, field_names):
     logger.info("Writing finished.")
 
 
+def database_write_worker(queue, output):
+    logger.info("Writing started...")
+
+    sqlalchemy_engine = config.create_sqlalchemy_engine()
+    sqlalchemy_session = sessionmaker(bind=sqlalchemy_engine)()
+
+    row_writer = output.create_direct_row_writer(sqlalchemy_session)
+
+    while True:
+        # wait until there is a new event
+        event = queue.get(block=True)
+
+        # write event
+        if event["event_type"] == EVENT_TYPE_WRITE:
+            row_writer.write(event["row"])
+        # exit event
+        elif event["event_type"] == EVENT_TYPE_EXIT:
+            break
+        # something went wrong
+        else:
+            raise Exception("Invalid event type '{}'".format(event["event_type"]))
+
+    # the last incomplete batch
+    row_writer.close()
+
+    sqlalchemy_session.close()
+    sqlalchemy_engine.dispose()
+
+    logger.info("Writing finished.")
+
+
+def upsert_feature_rows(sqlalchemy_session, table, key_field, row_by_address, inputs_by_address=None):
+    """
+    Replaces the feature rows of the addresses in one transaction (delete and insert works with any database).
+    Each row also stores the crawl state and the input fingerprint of its address.
+    :param inputs_by_address: contract inputs fetched before (see fetch_contract_inputs),
+    only the missing ones are fetched for the whole batch with one query
+    """
+    addresses = list(row_by_address.keys())
+    computed_at = int(time.time())
+
+    if inputs_by_address is None:
+        inputs_by_address = {}
+
+    missing_addresses = [address for address in addresses if address not in inputs_by_address]
+    if len(missing_addresses) > 0:
+        fetched_inputs_by_address = fetch_contract_inputs(sqlalchemy_session, missing_addresses)
+    else:
+        fetched_inputs_by_address = {}
+
+    field_names = [column.name for column in table.columns]
+
+    values = []
+    for address, row in row_by_address.items():
+        # missing features are null (like empty csv cells)
+        value = dict.fromkeys(field_names)
+        for field, field_value in row.items():
+            # booleans are stored as numbers like the rest of the features
+            if isinstance(field_value, bool):
+                field_value = int(field_value)
+            value[field] = field_value
+        if address in inputs_by_address:
+            value.update(inputs_by_address[address])
+        else:
+            value.update(fetched_inputs_by_address.get(address, {}))
+        value[COMPUTED_AT_COLUMN] = computed_at
+        values.append(value)
+
+    sqlalchemy_session.execute(table.delete().where(table.c[key_field].in_(addresses)))
+    sqlalchemy_session.execute(table.insert(), values)
+    sqlalchemy_session.commit()
+
+
+def log_elapsed_time(start_time):
+    elapsed_time = time.time() - start_time
+    elapsed_time_unit = "seconds"
+    if elapsed_time > 60:
+        elapsed_time /= 60
+        elapsed_time_unit = "minutes"
+    if elapsed_time > 60:
+        elapsed_time /= 60
+        elapsed_time_unit = "hours"
+    if elapsed_time > 24:
+        elapsed_time /= 24
+        elapsed_time_unit = "days"
+    logger.info("Total time: {} {}".format(elapsed_time, elapsed_time_unit))
+
+
 def multiprocess_by_address(addresses, worker_class, output_file_path, output_field_names, num_processes=None,
-                            log_every=5):
+                            log_every=5, output_mode=OUTPUT_MODE_SINGLE, output_version=1,
+                            output_column_types=None, incremental=False, executor=EXECUTOR_PROCESSES,
+                            num_threads=None, batch_size=1):
     """
-    Addresses are put into a read queue.
+    Addresses are put into a read queue in batches.
     Several workers are spawn with one SQLAlchemy session each (should be used for read only queries).
-    Each worker takes addresses from the read queue and puts outputs into a write queue (in dictionary format).
-    After all the workers are done, the outputs are taken from write the queue and added to the session.
-    At the end the session is committed.
+    With the processes executor there is one worker per process.
+    With the threads executor there is only one process with one worker per thread.
+    With the hybrid executor there are several processes with one worker per thread each.
+    The threads of one process share one SQLAlchemy engine, so the connections are limited by its pool.
+    Each worker takes addresses from the read queue and sends outputs (in dictionary format) to a row writer.
+    With the single output mode, the row writers put the outputs into a write queue consumed by one write process.
+    With the sharded output mode, each worker writes its own shard file and the shards are concatenated at the end.
+    With the database output mode, the write process upserts the outputs into a versioned feature table.
+    With the incremental option, only the addresses with changed input fingerprints are processed,
+    and the rest of the outputs are kept from the last successful run.
     :param addresses: contract address to process
     :param worker_class: the one that actually does the processing
-    :param output_file_path:
+    :param output_file_path: csv file path, or feature table name for the database output mode
     :param output_field_names:
-    :param num_processes: how many workers should be spawned
+    :param num_processes: how many worker processes should be spawned (ignored by the threads executor)
     :param log_every: amount of seconds between between count logs
+    :param output_mode: either "single", "sharded" or "database"
+    :param output_version: table version for the database output mode, or part of the fingerprints of the csv outputs
+    :param output_column_types: optional SQLAlchemy types by field for the database output mode (float by default)
+    :param incremental: only process the addresses with new inputs since the last successful run
+    :param executor: either "processes", "threads" or "hybrid"
+    :param num_threads: how many worker threads per process (ignored by the processes executor)
+    :param batch_size: how many addresses each worker takes from the read queue at once
+    """
+    output = create_output(output_mode, output_file_path, output_field_names, incremental=incremental,
+                           version=output_version, column_types=output_column_types)
+
+    multiprocess_with_output(addresses, worker_class, output, num_processes=num_processes, log_every=log_every,
+                             executor=executor, num_threads=num_threads, batch_size=batch_size)
+
+
+def multiprocess_with_output(addresses, worker_class, output, num_processes=None, log_every=5,
+                             executor=EXECUTOR_PROCESSES, num_threads=None, batch_size=1):
+    """
+    Same as multiprocess_by_address but with an output that was already created (e.g. a routed output).
     """
     start_time = time.time()
 
+    if executor == EXECUTOR_PROCESSES:
+        num_threads = 1
+    elif executor == EXECUTOR_THREADS:
+        num_processes = 1
+    elif executor != EXECUTOR_HYBRID:
+        raise Exception("Invalid executor '{}'".format(executor))
+
     if num_processes is None:
         num_processes = cpu_count() - 1
 
+    if num_threads is None:
+        num_threads = DEFAULT_NUM_THREADS
+
+    # the output decides which addresses need to be processed
+    addresses = output.prepare(addresses)
+
     read_queue = Queue()
     write_queue = Queue()
 
     # queue all the addresses
-    for address in addresses:
-        read_queue.put(address)
+    for start in range(0, len(addresses), batch_size):
+        read_queue.put(addresses[start:start + batch_size])
 
-    # write worker: we will write in the output file using only one process and a queue
-    write_process = Process(target=write_worker, args=(write_queue, output_file_path, output_field_names))
-    write_process.start()
+    output_processes = output.start(write_queue)
 
     # additional process to log the remaining addresses
-    count_process = Process(target=count_worker, args=(read_queue, log_every))
+    # we don't need to join this one (daemon, so it does not keep the run alive if a worker dies)
+    count_process = Process(target=count_worker, args=(read_queue, log_every), daemon=True)
     count_process.start()
-    # we don't need to join this one
 
     # workers: we will process addresses in parallel
     worker_processes = []
-    for _ in range(num_processes):
-        worker_process = Process(target=worker_wrapper, args=(read_queue, worker_class, write_queue))
+    for worker_index in range(num_processes):
+        worker_process = Process(target=worker_wrapper,
+                                 args=(read_queue, worker_class, write_queue, output, worker_index, num_threads))
         worker_process.start()
         worker_processes.append(worker_process)
 
@@ -158,23 +891,20 @@ def multiprocess_by_address(addresses, worker_class, output_file_path, output_fi
         worker_process.join()
     logger.info("Workers finished.")
 
-    # the workers stopped queuing rows
-    # add to stop event for the writing worker
-    write_queue.put({"event_type": EVENT_TYPE_EXIT})
-
-    # wait until the writing worker actually stops
-    write_process.join()
-
-    # log the time
-    elapsed_time = time.time() - start_time
-    elapsed_time_unit = "seconds"
-    if elapsed_time > 60:
-        elapsed_time /= 60
-        elapsed_time_unit = "minutes"
-    if elapsed_time > 60:
-        elapsed_time /= 60
-        elapsed_time_unit = "hours"
-    if elapsed_time > 24:
-        elapsed_time /= 24
-        elapsed_time_unit = "days"
-    logger.info("Total time: {} {}".format(elapsed_time, elapsed_time_unit))
+    # a failed worker lost the rows of its addresses (and its shard), so the output should not be finished
+    failed_count = sum(1 for worker_process in worker_processes if worker_process.exitcode != 0)
+    if failed_count > 0:
+        for output_process in output_processes:
+            output_process.terminate()
+        # the remaining addresses will never be read
+        read_queue.cancel_join_thread()
+        raise Exception("{:d} of {:d} workers failed, the output was not finished.".format(
+            failed_count, len(worker_processes)))
+
+    # wait until the output is complete
+    output.finish(write_queue)
+    for output_process in output_processes:
+        output_process.join()
+    output.close()
+
+    log_elapsed_time(start_time)
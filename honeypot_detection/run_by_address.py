@@ -0,0 +1,95 @@
+from honeypot_detection.distributed_by_address import distributed_with_output
+from honeypot_detection.multiprocess_by_address import create_output, multiprocess_with_output, DEFAULT_NUM_THREADS,\
+    EXECUTORS, EXECUTOR_PROCESSES, OUTPUT_MODES, OUTPUT_MODE_DATABASE, OUTPUT_MODE_SINGLE
+
+
+def add_run_by_address_arguments(argument_parser, output_help=None, with_output=True):
+    """
+    Adds the arguments shared by all the scripts that process contracts by address.
+    :param argument_parser:
+    :param output_help: optional description of the output argument for scripts with other outputs
+    :param with_output: False for scripts that always write into their own tables (no output argument)
+    """
+    if output_help is None:
+        output_help = "Output file in csv format, or feature table name for the database output mode."
+
+    if with_output:
+        argument_parser.add_argument("output", type=str, help=output_help)
+
+    argument_parser.add_argument("--processes", type=int, help="Number of processes. Default is cpu_count() - 1.")
+    argument_parser.add_argument("--executor", type=str, choices=EXECUTORS, default=EXECUTOR_PROCESSES,
+                                 help="One worker per process (processes), one process with one worker per thread"
+                                      + " (threads) or several processes with one worker per thread (hybrid).")
+    argument_parser.add_argument("--threads", type=int,
+                                 help="Number of threads per process. Default is {:d}.".format(DEFAULT_NUM_THREADS))
+    argument_parser.add_argument("--batch_size", type=int, default=1,
+                                 help="Number of contracts each worker takes at once.")
+    argument_parser.add_argument("--log_every", type=int, default=5, help="How many seconds between count logs.")
+    argument_parser.add_argument("--output_mode", type=str, choices=OUTPUT_MODES, default=OUTPUT_MODE_SINGLE,
+                                 help="Write with one process (single), one shard file per worker (sharded)"
+                                      + " or upserting into a versioned feature table (database).")
+    argument_parser.add_argument("--incremental", action="store_true", default=False,
+                                 help="Only process the contracts with new inputs since the last successful run.")
+
+    argument_parser.add_argument("--distributed", type=str,
+                                 help="Run name to share the work with other hosts through a job table."
+                                      + " Requires the database output mode.")
+    argument_parser.add_argument("--submit", action="store_true", default=False,
+                                 help="Only create the jobs of the distributed run (the workers are started later).")
+    argument_parser.add_argument("--job_size", type=int, default=100,
+                                 help="Number of contracts per job of the distributed run.")
+    argument_parser.add_argument("--lease_seconds", type=int, default=600,
+                                 help="Seconds before an unfinished job of the distributed run is dispatched again"
+                                      + " (it should be longer than any job, the lease is not renewed).")
+    argument_parser.add_argument("--max_attempts", type=int, default=3,
+                                 help="Number of leases before a job of the distributed run is marked as failed.")
+
+
+def run_by_address(arguments, addresses, worker_class, output_field_names, output_version=1,
+                   output_column_types=None):
+    """
+    Processes the addresses in this host, or through a job table when the run is distributed.
+    :param arguments: parsed from an argument parser with the arguments of add_run_by_address_arguments
+    :param addresses: contract address to process
+    :param worker_class: the one that actually does the processing
+    :param output_field_names:
+    :param output_version: table version for the database output mode, or part of the fingerprints of the csv outputs
+    :param output_column_types: optional SQLAlchemy types by field for the database output mode (float by default)
+    """
+    output = create_output(arguments.output_mode,
+                           arguments.output,
+                           output_field_names,
+                           incremental=arguments.incremental,
+                           version=output_version,
+                           column_types=output_column_types)
+
+    run_with_output(arguments, addresses, worker_class, output)
+
+
+def run_with_output(arguments, addresses, worker_class, output):
+    """
+    Same as run_by_address but with an output that was already created (e.g. a routed output).
+    """
+    if arguments.distributed is not None:
+        if arguments.output_mode != OUTPUT_MODE_DATABASE:
+            raise Exception("Only the database output mode can be written from several hosts.")
+
+        distributed_with_output(arguments.distributed,
+                                addresses,
+                                worker_class,
+                                output,
+                                submit=arguments.submit,
+                                num_processes=arguments.processes,
+                                batch_size=arguments.job_size,
+                                lease_seconds=arguments.lease_seconds,
+                                max_attempts=arguments.max_attempts,
+                                poll_every=arguments.log_every)
+    else:
+        multiprocess_with_output(addresses,
+                                 worker_class,
+                                 output,
+                                 num_processes=arguments.processes,
+                                 log_every=arguments.log_every,
+                                 executor=arguments.executor,
+                                 num_threads=arguments.threads,
+                                 batch_size=arguments.batch_size)
@@ -0,0 +1,185 @@
+import os
+
+import numpy as np
+
+from multiprocessing import Process
+
+from honeypot_detection.multiprocess_by_address import logger, EVENT_TYPE_EXIT, EVENT_TYPE_WRITE, Output,\
+    QueueRowWriter
+from honeypot_detection.utils import address_list_from_file
+
+
+ADDRESSES_FILE_NAME = "addresses.txt"
+OFFSETS_FILE_NAME = "offsets.npy"
+PAYLOAD_FILE_NAME = "sequences.bin"
+BLOCKS_FILE_NAME = "blocks.bin"
+
+BLOCK_NUMBER_SIZE = np.dtype(np.int64).itemsize
+
+
+class SequenceStore:
+    """
+    Fund flow case sequences stored in a directory with three files:
+    the contract addresses (one per line), the offsets of each sequence (one more than the addresses)
+    and the concatenation of all the sequences (one byte per case id).
+    The payload and the offsets are memory mapped, so each sequence is a view that is not copied.
+    Optionally, a fourth file has the block number of each case (aligned with the payload).
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, ADDRESSES_FILE_NAME), "r") as addresses_file:
+            self.addresses = address_list_from_file(addresses_file)
+
+        self.index_by_address = {address: index for index, address in enumerate(self.addresses)}
+
+        self.offsets = np.load(os.path.join(directory, OFFSETS_FILE_NAME), mmap_mode="r")
+
+        # an empty file can not be memory mapped
+        payload_file_path = os.path.join(directory, PAYLOAD_FILE_NAME)
+        if os.path.getsize(payload_file_path) == 0:
+            self.payload = np.zeros(0, dtype=np.uint8)
+        else:
+            self.payload = np.memmap(payload_file_path, dtype=np.uint8, mode="r")
+
+        blocks_file_path = os.path.join(directory, BLOCKS_FILE_NAME)
+        if not os.path.exists(blocks_file_path):
+            self.blocks = None
+        elif os.path.getsize(blocks_file_path) == 0:
+            self.blocks = np.zeros(0, dtype=np.int64)
+        else:
+            self.blocks = np.memmap(blocks_file_path, dtype=np.int64, mode="r")
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self.index_by_address
+
+    def __getitem__(self, address):
+        return self.sequence(self.index_by_address[address])
+
+    def sequence(self, index):
+        """
+        :param index: position of the contract in the store
+        :return: uint8 array view with the fund flow case ids of the contract
+        """
+        return self.payload[self.offsets[index]:self.offsets[index + 1]]
+
+    def sequence_blocks(self, index):
+        """
+        :param index: position of the contract in the store
+        :return: int64 array view with the block number of each case of the contract
+        """
+        if self.blocks is None:
+            raise Exception("The sequence store does not have block numbers.")
+        return self.blocks[self.offsets[index]:self.offsets[index + 1]]
+
+    def items(self):
+        """
+        :return: generator of (address, sequence) tuples in the store order
+        """
+        for index, address in enumerate(self.addresses):
+            yield address, self.sequence(index)
+
+
+class SequenceStoreWriter:
+    """
+    Appends the sequences to the payload file and writes the addresses and the offsets when closed.
+    With blocks, the block numbers of the cases are appended to the blocks file too.
+    """
+
+    def __init__(self, directory, with_blocks=False):
+        self.directory = directory
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.addresses = []
+        self.offsets = [0]
+
+        self.payload_file = open(os.path.join(directory, PAYLOAD_FILE_NAME), "wb")
+
+        if with_blocks:
+            self.blocks_file = open(os.path.join(directory, BLOCKS_FILE_NAME), "wb")
+        else:
+            self.blocks_file = None
+
+    def write(self, address, sequence, blocks=None):
+        """
+        :param address: contract address
+        :param sequence: fund flow case ids as bytes
+        :param blocks: block numbers of the cases as int64 bytes (only when the writer has blocks)
+        """
+        self.payload_file.write(sequence)
+        if self.blocks_file is not None:
+            if blocks is None or len(blocks) != len(sequence) * BLOCK_NUMBER_SIZE:
+                raise Exception("Missing block numbers for contract {}.".format(address))
+            self.blocks_file.write(blocks)
+        self.addresses.append(address)
+        self.offsets.append(self.offsets[-1] + len(sequence))
+
+    def close(self):
+        self.payload_file.close()
+        if self.blocks_file is not None:
+            self.blocks_file.close()
+
+        np.save(os.path.join(self.directory, OFFSETS_FILE_NAME), np.array(self.offsets, dtype=np.int64))
+
+        with open(os.path.join(self.directory, ADDRESSES_FILE_NAME), "w") as addresses_file:
+            for address in self.addresses:
+                addresses_file.write(address + "\n")
+
+
+class SequenceStoreOutput(Output):
+    """
+    All the workers send the sequences through the write queue to only one process that fills a sequence store.
+    The rows should have the address and the sequence as bytes in the value,
+    and with blocks, the block numbers of the cases as int64 bytes in the blocks.
+    """
+
+    def __init__(self, directory, incremental=False, with_blocks=False):
+        super(SequenceStoreOutput, self).__init__(directory, None, incremental=incremental)
+        self.with_blocks = with_blocks
+
+    def prepare(self, addresses):
+        if self.incremental:
+            raise Exception("The sequence store can not be updated incrementally.")
+        return addresses
+
+    def create_row_writer(self, write_queue, worker_index):
+        return QueueRowWriter(write_queue)
+
+    def start(self, write_queue):
+        # write worker: we will write in the store using only one process and a queue
+        write_process = Process(target=sequence_store_write_worker, args=(write_queue, self.file_path, self.with_blocks))
+        write_process.start()
+        return [write_process]
+
+    def finish(self, write_queue):
+        # the workers stopped queuing rows
+        # add to stop event for the writing worker
+        write_queue.put({"event_type": EVENT_TYPE_EXIT})
+
+
+def sequence_store_write_worker(queue, directory, with_blocks=False):
+    logger.info("Writing started...")
+
+    writer = SequenceStoreWriter(directory, with_blocks=with_blocks)
+
+    while True:
+        # wait until there is a new event
+        event = queue.get(block=True)
+
+        # write event
+        if event["event_type"] == EVENT_TYPE_WRITE:
+            writer.write(event["row"]["address"], event["row"]["value"], event["row"].get("blocks"))
+        # exit event
+        elif event["event_type"] == EVENT_TYPE_EXIT:
+            break
+        # something went wrong
+        else:
+            raise Exception("Invalid event type '{}'".format(event["event_type"]))
+
+    writer.close()
+
+    logger.info("Writing finished.")
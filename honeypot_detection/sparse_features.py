@@ -0,0 +1,57 @@
+import numpy as np
+
+from scipy import sparse
+
+
+def rows_file_path(file_path):
+    return file_path + ".rows"
+
+
+def columns_file_path(file_path):
+    return file_path + ".columns"
+
+
+def save_sparse_features(file_path, addresses, columns, matrix):
+    """
+    Saves a feature matrix in CSR format (scipy npz) with two sidecar files (one value per line):
+    the contract address of each row and the name of each column.
+    :param file_path: npz file path (the sidecars are written next to it)
+    :param addresses: contract address of each row
+    :param columns: feature name of each column
+    :param matrix: scipy sparse matrix or numpy array with one row per address and one column per feature
+    """
+    # through a file object so the extension is not changed
+    with open(file_path, "wb") as matrix_file:
+        sparse.save_npz(matrix_file, sparse.csr_matrix(matrix))
+
+    with open(rows_file_path(file_path), "w") as rows_file:
+        for address in addresses:
+            rows_file.write(address + "\n")
+
+    with open(columns_file_path(file_path), "w") as columns_file:
+        for column in columns:
+            columns_file.write(column + "\n")
+
+
+def load_sparse_features(file_path):
+    """
+    :param file_path: npz file path written by save_sparse_features
+    :return: tuple with the contract addresses, the feature names and the CSR matrix
+    """
+    with open(rows_file_path(file_path), "r") as rows_file:
+        addresses = [line.strip() for line in rows_file]
+
+    with open(columns_file_path(file_path), "r") as columns_file:
+        columns = [line.strip() for line in columns_file]
+
+    return addresses, columns, sparse.load_npz(file_path).tocsr()
+
+
+def iterate_dense_rows(matrix, chunk_size=10000):
+    """
+    Densifies the matrix a few rows at a time.
+    :return: generator of lists of floats (one per row)
+    """
+    for start in range(0, matrix.shape[0], chunk_size):
+        for row in np.asarray(matrix[start:start + chunk_size].todense()).tolist():
+            yield row
@@ -0,0 +1,123 @@
+from honeypot_detection.contract_transactions import iterate_transactions_with_children
+from honeypot_detection.database.contract import Contract
+from honeypot_detection.multiprocess_by_address import Worker
+
+
+class TransactionExtractor:
+    """
+    Builds one output row per contract from its normal transactions (in chronological order) and their children.
+    Several extractors can share the same transactions of a contract, so they should never modify them.
+    """
+
+    # transaction columns used by the extractor (for both normal and internal transactions)
+    columns = []
+
+    def __init__(self, contract, validate=False):
+        """
+        :param contract: row with only the address and the creator
+        :param validate: check the transactions and fail on the first invalid one (see transaction_validation)
+        """
+        self.contract = contract
+        self.validate = validate
+
+    def add(self, transaction, children):
+        """
+        :param transaction: next normal transaction of the contract
+        :param children: internal transactions of the normal transaction
+        """
+        raise NotImplementedError
+
+    def build(self):
+        """
+        Called after the last transaction.
+        :return: output row (in dictionary format)
+        """
+        raise NotImplementedError
+
+
+def extract_contract(sqlalchemy_session, contract, extractor_classes, chunk_size=None, validate=False):
+    """
+    Feeds the same transactions of the contract to several extractors, so the transactions are fetched only once.
+    :param sqlalchemy_session: to query the database (read only)
+    :param contract: row with the contract address and creator
+    :param extractor_classes: list of TransactionExtractor subclasses
+    :param chunk_size: optional amount of normal transactions fetched at once
+    :param validate: check the transactions on every extractor
+    :return: list of output rows in the same order as the extractor classes
+    """
+    extractors = [extractor_class(contract, validate=validate) for extractor_class in extractor_classes]
+
+    # load the columns that any extractor needs
+    columns = sorted(set(column for extractor_class in extractor_classes for column in extractor_class.columns))
+
+    for transaction, children in iterate_transactions_with_children(sqlalchemy_session, contract.address,
+                                                                    columns=columns, chunk_size=chunk_size):
+        for extractor in extractors:
+            extractor.add(transaction, children)
+
+    return [extractor.build() for extractor in extractors]
+
+
+class TransactionExtractorWorker(Worker):
+    """
+    Sends the output rows of only one extractor class.
+    With chunk size, only one chunk of transactions is kept in memory at a time.
+    With validation, the transactions are checked while they are processed (slower).
+    """
+
+    # should be defined by the subclasses
+    extractor_class = None
+
+    contract_columns = [Contract.creator]
+
+    def __init__(self, sqlalchemy_session, row_writer, chunk_size=None, validate=False):
+        super(TransactionExtractorWorker, self).__init__(sqlalchemy_session, row_writer)
+        self.chunk_size = chunk_size
+        self.validate = validate
+
+    def process_contract(self, contract):
+        rows = extract_contract(self.sqlalchemy_session, contract, [self.extractor_class], chunk_size=self.chunk_size,
+                                validate=self.validate)
+        self.send_output(rows[0])
+
+
+def add_extractor_arguments(argument_parser):
+    """
+    Adds the arguments shared by all the scripts that run transaction extractors.
+    """
+    argument_parser.add_argument("--chunk_size", type=int,
+                                 help="Stream the transactions of each contract in chunks of this size."
+                                      + " Default is all the transactions at once.")
+    argument_parser.add_argument("--validate", action="store_true", default=False,
+                                 help="Check every transaction and stop on the first invalid one (slower)."
+                                      + " See validate_transactions.py to audit the data instead.")
+
+
+def extractor_worker_options(arguments):
+    """
+    :param arguments: parsed from an argument parser with the arguments of add_extractor_arguments
+    :return: dictionary of keyword arguments for the extractor workers
+    """
+    return {"chunk_size": arguments.chunk_size, "validate": arguments.validate}
+
+
+class FusedTransactionWorker(Worker):
+    """
+    Runs several extractor classes over the same transactions and sends the output rows of each one
+    to the route with the same name (the row writer should come from a routed output).
+    """
+
+    contract_columns = [Contract.creator]
+
+    def __init__(self, sqlalchemy_session, row_writer, extractor_classes_by_name, chunk_size=None, validate=False):
+        super(FusedTransactionWorker, self).__init__(sqlalchemy_session, row_writer)
+        self.names = list(extractor_classes_by_name.keys())
+        self.extractor_classes = [extractor_classes_by_name[name] for name in self.names]
+        self.chunk_size = chunk_size
+        self.validate = validate
+
+    def process_contract(self, contract):
+        rows = extract_contract(self.sqlalchemy_session, contract, self.extractor_classes, chunk_size=self.chunk_size,
+                                validate=self.validate)
+        for name, row in zip(self.names, rows):
+            self.row_writer.route(name).write(row)
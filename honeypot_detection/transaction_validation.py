@@ -0,0 +1,147 @@
+import numpy as np
+
+
+# rules checked for every normal transaction crawled from a contract
+NORMAL_TRANSACTION_RULES = [
+    "normal_transaction_without_source",
+    "normal_transaction_to_itself",
+    "normal_transaction_extra_creation",
+    "normal_transaction_creation_not_from_creator",
+    "normal_transaction_with_contract_address",
+    "normal_transaction_not_to_contract",
+]
+
+# rules checked for every internal transaction of the normal transactions crawled from a contract
+INTERNAL_TRANSACTION_RULES = [
+    "internal_transaction_without_source",
+    "internal_transaction_creation_not_from_parent",
+    "internal_transaction_creation_of_parent",
+    "internal_transaction_with_contract_address",
+]
+
+RULES = NORMAL_TRANSACTION_RULES + INTERNAL_TRANSACTION_RULES
+
+
+def violation(transaction_hash, rule):
+    """
+    :return: the exception raised for the first invalid transaction (unlike assert, the checks are never skipped)
+    """
+    return Exception("The transaction {} violates the rule {}.".format(transaction_hash, rule))
+
+
+def check_normal_transaction(contract, transaction, contract_created):
+    """
+    Same rules as find_normal_transaction_violations for one transaction, failing on the first violation.
+    :param contract: only the address and the creator are used
+    :param transaction: normal transaction crawled from the contract
+    :param contract_created: if a previous transaction created the contract
+    """
+    # transactions should always have source
+    if transaction.source is None:
+        raise violation(transaction.hash, "normal_transaction_without_source")
+    # transaction is not sent and received by the same party
+    if transaction.source == transaction.target:
+        raise violation(transaction.hash, "normal_transaction_to_itself")
+
+    # the contract address added by me should match
+    if transaction.crawled_from != contract.address:
+        raise violation(transaction.hash, "normal_transaction_not_crawled_from_contract")
+
+    # creation transaction
+    if transaction.target is None:
+        # there should be only one creation transaction
+        if contract_created:
+            raise violation(transaction.hash, "normal_transaction_extra_creation")
+        # in the creation transaction the creator is the source
+        if transaction.source != contract.creator:
+            raise violation(transaction.hash, "normal_transaction_creation_not_from_creator")
+
+    # other transaction
+    else:
+        # non-creation transactions have no contract address
+        if transaction.contract_address is not None:
+            raise violation(transaction.hash, "normal_transaction_with_contract_address")
+        # the contract is always the target
+        if transaction.target != contract.address:
+            raise violation(transaction.hash, "normal_transaction_not_to_contract")
+
+
+def check_internal_transaction(transaction):
+    """
+    Same rules as find_internal_transaction_violations for one transaction, failing on the first violation.
+    :param transaction: internal transaction from any contract
+    """
+    # transactions should always have source
+    if transaction.source is None:
+        raise violation(transaction.hash, "internal_transaction_without_source")
+
+    # other contract creation
+    if transaction.target is None:
+        # the source is the contract that created this transaction
+        if transaction.source != transaction.crawled_from:
+            raise violation(transaction.hash, "internal_transaction_creation_not_from_parent")
+        # the new contract should not be the contract that created this transaction
+        if transaction.contract_address == transaction.crawled_from:
+            raise violation(transaction.hash, "internal_transaction_creation_of_parent")
+    # no other contract is created
+    else:
+        # non-creation transactions have no contract address
+        if transaction.contract_address is not None:
+            raise violation(transaction.hash, "internal_transaction_with_contract_address")
+
+        # IMPORTANT: _contract_address can be != contract["address"]
+        # children from a transaction can be from another contract
+
+
+def find_normal_transaction_violations(address, creator, sources, targets, contract_addresses):
+    """
+    Checks all the normal transactions of one contract at once.
+    The transactions are fetched by the address they were crawled from, so that one is not checked.
+    :param address: contract address
+    :param creator: contract creator
+    :param sources: object array with the source of each transaction in chronological order
+    :param targets: object array with the target of each transaction in chronological order
+    :param contract_addresses: object array with the contract address of each transaction in chronological order
+    :return: dictionary of boolean masks (one position per transaction) by rule
+    """
+    is_creation = np.equal(targets, None)
+
+    return {
+        "normal_transaction_without_source": np.equal(sources, None),
+        "normal_transaction_to_itself": sources == targets,
+        # the first creation is valid
+        "normal_transaction_extra_creation": is_creation & (np.cumsum(is_creation) > 1),
+        "normal_transaction_creation_not_from_creator": is_creation & (sources != creator),
+        "normal_transaction_with_contract_address": ~is_creation & ~np.equal(contract_addresses, None),
+        "normal_transaction_not_to_contract": ~is_creation & (targets != address),
+    }
+
+
+def find_internal_transaction_violations(sources, targets, contract_addresses, crawled_froms):
+    """
+    Checks all the internal transactions of one contract at once.
+    :param sources: object array with the source of each transaction
+    :param targets: object array with the target of each transaction
+    :param contract_addresses: object array with the contract address of each transaction
+    :param crawled_froms: object array with the address from which each transaction was crawled
+    :return: dictionary of boolean masks (one position per transaction) by rule
+    """
+    is_creation = np.equal(targets, None)
+
+    return {
+        "internal_transaction_without_source": np.equal(sources, None),
+        "internal_transaction_creation_not_from_parent": is_creation & (sources != crawled_froms),
+        "internal_transaction_creation_of_parent": is_creation & (contract_addresses == crawled_froms),
+        "internal_transaction_with_contract_address": ~is_creation & ~np.equal(contract_addresses, None),
+    }
+
+
+def check_violations(hashes, violations):
+    """
+    Fails on the first transaction that violates a rule like check_normal_transaction.
+    :param hashes: object array with the hash of each transaction
+    :param violations: dictionary of boolean masks by rule (see find_normal_transaction_violations)
+    """
+    for rule, mask in violations.items():
+        if np.any(mask):
+            raise violation(hashes[np.argmax(mask)], rule)
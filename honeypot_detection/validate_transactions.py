@@ -0,0 +1,109 @@
+import argparse
+
+import numpy as np
+
+from sqlalchemy import String
+
+from honeypot_detection.contract_transactions import fetch_normal_transaction_columns,\
+    fetch_internal_transaction_columns
+from honeypot_detection.create_transaction_features import column_arrays
+from honeypot_detection.database.contract import Contract
+from honeypot_detection.database.transaction import NormalTransaction, InternalTransaction
+from honeypot_detection.multiprocess_by_address import Worker
+from honeypot_detection.run_by_address import add_run_by_address_arguments, run_by_address
+from honeypot_detection.transaction_validation import find_internal_transaction_violations,\
+    find_normal_transaction_violations, RULES
+from honeypot_detection.utils import address_list_from_file
+
+
+# increase every time the rules change (used for the database output)
+REPORT_VERSION = 1
+
+COLUMNS = ["contract_address", "invalid_transaction_count", "first_invalid_transaction"] + RULES
+
+# the hash is not a number (used for the database output)
+COLUMN_TYPES = {"first_invalid_transaction": String(length=66)}
+
+
+class TransactionValidationWorker(Worker):
+    """
+    Checks all the transactions of each contract with array operations and reports the violations per rule,
+    instead of failing on the first invalid transaction.
+    """
+
+    contract_columns = [Contract.creator]
+
+    def process_contract(self, contract):
+        address = contract.address
+        creator = contract.creator
+
+        report = dict.fromkeys(RULES, 0)
+        report["contract_address"] = address
+        report["invalid_transaction_count"] = 0
+        report["first_invalid_transaction"] = None
+
+        rows = fetch_normal_transaction_columns(self.sqlalchemy_session,
+                                                address,
+                                                NormalTransaction.hash,
+                                                NormalTransaction.source,
+                                                NormalTransaction.target,
+                                                NormalTransaction.contract_address)
+
+        if len(rows) > 0:
+            hashes, sources, targets, contract_addresses = column_arrays(rows)
+            violations = find_normal_transaction_violations(address, creator, sources, targets, contract_addresses)
+            self._count_violations(report, hashes, violations)
+
+        rows = fetch_internal_transaction_columns(self.sqlalchemy_session,
+                                                  address,
+                                                  InternalTransaction.hash,
+                                                  InternalTransaction.source,
+                                                  InternalTransaction.target,
+                                                  InternalTransaction.contract_address,
+                                                  InternalTransaction.crawled_from)
+
+        if len(rows) > 0:
+            hashes, sources, targets, contract_addresses, crawled_froms = column_arrays(rows)
+            violations = find_internal_transaction_violations(sources, targets, contract_addresses, crawled_froms)
+            self._count_violations(report, hashes, violations)
+
+        self.send_output(report)
+
+    @staticmethod
+    def _count_violations(report, hashes, violations):
+        invalid = np.zeros(len(hashes), dtype=bool)
+
+        for rule, mask in violations.items():
+            report[rule] += int(np.count_nonzero(mask))
+            invalid |= mask
+
+        report["invalid_transaction_count"] += int(np.count_nonzero(invalid))
+
+        # the first one in chronological order (normal transactions are checked first)
+        if report["first_invalid_transaction"] is None and np.any(invalid):
+            report["first_invalid_transaction"] = hashes[np.argmax(invalid)]
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(
+        description="Create a report with the invalid transactions per contract and rule.")
+
+    argument_parser.add_argument("contracts", type=argparse.FileType("r"),
+                                 help="File path containing contracts to validate, one address per line.")
+
+    add_run_by_address_arguments(argument_parser)
+
+    arguments = argument_parser.parse_args()
+
+    addresses = address_list_from_file(arguments.contracts)
+
+    run_by_address(arguments,
+                   addresses,
+                   TransactionValidationWorker,
+                   COLUMNS,
+                   output_version=REPORT_VERSION,
+                   output_column_types=COLUMN_TYPES)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,7 +10,9 @@ from sklearn.preprocessing import MinMaxScaler
 
 from sklearn.model_selection import KFold
 
+from honeypot_detection.dataset_bundle import DatasetBundle
 from honeypot_detection.fund_flow_cases import convert_fund_flow_case_definition_to_instances
+from honeypot_detection.sparse_features import load_sparse_features
 
 
 def load_dictionary(file_path):
@@ -21,6 +23,19 @@ def load_dictionary(file_path):
         return pickle.load(dictionary_file)
 
 
+def load_sparse_feature_frame(file_path):
+    """
+    Loads the features saved as a sparse matrix into a dataframe with sparse columns indexed by contract address.
+
+    Arguments:
+    file_path -- the npz file path (the rows and columns sidecar files should be next to it)
+    """
+    addresses, columns, matrix = load_sparse_features(file_path)
+    return pd.DataFrame.sparse.from_spmatrix(matrix,
+                                             index=pd.Index(addresses, name="contract_address"),
+                                             columns=columns)
+
+
 def print_dimensions(target):
     """
     Prints the amount of rows and columns of the dataset.
@@ -190,6 +205,56 @@ def extract_experiment_data(target, filter_feature_categories=None):
     return addresses, features, labels_binary, labels_multi, scaler, feature_names
 
 
+def load_experiment_data_bundle(directory, filter_feature_categories=None):
+    """
+    Same as extract_experiment_data but from a dataset bundle (see create_dataset_bundle.py),
+    where the features are already one-hot-encoded and scaled.
+    The feature matrix is memory mapped, so it is not copied unless the feature categories are filtered.
+
+    Arguments:
+    directory -- the dataset bundle directory
+    feature_categories -- list containing "transaction", "source code" or "fund flow";
+        if None, all feature categories will be used
+    """
+    bundle = DatasetBundle(directory)
+
+    if filter_feature_categories is None:
+        indices = list(range(len(bundle.feature_names)))
+        features = bundle.features
+    else:
+        indices = bundle.feature_indices(filter_feature_categories)
+        features = bundle.features[:, indices]
+
+    if len(indices) == 0:
+        raise Exception("At least one column should be used.")
+
+    feature_names = [bundle.feature_names[i] for i in indices]
+
+    # the scaler is rebuilt from the ranges used to scale the bundle (it can transform new rows the same way)
+    scaled_metadata = [bundle.feature_metadata[i] for i in indices if bundle.feature_metadata[i]["scale"] == "1"]
+    if len(scaled_metadata) > 0:
+        scaler = MinMaxScaler()
+        scaler.fit([[float(row["minimum"]) for row in scaled_metadata],
+                    [float(row["maximum"]) for row in scaled_metadata]])
+
+        print("Scaled columns:")
+        for row in scaled_metadata:
+            print("{:s}: [{:.0f}, {:.0f}]".format(row["feature"], float(row["minimum"]), float(row["maximum"])))
+        print()
+    else:
+        scaler = None
+
+    addresses = pd.Series(bundle.addresses, name="contract_address")
+
+    print("Extracted values:")
+    print("addresses", addresses.shape)
+    print("features", features.shape)
+    print("labels_binary", bundle.labels_binary.shape)
+    print("labels_multi", bundle.labels_multi.shape)
+
+    return addresses, features, bundle.labels_binary, bundle.labels_multi, scaler, feature_names
+
+
 def compute_scale_pos_weight(labels_binary):
     """
     Calculate the scale_pos_weight parameter for XGBoost when the dataset is imbalanced.